@@ -0,0 +1,101 @@
+import argparse
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+import requests
+
+SERVER_URL = "http://127.0.0.1:5000"
+
+
+def wait_for_server(server_url, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f"{server_url}/verify_match_key", params={"match_key": "-"}, timeout=1)
+            return True
+        except requests.exceptions.RequestException:
+            time.sleep(0.2)
+    return False
+
+
+def drone_client(server_url, match_key, tag_count, deadline, verify_every, latencies, errors):
+    """Stands in for one transmitter hammering /decode (and now and then /verify_match_key)."""
+    session = requests.Session()
+    n = 0
+    while time.monotonic() < deadline:
+        n += 1
+        start = time.perf_counter()
+        try:
+            if verify_every and n % verify_every == 0:
+                r = session.get(f"{server_url}/verify_match_key", params={"match_key": match_key}, timeout=5)
+            else:
+                r = session.get(f"{server_url}/decode",
+                                params={"tag_id": str(random.randint(1, tag_count)), "match_key": match_key},
+                                timeout=5)
+            if r.status_code != 200:
+                errors.append(r.status_code)
+        except requests.exceptions.RequestException as e:
+            errors.append(type(e).__name__)
+        latencies.append(time.perf_counter() - start)
+    session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the decoder server with simulated drones")
+    parser.add_argument("--server", type=str, default=SERVER_URL, help=f"Decoder server URL (default: {SERVER_URL})")
+    parser.add_argument("--spawn", action="store_true", help="Start a local decoder_server.py for the test")
+    parser.add_argument("--threads", type=int, default=16, help="Server worker threads when spawning (default: 16)")
+    parser.add_argument("--clients", type=int, default=12, help="Concurrent simulated drones (default: 12)")
+    parser.add_argument("--duration", type=float, default=10.0, help="Test length in seconds (default: 10)")
+    parser.add_argument("--tags", type=int, default=40, help="Tags in the test match (default: 40)")
+    parser.add_argument("--verify-every", type=int, default=20,
+                        help="Every Nth request is /verify_match_key, 0 for never (default: 20)")
+    args = parser.parse_args()
+
+    server = None
+    if args.spawn:
+        port = args.server.rsplit(":", 1)[-1].strip("/")
+        server = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                "decoder_server.py"),
+                                   "--port", port, "--threads", str(args.threads)])
+    try:
+        if not wait_for_server(args.server):
+            sys.exit(f"Decoder server at {args.server} did not come up")
+
+        match_key = f"load-{random.randint(0, 1 << 30)}"
+        requests.post(f"{args.server}/new_match",
+                      json={"match_key": match_key, "tag_ids": [str(i) for i in range(1, args.tags + 1)]},
+                      timeout=5).raise_for_status()
+
+        latencies = []
+        errors = []
+        deadline = time.monotonic() + args.duration
+        clients = [threading.Thread(target=drone_client,
+                                    args=(args.server, match_key, args.tags, deadline, args.verify_every,
+                                          latencies, errors))
+                   for _ in range(args.clients)]
+        start = time.monotonic()
+        for t in clients:
+            t.start()
+        for t in clients:
+            t.join()
+        elapsed = time.monotonic() - start
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    ms = np.array(latencies) * 1000.0
+    print(f"{args.clients} clients, {len(latencies)} requests in {elapsed:.1f} s: {len(latencies) / elapsed:.0f} req/s")
+    print(f"latency p50 {np.percentile(ms, 50):.2f} ms  p90 {np.percentile(ms, 90):.2f} ms  "
+          f"p99 {np.percentile(ms, 99):.2f} ms  max {ms.max():.2f} ms")
+    print(f"errors: {len(errors)}")
+
+
+if __name__ == "__main__":
+    main()
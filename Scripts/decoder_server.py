@@ -1,20 +1,382 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
-import random
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import queue
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# numpy, sqlite3 and waitress are imported where they are first needed, so the server starts faster.
 
 app = Flask(__name__)
 CORS(app)
 
-match_mappings = {}
+MISSING = -32768
 
-def generate_mapping(match_key, tag_ids, min_points=5, max_points=50, mine_chance=0.1, mine_value=-45):
-    mapping = {}
-    for tid in tag_ids:
-        if random.random() < mine_chance:
-            mapping[tid] = mine_value
-        else:
-            mapping[tid] = random.randint(min_points, max_points)
-    match_mappings[match_key] = mapping
+
+def canonical_id(tag_id):
+    """True for tag IDs that are plain decimal numbers, so "7" but not "007" or "+7"."""
+    return tag_id.isdigit() and str(int(tag_id)) == tag_id
+
+
+class MatchMapping:
+    """Read-only tag_id -> points mapping of one match.
+
+    Numeric tag IDs (the usual case) are stored in an int16 array indexed by
+    ID; anything else, including IDs like "007", falls back to a dict keyed
+    by the ID as given. Lookups are O(1) either way. The
+    /decode body of every tag is built once here, so the hot path does no
+    JSON work and nothing is written after construction.
+    """
+
+    def __init__(self, mapping, created=None):
+        self.created = time.time() if created is None else created
+        self.count = len(mapping)
+        self.points = None
+        self.extra = {}
+        numeric = {int(tid): pts for tid, pts in mapping.items() if canonical_id(str(tid)) and int(tid) < 65536
+                   and -32768 < int(pts) < 32768 and int(pts) == pts}
+        if numeric:
+            self.points = array("h", [MISSING]) * (max(numeric) + 1)
+            for tid, pts in numeric.items():
+                self.points[tid] = int(pts)
+        for tid, pts in mapping.items():
+            if not (canonical_id(str(tid)) and int(tid) in numeric):
+                self.extra[str(tid)] = pts
+        self.responses = {tid: json.dumps({"tag_id": tid, "points": pts}).encode("utf-8")
+                          for tid, pts in self.to_dict().items()}
+
+    def get(self, tag_id):
+        tag_id = str(tag_id)
+        if self.points is not None and canonical_id(tag_id):
+            index = int(tag_id)
+            if index < len(self.points) and self.points[index] != MISSING:
+                return self.points[index]
+        return self.extra.get(tag_id)
+
+    def __contains__(self, tag_id):
+        return self.get(tag_id) is not None
+
+    def response(self, tag_id):
+        """Returns the precomputed /decode body for tag_id, or None for unknown tags."""
+        return self.responses.get(tag_id)
+
+    def to_dict(self):
+        mapping = {}
+        if self.points is not None:
+            mapping.update({str(tid): pts for tid, pts in enumerate(self.points) if pts != MISSING})
+        mapping.update(self.extra)
+        return mapping
+
+
+class MemoryMatchStore:
+    """In-memory match store with LRU eviction beyond max_matches and a per-match TTL.
+
+    Mappings are never mutated after creation, only replaced under the lock.
+    """
+
+    def __init__(self, max_matches=1000, ttl=None):
+        self.max_matches = max_matches
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.matches = OrderedDict()
+
+    def expired(self, mapping):
+        return self.ttl is not None and time.time() - mapping.created > self.ttl
+
+    def put(self, match_key, mapping):
+        with self.lock:
+            self.matches[match_key] = mapping
+            self.matches.move_to_end(match_key)
+            while len(self.matches) > self.max_matches:
+                self.matches.popitem(last=False)
+
+    def get(self, match_key):
+        with self.lock:
+            mapping = self.matches.get(match_key)
+            if mapping is None:
+                return None
+            if self.expired(mapping):
+                del self.matches[match_key]
+                return None
+            self.matches.move_to_end(match_key)
+            return mapping
+
+    def delete(self, match_key):
+        with self.lock:
+            return self.matches.pop(match_key, None) is not None
+
+    def __contains__(self, match_key):
+        return self.get(match_key) is not None
+
+
+class SQLiteMatchStore(MemoryMatchStore):
+    """Write-through SQLite persistence on top of the in-memory store.
+
+    Matches survive restarts: unexpired matches are reloaded on startup and
+    matches evicted from memory are read back from disk on the next lookup.
+    Keys found on neither are remembered for negative_ttl seconds, so a drone
+    retrying with a wrong key does not hit the database on every request.
+    """
+
+    def __init__(self, path, max_matches=1000, ttl=None, negative_ttl=5.0, max_missing=10000):
+        import sqlite3
+
+        super().__init__(max_matches, ttl)
+        self.negative_ttl = negative_ttl
+        self.max_missing = max_missing
+        self.missing = OrderedDict()
+        self.puts = 0
+        self.db_lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS matches (match_key TEXT PRIMARY KEY, created REAL, mapping TEXT)")
+        if ttl is not None:
+            self.db.execute("DELETE FROM matches WHERE created < ?", (time.time() - ttl,))
+        self.db.commit()
+
+        rows = self.db.execute("SELECT match_key, created, mapping FROM matches ORDER BY created DESC LIMIT ?",
+                               (max_matches,)).fetchall()
+        for match_key, created, mapping in reversed(rows):
+            super().put(match_key, MatchMapping(json.loads(mapping), created))
+
+    def put(self, match_key, mapping):
+        with self.db_lock:
+            self.db.execute("INSERT OR REPLACE INTO matches VALUES (?, ?, ?)",
+                            (match_key, mapping.created, json.dumps(mapping.to_dict())))
+            self.db.commit()
+        super().put(match_key, mapping)
+        with self.lock:
+            self.puts += 1
+            self.missing.pop(match_key, None)
+
+    def known_missing(self, match_key):
+        with self.lock:
+            expires = self.missing.get(match_key)
+            if expires is None:
+                return False
+            if time.monotonic() < expires:
+                return True
+            del self.missing[match_key]
+            return False
+
+    def remember_missing(self, match_key, puts):
+        with self.lock:
+            if puts != self.puts:
+                return  # A match was stored since the lookup started; it may be this one.
+            self.missing[match_key] = time.monotonic() + self.negative_ttl
+            self.missing.move_to_end(match_key)
+            while len(self.missing) > self.max_missing:
+                self.missing.popitem(last=False)
+
+    def get(self, match_key):
+        mapping = super().get(match_key)
+        if mapping is not None:
+            return mapping
+        if self.known_missing(match_key):
+            return None
+
+        puts = self.puts
+        with self.db_lock:
+            row = self.db.execute("SELECT created, mapping FROM matches WHERE match_key = ?", (match_key,)).fetchone()
+        if row is None:
+            self.remember_missing(match_key, puts)
+            return None
+        mapping = MatchMapping(json.loads(row[1]), row[0])
+        if self.expired(mapping):
+            with self.db_lock:
+                self.db.execute("DELETE FROM matches WHERE match_key = ?", (match_key,))
+                self.db.commit()
+            return None
+        super().put(match_key, mapping)
+        return mapping
+
+    def delete(self, match_key):
+        with self.db_lock:
+            deleted = self.db.execute("DELETE FROM matches WHERE match_key = ?", (match_key,)).rowcount
+            self.db.commit()
+        return super().delete(match_key) or bool(deleted)
+
+
+def canonical_json(payload):
+    return json.dumps(payload, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+def sign(secret, data):
+    return hmac.new(secret.encode("utf-8"), data, hashlib.sha256).hexdigest()
+
+def subscribe_token(secret, match_key, drone):
+    """Credential a transmitter presents to /subscribe, so the shared secret itself never goes over the wire."""
+    return sign(secret, f"subscribe\n{match_key}\n{drone}".encode("utf-8"))
+
+
+class BundleHub:
+    """Pushes signed per-match mapping bundles to subscribed transmitters as server-sent events.
+
+    A subscriber gets the current bundle on connect (or as soon as the match
+    is created) and every rotation or revocation after that. Each event is
+    HMAC-SHA256 signed with the secret shared with the transmitters.
+    Streams are served by start_push_server, outside the request workers.
+    """
+
+    def __init__(self, secret=None, keepalive=15.0, max_pending=16, max_subscribers=256):
+        self.secret = secret
+        self.keepalive = keepalive
+        self.max_pending = max_pending
+        self.max_subscribers = max_subscribers
+        self.push_port = None
+        self.lock = threading.Lock()
+        self.subscribers = {}
+
+    def check(self, match_key, drone, authorization):
+        """Returns None when the subscription may go ahead, else (status, error)."""
+        if not match_key:
+            return 400, "Missing match_key"
+        if not self.secret or self.push_port is None:
+            return 404, "Mapping push is disabled on this server"
+        token = (authorization or "").removeprefix("Bearer ")
+        if not hmac.compare_digest(token, subscribe_token(self.secret, match_key, drone)):
+            return 403, "Invalid subscription token"
+        if self.subscriber_count() >= self.max_subscribers:
+            return 503, "Too many subscribers"
+        return None
+
+    def signed(self, payload):
+        return json.dumps({"payload": payload, "signature": sign(self.secret, canonical_json(payload))})
+
+    def bundle(self, match_key, mapping):
+        expires = mapping.created + store.ttl if store.ttl is not None else None
+        return self.signed({"match_key": match_key, "version": int(mapping.created * 1e6), "issued": time.time(),
+                            "expires": expires, "mapping": mapping.to_dict()})
+
+    def publish(self, match_key, event, data):
+        with self.lock:
+            subscribers = list(self.subscribers.get(match_key, ()))
+        for q in subscribers:
+            try:
+                q.put_nowait((event, data))
+            except queue.Full:
+                pass  # A stuck subscriber misses the event and resyncs when it reconnects.
+
+    def mapping_changed(self, match_key, mapping):
+        if self.secret:
+            self.publish(match_key, "mapping", self.bundle(match_key, mapping))
+
+    def revoke(self, match_key):
+        if self.secret:
+            self.publish(match_key, "revoke", self.signed({"match_key": match_key, "revoked": time.time()}))
+
+    def stream(self, match_key):
+        q = queue.Queue(maxsize=self.max_pending)
+        with self.lock:
+            self.subscribers.setdefault(match_key, set()).add(q)
+        try:
+            yield "retry: 2000\n\n"
+            mapping = store.get(match_key)
+            if mapping is not None:
+                yield f"event: mapping\ndata: {self.bundle(match_key, mapping)}\n\n"
+            while True:
+                try:
+                    event, data = q.get(timeout=self.keepalive)
+                except queue.Empty:
+                    yield ": ping\n\n"
+                    continue
+                yield f"event: {event}\ndata: {data}\n\n"
+        finally:
+            with self.lock:
+                self.subscribers[match_key].discard(q)
+                if not self.subscribers[match_key]:
+                    del self.subscribers[match_key]
+
+    def subscriber_count(self):
+        with self.lock:
+            return sum(len(s) for s in self.subscribers.values())
+
+
+def start_push_server(host, port):
+    """Serves the /subscribe event streams from daemon threads, one per subscriber.
+
+    Subscribers stay connected for the whole match, so they must not hold
+    the waitress workers that answer /decode, /new_match and /revoke_match.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        # Chunked encoding, so clients get every event as it is written instead of buffering reads.
+        protocol_version = "HTTP/1.1"
+
+        def reply_error(self, status, error):
+            body = json.dumps({"error": error}).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            if url.path != "/subscribe":
+                self.reply_error(404, "Not found")
+                return
+            args = parse_qs(url.query)
+            match_key = args.get("match_key", [None])[0]
+            refused = hub.check(match_key, args.get("drone", [""])[0], self.headers.get("Authorization"))
+            if refused:
+                self.reply_error(*refused)
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            self.close_connection = True
+            events = hub.stream(match_key)
+            try:
+                for chunk in events:
+                    data = chunk.encode("utf-8")
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                    self.wfile.flush()
+            except OSError:
+                pass  # The subscriber went away; the next write after an event or ping notices.
+            finally:
+                events.close()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="bundle-push", daemon=True).start()
+    hub.push_port = server.server_address[1]
+    return server
+
+
+store = MemoryMatchStore()
+hub = BundleHub(os.environ.get("DECODER_BUNDLE_SECRET"))
+
+def match_rng(match_key, seed=None):
+    """Per-match random stream: reproducible from (seed, match_key), independent of creation order."""
+    import numpy as np
+
+    if seed is None:
+        return np.random.default_rng()
+    key = int.from_bytes(hashlib.sha256(match_key.encode("utf-8")).digest()[:8], "little")
+    return np.random.default_rng(np.random.SeedSequence(int(seed), spawn_key=(key,)))
+
+def generate_mapping(match_key, tag_ids, min_points=5, max_points=50, mine_chance=0.1, mine_value=-45, seed=None):
+    rng = match_rng(match_key, seed)
+    points = rng.integers(min_points, max_points, size=len(tag_ids), endpoint=True)
+    points[rng.random(len(tag_ids)) < mine_chance] = mine_value
+
+    mapping = dict(zip(tag_ids, points.tolist()))
+    match_mapping = MatchMapping(mapping)
+    store.put(match_key, match_mapping)
+    hub.mapping_changed(match_key, match_mapping)
     return mapping
 
 @app.route("/decode", methods=["GET"])
@@ -25,14 +387,43 @@ def decode():
     if not tag_id or not match_key:
         return jsonify({"error": "Missing tag_id or match_key"}), 400
 
-    if match_key not in match_mappings:
+    mapping = store.get(match_key)
+    if mapping is None:
         return jsonify({"error": "Invalid or expired match key"}), 403
 
-    mapping = match_mappings[match_key]
-    if tag_id not in mapping:
+    body = mapping.response(tag_id)
+    if body is None:
         return jsonify({"error": "Unknown tag_id"}), 404
 
-    return jsonify({"tag_id": tag_id, "points": mapping[tag_id]})
+    return Response(body, mimetype="application/json")
+
+@app.route("/decode_batch", methods=["POST"])
+def decode_batch():
+    """Resolve many tag IDs of one match in a single request"""
+    data = request.get_json(silent=True) or {}
+    match_key = data.get("match_key")
+    tag_ids = data.get("tag_ids")
+
+    if not match_key or not isinstance(tag_ids, list):
+        return jsonify({"error": "Missing match_key or tag_ids"}), 400
+
+    mapping = store.get(match_key)
+    if mapping is None:
+        return jsonify({"error": "Invalid or expired match key"}), 403
+
+    points = {}
+    unknown = []
+    for tid in tag_ids:
+        tid = str(tid)
+        value = mapping.get(tid)
+        if value is not None:
+            points[tid] = value
+        else:
+            unknown.append(tid)
+
+    return jsonify({"match_key": match_key, "points": points, "unknown": unknown})
+
+MAPPING_OPTIONS = ("min_points", "max_points", "mine_chance", "mine_value")
 
 @app.route("/new_match", methods=["POST"])
 def new_match():
@@ -44,23 +435,121 @@ def new_match():
     if not match_key or not tag_ids:
         return jsonify({"error": "Missing match_key or tag_ids"}), 400
 
-    mapping = generate_mapping(match_key, tag_ids)
+    options = {name: data[name] for name in MAPPING_OPTIONS if name in data}
+    mapping = generate_mapping(match_key, tag_ids, seed=data.get("seed"), **options)
     return jsonify({
         "match_key": match_key,
         "mapping": mapping,
         "tag_count": len(mapping)
     })
 
+@app.route("/new_matches", methods=["POST"])
+def new_matches():
+    """Admin endpoint to create many matches (e.g. a whole bracket) in one request"""
+    data = request.get_json(silent=True) or {}
+    matches = data.get("matches")
+    if not isinstance(matches, list) or not matches:
+        return jsonify({"error": "Missing matches"}), 400
+    if any(not isinstance(m, dict) or not m.get("match_key") or not isinstance(m["match_key"], str)
+           or not m.get("tag_ids") or not isinstance(m["tag_ids"], list) for m in matches):
+        return jsonify({"error": "Every match needs a match_key string and a tag_ids list"}), 400
+
+    defaults = {name: data[name] for name in MAPPING_OPTIONS if name in data}
+    created = []
+    for m in matches:
+        options = dict(defaults, **{name: m[name] for name in MAPPING_OPTIONS if name in m})
+        mapping = generate_mapping(m["match_key"], m["tag_ids"], seed=m.get("seed", data.get("seed")), **options)
+        entry = {"match_key": m["match_key"], "tag_count": len(mapping)}
+        if data.get("include_mappings", True):
+            entry["mapping"] = mapping
+        created.append(entry)
+
+    return jsonify({"matches": created, "match_count": len(created)})
+
 @app.route("/verify_match_key", methods=["GET"])
 def verify_match_key():
     match_key = request.args.get("match_key")
     if not match_key:
         return jsonify({"error": "Missing match_key"}), 400
 
-    if match_key in match_mappings:
+    if match_key in store:
         return jsonify({"valid": True}), 200
     else:
         return jsonify({"valid": False}), 404
 
+@app.route("/revoke_match", methods=["POST"])
+def revoke_match():
+    """Admin endpoint to end a match: forgets its mapping and tells subscribed transmitters to drop theirs"""
+    data = request.get_json(silent=True) or {}
+    match_key = data.get("match_key")
+    if not match_key:
+        return jsonify({"error": "Missing match_key"}), 400
+
+    deleted = store.delete(match_key)
+    hub.revoke(match_key)
+    return jsonify({"match_key": match_key, "revoked": deleted})
+
+@app.route("/subscribe", methods=["GET"])
+def subscribe():
+    """Redirect to the push server, which streams signed mapping bundles for one match"""
+    refused = hub.check(request.args.get("match_key"), request.args.get("drone", ""),
+                        request.headers.get("Authorization"))
+    if refused:
+        status, error = refused
+        return jsonify({"error": error}), status
+
+    # Streams are long-lived, so they are served off the worker pool on their own port.
+    host = urlsplit(request.host_url).hostname
+    location = f"{request.scheme}://{f'[{host}]' if ':' in host else host}:{hub.push_port}/subscribe"
+    return Response(status=307, headers={"Location": f"{location}?{request.query_string.decode('ascii')}"})
+
+def main():
+    global store
+    parser = argparse.ArgumentParser(description="Tag decoder server")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=5000, help="Port to listen on (default: 5000)")
+    parser.add_argument("--threads", type=int, default=16, help="Worker threads serving requests (default: 16)")
+    parser.add_argument("--dev", action="store_true", help="Use the Flask development server")
+    parser.add_argument("--store", choices=["memory", "sqlite"], default="memory",
+                        help="Keep matches in memory only or also persist them to SQLite (default: memory)")
+    parser.add_argument("--db", type=str, default="matches.db", help="SQLite file for --store sqlite (default: matches.db)")
+    parser.add_argument("--max-matches", type=int, default=1000,
+                        help="Matches kept in memory before the least recently used is evicted (default: 1000)")
+    parser.add_argument("--match-ttl", type=float, default=24 * 3600,
+                        help="Seconds after creation when a match expires, 0 to keep forever (default: 86400)")
+    parser.add_argument("--bundle-secret", type=str, default=os.environ.get("DECODER_BUNDLE_SECRET"),
+                        help="Secret shared with the transmitters; enables /subscribe mapping push "
+                             "(default: $DECODER_BUNDLE_SECRET)")
+    parser.add_argument("--push-port", type=int,
+                        help="Port of the mapping push streams that /subscribe redirects to (default: --port + 1)")
+    parser.add_argument("--max-subscribers", type=int, default=256,
+                        help="Mapping push subscribers served at once, one thread each (default: 256)")
+    args = parser.parse_args()
+
+    hub.secret = args.bundle_secret
+    hub.max_subscribers = args.max_subscribers
+    if hub.secret:
+        push_port = args.push_port or args.port + 1
+        start_push_server(args.host, push_port)
+        print(f"Mapping push on http://{args.host}:{push_port}/subscribe")
+    ttl = args.match_ttl or None
+    if args.store == "sqlite":
+        store = SQLiteMatchStore(args.db, max_matches=args.max_matches, ttl=ttl)
+        print(f"Loaded {len(store.matches)} matches from {args.db}")
+    else:
+        store = MemoryMatchStore(max_matches=args.max_matches, ttl=ttl)
+
+    try:
+        from waitress import serve
+    except ImportError:
+        serve = None
+    if serve is None or args.dev:
+        if not args.dev:
+            print("waitress is not installed, falling back to the Flask development server")
+        app.run(host=args.host, port=args.port, threaded=True)
+    else:
+        print(f"Serving on http://{args.host}:{args.port} with {args.threads} threads")
+        serve(app, host=args.host, port=args.port, threads=args.threads)
+
 if __name__ == "__main__":
-    app.run(host="127.0.0.1", port=5000)
+    main()
@@ -0,0 +1,204 @@
+import argparse
+import json
+import math
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from unity_transmitter import (TAGS_DIR, CameraModel, SimulatedDrone, TagDetector, TagField, ground_texture,
+                               init_drone_state, load_tag_images, localize_tags, project_tags, render_scene,
+                               render_view)
+
+
+def synthetic_frames(args):
+    """Independent random scenes: every frame is new, so nothing can be carried over between frames."""
+    rng = np.random.default_rng(args.seed)
+    tags = load_tag_images(args.tags_dir)
+    if not tags:
+        sys.exit(f"No tag36h11-*.svg files found in {args.tags_dir}")
+    for _ in range(args.frames):
+        frame, truth = render_scene(rng, tags, args.width, args.height, args.count, args.min_size, args.max_size,
+                                    args.rotation, args.blur, args.noise)
+        yield frame, truth, None
+
+
+def flight_frames(args):
+    """Consecutive camera frames of a simulated drone flying over the tag field, as the transmitter sees them."""
+    field = TagField(args.layout, tags_dir=args.tags_dir)
+    camera = CameraModel(args.width, args.height, hfov=args.camera_hfov)
+    drone = SimulatedDrone(args.trajectory, field, speed=args.sim_speed, altitude=args.altitude, seed=args.seed)
+    background = ground_texture(args.width, args.height, seed=args.seed)
+    for i in range(args.frames):
+        pose = drone.pose(i / args.fps)
+        # Tags cut by the frame edge are not expected, as in drone_simulator.py. Each carries its field
+        # position so localization is checked against the ground truth.
+        truth = [(tag["id"], *corners.mean(axis=0), tag["x"], tag["y"])
+                 for tag, corners in project_tags(field, pose, camera)
+                 if (corners >= 0).all() and (corners[:, 0] < args.width).all()
+                 and (corners[:, 1] < args.height).all()]
+        yield render_view(field, pose, camera, background), truth, pose
+
+
+def video_frames(paths, limit):
+    for path in paths:
+        cap = cv2.VideoCapture(path)
+        if not cap.isOpened():
+            sys.exit(f"Could not open video {path}")
+        n = 0
+        while limit <= 0 or n < limit:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            n += 1
+            yield frame, None, None
+        cap.release()
+
+
+def percentiles(samples):
+    if not samples:
+        return {}
+    p50, p90, p99 = np.percentile(np.array(samples) * 1000.0, [50, 90, 99])
+    return {"mean_ms": float(np.mean(samples) * 1000.0), "p50_ms": float(p50), "p90_ms": float(p90),
+            "p99_ms": float(p99)}
+
+
+def run(frames, detector, match_radius=5.0, camera_options=None):
+    """Pushes frames through the transmitter's grayscale -> detect -> localize path."""
+    drone_state = init_drone_state()
+    drone_state.update({"x": 0.0, "y": 0.0, "z": -10.0, "roll": 0.0, "pitch": 0.0, "yaw": 0.0})
+    camera = None
+
+    stages = {"gray": [], "detect": [], "localize": [], "total": []}
+    expected = matched = false_positives = 0
+    pixel_errors = []
+    world_errors = []
+    n_frames = 0
+
+    start = time.perf_counter()
+    for frame, truth, pose in frames:
+        state = dict(drone_state, **pose) if pose else drone_state
+        t0 = time.perf_counter()
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if camera is None:
+            camera = CameraModel(gray.shape[1], gray.shape[0], **(camera_options or {}))
+        t1 = time.perf_counter()
+        detections = detector.detect(gray, camera, pose)
+        t2 = time.perf_counter()
+        positions = localize_tags(detections, state, camera)
+        t3 = time.perf_counter()
+
+        stages["gray"].append(t1 - t0)
+        stages["detect"].append(t2 - t1)
+        stages["localize"].append(t3 - t2)
+        stages["total"].append(t3 - t0)
+        n_frames += 1
+
+        if truth is None:
+            continue
+        expected += len(truth)
+        remaining = list(truth)
+        for det, (x, y, _) in zip(detections, positions):
+            hit = next((t for t in remaining if t[0] == det.tag_id
+                        and math.hypot(det.center[0] - t[1], det.center[1] - t[2]) <= match_radius), None)
+            if hit is None:
+                false_positives += 1
+                continue
+            remaining.remove(hit)
+            matched += 1
+            pixel_errors.append(math.hypot(det.center[0] - hit[1], det.center[1] - hit[2]))
+            if len(hit) > 3:
+                world_errors.append(math.hypot(x - hit[3], y - hit[4]))
+    elapsed = time.perf_counter() - start
+
+    report = {
+        "frames": n_frames,
+        "fps": n_frames / elapsed if elapsed > 0 else 0.0,
+        "stages": {name: percentiles(samples) for name, samples in stages.items()},
+    }
+    if expected:
+        report.update({
+            "expected_tags": expected,
+            "recall": matched / expected,
+            "false_positives": false_positives,
+            "center_error_px": {"mean": float(np.mean(pixel_errors)) if pixel_errors else None,
+                                "p99": float(np.percentile(pixel_errors, 99)) if pixel_errors else None},
+            "world_error": {"mean": float(np.mean(world_errors)) if world_errors else None,
+                            "p99": float(np.percentile(world_errors, 99)) if world_errors else None},
+        })
+    return report
+
+
+def print_report(report):
+    print(f"frames: {report['frames']}  fps: {report['fps']:.1f}")
+    for name, stats in report["stages"].items():
+        if stats:
+            print(f"  {name:<9} mean {stats['mean_ms']:7.2f} ms  p50 {stats['p50_ms']:7.2f}  "
+                  f"p90 {stats['p90_ms']:7.2f}  p99 {stats['p99_ms']:7.2f}")
+    if "recall" in report:
+        print(f"recall: {report['recall']:.3f} ({report['expected_tags']} tags)  "
+              f"false positives: {report['false_positives']}")
+        err = report["center_error_px"]
+        if err["mean"] is not None:
+            print(f"center error: mean {err['mean']:.2f} px  p99 {err['p99']:.2f} px")
+        err = report["world_error"]
+        if err["mean"] is not None:
+            print(f"world error: mean {err['mean']:.4f} m  p99 {err['p99']:.4f} m")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline AprilTag detection benchmark (no camera, Unity or drone)")
+    parser.add_argument("--video", action="append", help="Replay a recorded video instead of synthetic frames (repeatable)")
+    parser.add_argument("--scene", choices=["flight", "random"], default="flight",
+                        help="Synthetic frames: consecutive frames of a simulated flight over the tag field, or "
+                             "independent random scenes (default: flight)")
+    parser.add_argument("--frames", type=int, default=200, help="Synthetic frames, or max frames per video (default: 200)")
+    parser.add_argument("--tags-dir", type=str, default=TAGS_DIR, help="Directory with tag36h11-*.svg files")
+    parser.add_argument("--trajectory", type=str, default="lawnmower",
+                        help="Flight scene: hover, circle[:radius], lawnmower[:spacing], random[:seed] or "
+                             "waypoints:file.json (default: lawnmower)")
+    parser.add_argument("--layout", type=str, help="Flight scene: JSON tag layout (default: grid of the Tags/ tags)")
+    parser.add_argument("--fps", type=float, default=10.0, help="Flight scene: camera FPS (default: 10)")
+    parser.add_argument("--sim-speed", type=float, default=3.0, help="Flight scene: ground speed in m/s (default: 3)")
+    parser.add_argument("--altitude", type=float, default=8.0, help="Flight scene: altitude in meters (default: 8)")
+    parser.add_argument("--width", type=int, default=1280, help="Synthetic frame width (default: 1280)")
+    parser.add_argument("--height", type=int, default=720, help="Synthetic frame height (default: 720)")
+    parser.add_argument("--count", type=int, default=4, help="Random scene: tags per frame (default: 4)")
+    parser.add_argument("--min-size", type=float, default=40, help="Random scene: smallest tag edge in pixels (default: 40)")
+    parser.add_argument("--max-size", type=float, default=200, help="Random scene: largest tag edge in pixels (default: 200)")
+    parser.add_argument("--rotation", type=float, default=180.0, help="Random scene: max tag rotation in degrees (default: 180)")
+    parser.add_argument("--blur", type=float, default=0.0, help="Random scene: Gaussian blur sigma in pixels (default: 0)")
+    parser.add_argument("--noise", type=float, default=0.0, help="Random scene: Gaussian noise sigma in gray levels (default: 0)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for synthetic frames (default: 0)")
+    parser.add_argument("--detect-mode", choices=["full", "adaptive"], default="full")
+    parser.add_argument("--quad-decimate", type=float, default=2.0)
+    parser.add_argument("--apriltag-nthreads", type=int, default=1)
+    parser.add_argument("--decode-sharpening", type=float, default=0.25)
+    parser.add_argument("--sweep-interval", type=int, default=10)
+    parser.add_argument("--camera-hfov", type=float, default=78.0)
+    parser.add_argument("--json", type=str, help="Also write the report as JSON to this file")
+    parser.add_argument("--min-fps", type=float, default=0.0, help="Exit with status 1 below this FPS")
+    parser.add_argument("--min-recall", type=float, default=0.0, help="Exit with status 1 below this recall")
+    args = parser.parse_args()
+
+    detector = TagDetector(mode=args.detect_mode, quad_decimate=args.quad_decimate, nthreads=args.apriltag_nthreads,
+                           decode_sharpening=args.decode_sharpening, sweep_interval=args.sweep_interval)
+    if args.video:
+        frames = video_frames(args.video, args.frames)
+    else:
+        # Render up front so scene synthesis is not counted as pipeline time.
+        frames = list(flight_frames(args) if args.scene == "flight" else synthetic_frames(args))
+
+    report = run(frames, detector, camera_options={"hfov": args.camera_hfov})
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    failed = report["fps"] < args.min_fps or report.get("recall", 1.0) < args.min_recall
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
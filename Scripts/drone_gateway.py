@@ -0,0 +1,381 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from unity_transmitter import CompactDecoder, CompactEncoder, JsonEncoder, UnityWriter, wait_for_unity
+
+
+class StreamParser:
+    """Splits a transmitter stream into messages.
+
+    Transmitters always start with JSON lines (the connect LOG, maybe a HELLO)
+    and may continue with CompactEncoder records. JSON lines start with "{"
+    and compact records with a kind byte below it, so no state is needed to
+    tell them apart.
+    """
+
+    def __init__(self):
+        self.buffer = b""
+        self.decoder = None
+
+    def feed(self, data):
+        if self.decoder is not None:
+            return self.decoder.feed(data)
+        self.buffer += data
+        messages = []
+        while self.buffer:
+            if not self.buffer.startswith(b"{"):
+                self.decoder = CompactDecoder()
+                messages += self.decoder.feed(self.buffer)
+                self.buffer = b""
+                break
+            end = self.buffer.find(b"\n")
+            if end < 0:
+                break
+            line, self.buffer = self.buffer[:end], self.buffer[end + 1:]
+            messages.append(json.loads(line.decode("utf-8")))
+        return messages
+
+
+class TokenBucket:
+    """Allows rate events per second with a one second burst; a rate of 0 allows everything."""
+
+    def __init__(self, rate, now=None):
+        self.rate = rate
+        self.tokens = rate
+        self.refilled = time.monotonic() if now is None else now
+
+    def allow(self, now):
+        if not self.rate:
+            return True
+        self.tokens = min(self.rate, self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+        if self.tokens < 1.0:
+            return False
+        self.tokens -= 1.0
+        return True
+
+
+class DroneLink:
+    """One connected transmitter: its assigned drone ID, pending state and health counters."""
+
+    def __init__(self, peer, message_rate):
+        self.peer = peer
+        self.drone_id = None
+        self.claimed = None
+        self.connected_at = time.monotonic()
+        self.last_seen = self.connected_at
+        self.last_drone = None
+        self.last_state = None
+        self.pending_drone = None
+        self.events = []
+        self.early = []
+        self.received = {}
+        self.bytes = 0
+        self.rate_limited = 0
+        self.bucket = TokenBucket(message_rate, self.connected_at)
+        self.previous = (self.connected_at, 0, {})
+
+    def allow(self, now):
+        """Token bucket for non-DRONE messages, message_rate per second."""
+        if self.bucket.allow(now):
+            return True
+        self.rate_limited += 1
+        return False
+
+    def health(self, now, reconnects):
+        since, prev_bytes, prev_received = self.previous
+        elapsed = max(now - since, 1e-6)
+        rates = {mtype: round((n - prev_received.get(mtype, 0)) / elapsed, 1) for mtype, n in self.received.items()}
+        health = {
+            "id": self.drone_id,
+            "claimed": self.claimed,
+            "peer": self.peer,
+            "connected_s": round(now - self.connected_at, 1),
+            "last_seen_ms": int((now - self.last_seen) * 1000),
+            "drone_age_ms": int((now - self.last_drone) * 1000) if self.last_drone else None,
+            "rates": rates,
+            "kbytes_s": round((self.bytes - prev_bytes) / elapsed / 1024.0, 1),
+            "rate_limited": self.rate_limited,
+            "reconnects": reconnects,
+        }
+        if self.pending_drone or self.last_state:
+            state = self.pending_drone or self.last_state
+            health.update({name: state.get(name) for name in ("armed", "flight_mode", "battery_percentage", "rssi")})
+        self.previous = (now, self.bytes, dict(self.received))
+        return health
+
+
+class Gateway:
+    """Fans many transmitter streams into one Admin Terminal connection.
+
+    Each transmitter's first DRONE message claims a drone ID. The claim is
+    kept when it is free (and listed in ids, if given), otherwise the lowest
+    free ID is assigned, or with strict the connection is refused. DRONE
+    states are forwarded at most drone_rate times a second per drone, other
+    messages through a per-drone token bucket, and TAG/LOG messages are
+    tagged with the drone they came from.
+
+    The whole output is capped at output_rate messages a second, because the
+    Admin Terminal reads one line per rendered frame and a backlog only ends
+    in dropped messages. Half of it goes to DRONE states, shared by all
+    drones, so each drone's update rate falls as more connect; the rest is a
+    common bucket for TAG and LOG messages. The current terminal also draws
+    every DRONE message on one drone object, so drones are told apart only
+    by the "id" field, by tools such as the GATEWAY health messages.
+    """
+
+    DRONE_SHARE = 0.5
+
+    def __init__(self, writer, ids=None, strict=False, drone_rate=10.0, message_rate=50.0, wire="compact",
+                 health_interval=2.0, quiet=False, output_rate=60.0):
+        self.writer = writer
+        self.ids = ids
+        self.strict = strict
+        self.drone_rate = drone_rate
+        self.message_rate = message_rate
+        self.output_rate = output_rate
+        self.output = TokenBucket(output_rate * (1.0 - self.DRONE_SHARE))
+        self.output_limited = 0
+        self.wire = wire
+        self.health_interval = health_interval
+        self.quiet = quiet
+        self.links = {}
+        self.reconnects = {}
+
+    def log(self, text, severity=3):
+        if not self.quiet:
+            print(f"[LOG-{severity}] {text}")
+        self.writer.submit({"type": "LOG", "severity": severity, "text": text, "timestamp": int(time.time() * 1000)})
+
+    def assign(self, claimed):
+        allowed = claimed is not None and claimed not in self.links and (self.ids is None or claimed in self.ids)
+        if allowed:
+            return claimed
+        if self.strict:
+            return None
+        candidates = self.ids if self.ids is not None else range(1, 65536)
+        return next((i for i in candidates if i not in self.links), None)
+
+    def forward(self, link, msg, now):
+        mtype = msg.get("type")
+        if mtype == "HELLO":
+            return
+        if link.drone_id is None and mtype != "DRONE":
+            if len(link.early) < 256:
+                link.early.append(msg)
+            return
+
+        if mtype == "DRONE":
+            if link.drone_id is None:
+                return
+            link.last_drone = now
+            link.events += msg.get("messages") or []
+            link.pending_drone = dict(msg, id=link.drone_id)
+            return
+        if mtype == "EVENT":
+            # Compact streams send STATUSTEXT separately; put it back into the next DRONE message.
+            link.events.append({"severity": msg.get("severity"), "text": msg.get("text"),
+                                "timestamp": msg.get("timestamp")})
+            return
+        if not link.allow(now):
+            return
+        if not self.output.allow(now):
+            self.output_limited += 1
+            return
+        self.writer.submit(dict(msg, drone=link.drone_id))
+
+    def register(self, link, claimed):
+        link.claimed = claimed
+        link.drone_id = self.assign(claimed)
+        if link.drone_id is None:
+            return False
+        self.links[link.drone_id] = link
+        if link.drone_id in self.reconnects:
+            self.reconnects[link.drone_id] += 1
+        else:
+            self.reconnects[link.drone_id] = 0
+        note = "" if link.drone_id == claimed else f" (claimed {claimed})"
+        self.log(f"Drone {link.drone_id} connected from {link.peer}{note}")
+        early, link.early = link.early, []
+        for msg in early:
+            self.forward(link, msg, time.monotonic())
+        return True
+
+    async def handle(self, reader, writer):
+        peer = "%s:%s" % writer.get_extra_info("peername")[:2]
+        link = DroneLink(peer, self.message_rate)
+        parser = StreamParser()
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                now = time.monotonic()
+                link.last_seen = now
+                link.bytes += len(data)
+                for msg in parser.feed(data):
+                    mtype = msg.get("type")
+                    link.received[mtype] = link.received.get(mtype, 0) + 1
+                    if mtype == "HELLO":
+                        encoding = self.wire if self.wire in msg.get("encodings", []) else "json"
+                        writer.write((json.dumps({"type": "HELLO", "encoding": encoding}) + "\n").encode("utf-8"))
+                        await writer.drain()
+                    elif mtype == "DRONE" and link.drone_id is None and not self.register(link, msg.get("id")):
+                        self.log(f"Refused drone ID {msg.get('id')} from {peer}", severity=1)
+                        return
+                    self.forward(link, msg, now)
+        except (ConnectionError, ValueError) as e:
+            self.log(f"Stream from {peer} failed: {e}", severity=1)
+        finally:
+            writer.close()
+            if link.drone_id is not None and self.links.get(link.drone_id) is link:
+                self.publish(link)
+                del self.links[link.drone_id]
+                self.log(f"Drone {link.drone_id} disconnected", severity=2)
+
+    def publish(self, link):
+        if link.pending_drone is None:
+            return
+        msg = link.pending_drone
+        if link.events:
+            msg = dict(msg, messages=link.events)
+        self.writer.submit(msg)
+        link.last_state = link.pending_drone
+        link.pending_drone = None
+        link.events = []
+
+    def publish_period(self):
+        """Seconds between DRONE updates of each drone, stretched so all drones fit the output budget."""
+        period = 1.0 / self.drone_rate
+        if self.output_rate:
+            period = max(period, len(self.links) / (self.output_rate * self.DRONE_SHARE))
+        return period
+
+    async def publish_loop(self):
+        while True:
+            await asyncio.sleep(self.publish_period())
+            for link in list(self.links.values()):
+                self.publish(link)
+
+    async def health_loop(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            now = time.monotonic()
+            drones = [link.health(now, self.reconnects.get(drone_id, 0))
+                      for drone_id, link in sorted(self.links.items())]
+            self.writer.submit({"type": "GATEWAY", "timestamp": int(time.time() * 1000), "drones": drones,
+                                "unity": self.writer.stats(), "drone_rate": round(1.0 / self.publish_period(), 2),
+                                "output_limited": self.output_limited})
+            if not self.quiet:
+                summary = ", ".join(f"{d['id']}: {sum(d['rates'].values()):.0f} msg/s" for d in drones)
+                print(f"{len(drones)} drones | {summary} | {1.0 / self.publish_period():.1f} DRONE/s each | "
+                      f"unity queue {self.writer.stats()['queue_depth']}")
+
+
+async def simulated_transmitter(host, port, claimed_id, wire, rate, stop_at):
+    """Minimal stand-in for unity_transmitter.py: random-walk DRONE states plus occasional TAGs."""
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write((json.dumps({"type": "LOG", "severity": 3, "text": "Connected to Unity",
+                              "timestamp": int(time.time() * 1000)}) + "\n").encode("utf-8"))
+    encoder = JsonEncoder()
+    if wire == "auto":
+        writer.write((json.dumps({"type": "HELLO", "encodings": ["compact", "json"]}) + "\n").encode("utf-8"))
+        reply = json.loads(await reader.readline())
+        if reply.get("encoding") == "compact":
+            encoder = CompactEncoder()
+
+    x = y = 0.0
+    battery = 100.0
+    while time.monotonic() < stop_at:
+        x += random.uniform(-0.2, 0.2)
+        y += random.uniform(-0.2, 0.2)
+        battery = max(0.0, battery - 0.01)
+        state = {"type": "DRONE", "id": claimed_id, "x": x, "y": y, "z": -5.0, "pitch": 0.0, "roll": 0.0,
+                 "yaw": 0.0, "timestamp": int(time.time() * 1000), "armable": True, "armed": True,
+                 "battery_voltage": 12.0, "battery_percentage": int(battery), "flight_mode": "GUIDED",
+                 "rssi": 200, "messages": []}
+        data = encoder.encode(state)
+        if random.random() < 0.2:
+            data += encoder.encode({"type": "TAG", "id": random.randint(1, 40), "x": x, "y": y, "z": 0.0,
+                                    "points": None, "sightings": 1, "confidence": 0.5})
+        writer.write(data)
+        await writer.drain()
+        await asyncio.sleep(1.0 / rate)
+    writer.close()
+
+
+async def serve(gateway, host, port, simulate=0, sim_rate=10.0, duration=None):
+    server = await asyncio.start_server(gateway.handle, host, port)
+    print(f"Gateway listening on {host}:{port}")
+    tasks = [asyncio.create_task(gateway.publish_loop()), asyncio.create_task(gateway.health_loop())]
+    try:
+        if simulate:
+            stop_at = time.monotonic() + (duration or 10.0)
+            # Every simulated transmitter claims ID 1 like an unconfigured unity_transmitter.py.
+            await asyncio.gather(*(simulated_transmitter(host, port, 1, "auto" if i % 2 else "json", sim_rate, stop_at)
+                                   for i in range(simulate)))
+            await asyncio.sleep(0.5)
+        elif duration:
+            await asyncio.sleep(duration)
+        else:
+            await server.serve_forever()
+    finally:
+        for task in tasks:
+            task.cancel()
+        server.close()
+
+
+def parse_ids(text):
+    ids = []
+    for part in text.split(","):
+        low, _, high = part.partition("-")
+        ids += range(int(low), int(high or low) + 1)
+    return ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge many transmitters into one Admin Terminal stream")
+    parser.add_argument("--host", type=str, required=True, help="Unity server IP")
+    parser.add_argument("--port", type=int, required=True, help="Unity server port")
+    parser.add_argument("--listen-host", type=str, default="0.0.0.0", help="Address for transmitters (default: 0.0.0.0)")
+    parser.add_argument("--listen-port", type=int, default=5006, help="Port for transmitters (default: 5006)")
+    parser.add_argument("--ids", type=str, help="Allowed drone IDs, e.g. 1-8 or 1,3,5 (default: any)")
+    parser.add_argument("--strict-ids", action="store_true",
+                        help="Refuse transmitters whose claimed ID is taken or not allowed instead of reassigning")
+    parser.add_argument("--drone-rate", type=float, default=10.0,
+                        help="Max DRONE updates per second forwarded per drone, lowered as drones join so they fit "
+                             "--output-rate (default: 10)")
+    parser.add_argument("--message-rate", type=float, default=50.0,
+                        help="Max other messages per second forwarded per drone, 0 for no limit (default: 50)")
+    parser.add_argument("--output-rate", type=float, default=60.0,
+                        help="Max messages per second sent to Unity in total, about what the Admin Terminal reads "
+                             "(one per rendered frame); 0 for no limit (default: 60)")
+    parser.add_argument("--wire", choices=["json", "compact", "auto"], default="json",
+                        help="Encoding towards Unity, as for the transmitter (default: json)")
+    parser.add_argument("--health-interval", type=float, default=2.0,
+                        help="Seconds between GATEWAY health messages (default: 2)")
+    parser.add_argument("--simulate", type=int, default=0, help="Run this many simulated transmitters and exit")
+    parser.add_argument("--sim-rate", type=float, default=10.0, help="DRONE messages per second per simulated drone")
+    parser.add_argument("--duration", type=float, help="Stop after this many seconds (default: 10 with --simulate)")
+    args = parser.parse_args()
+
+    writer = UnityWriter(wait_for_unity(args.host, args.port), args.host, args.port, args.wire, max_messages=8192)
+    gateway = Gateway(writer, ids=parse_ids(args.ids) if args.ids else None, strict=args.strict_ids,
+                      drone_rate=args.drone_rate, message_rate=args.message_rate, health_interval=args.health_interval,
+                      output_rate=args.output_rate)
+    try:
+        asyncio.run(serve(gateway, args.listen_host, args.listen_port, args.simulate, args.sim_rate, args.duration))
+    except KeyboardInterrupt:
+        print("Stopping...")
+    finally:
+        writer.close()
+        print(f"Unity writer: {writer.stats()}")
+        for drone_id, count in sorted(gateway.reconnects.items()):
+            print(f"Drone {drone_id}: {count} reconnects")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from unity_transmitter import (CameraModel, SimulatedDrone, TagDetector, TagField, TagTracker, UnityWriter,
+                               ground_texture, init_drone_state, localize_tags, project_tags, render_view,
+                               wait_for_unity)
+
+
+class SimPipeline:
+    """One simulated drone run through the transmitter's render -> detect -> localize -> track path."""
+
+    def __init__(self, index, args, field, writer=None):
+        trajectory = args.trajectory
+        if trajectory == "random":
+            trajectory = f"random:{args.seed + index}"
+        self.drone = SimulatedDrone(trajectory, field, speed=args.sim_speed, altitude=args.altitude, seed=args.seed)
+        # Spread drones sharing a path along it instead of stacking them.
+        self.offset = index / args.drones * self.drone.total / args.sim_speed
+        self.field = field
+        self.camera = CameraModel(args.width, args.height, hfov=args.hfov, tag_size=args.tag_size)
+        self.background = ground_texture(args.width, args.height, seed=args.seed + index)
+        self.detector = TagDetector(mode=args.detect_mode, quad_decimate=args.quad_decimate)
+        self.tracker = TagTracker()
+        self.state = init_drone_state(id_val=index + 1)
+        self.writer = writer
+        self.epoch = time.time()
+        self.stats = {"frames": 0, "visible": 0, "detected": 0, "sent": 0, "render": 0.0, "detect": 0.0}
+
+    def send(self, msg):
+        if self.writer is not None:
+            self.writer.submit(msg)
+            self.stats["sent"] += 1
+
+    def telemetry(self, t):
+        pose = self.drone.pose(t + self.offset)
+        self.state.update({name: pose[name] for name in ("x", "y", "z", "roll", "pitch", "yaw")})
+        self.state.update({"timestamp": int((self.epoch + t) * 1000), "armable": True, "armed": True,
+                           "battery_percentage": self.drone.battery(t), "battery_voltage": 12.0,
+                           "flight_mode": "GUIDED", "rssi": 200})
+        self.send(dict(self.state))
+
+    def frame(self, t):
+        pose = self.drone.pose(t + self.offset)
+        start = time.perf_counter()
+        frame = render_view(self.field, pose, self.camera, self.background)
+        rendered = time.perf_counter()
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        detections = self.detector.detect(gray, self.camera, pose)
+        self.stats["render"] += rendered - start
+        self.stats["detect"] += time.perf_counter() - rendered
+
+        h, w = gray.shape
+        visible = {tag["id"] for tag, corners in project_tags(self.field, pose, self.camera)
+                   if (corners >= 0).all() and (corners[:, 0] < w).all() and (corners[:, 1] < h).all()}
+        self.stats["frames"] += 1
+        self.stats["visible"] += len(visible)
+        self.stats["detected"] += len(visible & {det.tag_id for det in detections})
+
+        state = dict(self.state, **{name: pose[name] for name in ("x", "y", "z", "roll", "pitch", "yaw")})
+        for det, (x, y, z) in zip(detections, localize_tags(detections, state, self.camera).tolist()):
+            msg = self.tracker.update(det.tag_id, x, y, z, det.decision_margin)
+            if msg is not None:
+                self.send(msg)
+
+    def errors(self):
+        truth = {tag["id"]: (tag["x"], tag["y"]) for tag in self.field.tags}
+        return [math.hypot(track["mean"][0] - truth[tag_id][0], track["mean"][1] - truth[tag_id][1])
+                for tag_id, track in self.tracker.tracks.items() if tag_id in truth]
+
+
+def run(pipelines, duration, fps, telemetry_rate, speed, workers):
+    """Steps every drone through duration simulated seconds, speed times real time (None for as fast as possible)."""
+    frame_dt = 1.0 / fps
+    telemetry_dt = 1.0 / telemetry_rate
+    next_telemetry = 0.0
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        t = 0.0
+        while t < duration:
+            if speed:
+                delay = start + t / speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            while next_telemetry <= t:
+                for pipeline in pipelines:
+                    pipeline.telemetry(next_telemetry)
+                next_telemetry += telemetry_dt
+            list(pool.map(lambda p: p.frame(t), pipelines))
+            t += frame_dt
+    return time.monotonic() - start
+
+
+def report(pipelines, duration, elapsed):
+    frames = sum(p.stats["frames"] for p in pipelines)
+    visible = sum(p.stats["visible"] for p in pipelines)
+    errors = [e for p in pipelines for e in p.errors()]
+    return {
+        "drones": len(pipelines),
+        "sim_seconds": duration,
+        "wall_seconds": elapsed,
+        "speedup": duration / elapsed if elapsed > 0 else None,
+        "frames": frames,
+        "fps": frames / elapsed if elapsed > 0 else None,
+        "render_ms": sum(p.stats["render"] for p in pipelines) / max(frames, 1) * 1000.0,
+        "detect_ms": sum(p.stats["detect"] for p in pipelines) / max(frames, 1) * 1000.0,
+        "recall": sum(p.stats["detected"] for p in pipelines) / visible if visible else None,
+        "tags_mapped": len(errors),
+        "map_error_m": {"mean": float(np.mean(errors)), "max": float(np.max(errors))} if errors else None,
+        "messages_sent": sum(p.stats["sent"] for p in pipelines),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate many drones flying over the tag field, faster than real time")
+    parser.add_argument("--drones", type=int, default=4, help="Number of simulated drones (default: 4)")
+    parser.add_argument("--trajectory", type=str, default="random",
+                        help="hover, circle[:radius], lawnmower[:spacing], random (per-drone seed) or waypoints:file.json")
+    parser.add_argument("--layout", type=str, help="JSON tag layout (default: grid of the Tags/ tags)")
+    parser.add_argument("--duration", type=float, default=60.0, help="Simulated seconds (default: 60)")
+    parser.add_argument("--speed", type=str, default="max", help="Simulated seconds per real second, or max (default: max)")
+    parser.add_argument("--fps", type=float, default=10.0, help="Simulated camera FPS (default: 10)")
+    parser.add_argument("--telemetry-rate", type=float, default=10.0, help="DRONE messages per simulated second")
+    parser.add_argument("--sim-speed", type=float, default=3.0, help="Ground speed in m/s (default: 3)")
+    parser.add_argument("--altitude", type=float, default=8.0, help="Altitude in meters (default: 8)")
+    parser.add_argument("--width", type=int, default=640, help="Camera width (default: 640)")
+    parser.add_argument("--height", type=int, default=480, help="Camera height (default: 480)")
+    parser.add_argument("--hfov", type=float, default=78.0, help="Camera horizontal field of view in degrees")
+    parser.add_argument("--tag-size", type=float, help="Use pose estimation with this tag size in meters")
+    parser.add_argument("--detect-mode", choices=["full", "adaptive"], default="full")
+    parser.add_argument("--quad-decimate", type=float, default=2.0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Drones rendered/detected in parallel")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    parser.add_argument("--host", type=str, help="Send each drone's DRONE/TAG stream to this Unity or gateway host")
+    parser.add_argument("--port", type=int, help="Unity or drone_gateway.py port")
+    parser.add_argument("--wire", choices=["json", "compact", "auto"], default="json")
+    parser.add_argument("--json", type=str, help="Also write the report as JSON to this file")
+    args = parser.parse_args()
+
+    field = TagField(args.layout)
+    writers = []
+    if args.host:
+        if not args.port:
+            sys.exit("--host needs --port")
+        writers = [UnityWriter(wait_for_unity(args.host, args.port), args.host, args.port, args.wire)
+                   for _ in range(args.drones)]
+    pipelines = [SimPipeline(i, args, field, writers[i] if writers else None) for i in range(args.drones)]
+
+    speed = None if args.speed == "max" else float(args.speed)
+    try:
+        elapsed = run(pipelines, args.duration, args.fps, args.telemetry_rate, speed, args.workers)
+    finally:
+        for writer in writers:
+            writer.close()
+
+    result = report(pipelines, args.duration, elapsed)
+    print(f"{result['drones']} drones, {result['sim_seconds']:.0f} simulated s in {result['wall_seconds']:.1f} s "
+          f"({result['speedup']:.1f}x real time), {result['fps']:.0f} frames/s")
+    print(f"render {result['render_ms']:.2f} ms  detect {result['detect_ms']:.2f} ms per frame")
+    if result["recall"] is not None:
+        print(f"recall {result['recall']:.3f}, {result['tags_mapped']} tag estimates")
+    if result["map_error_m"]:
+        print(f"map error mean {result['map_error_m']['mean']:.3f} m  max {result['map_error_m']['max']:.3f} m")
+    print(f"messages sent: {result['messages_sent']}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
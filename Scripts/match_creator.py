@@ -1,20 +1,88 @@
 import argparse
+import json
 import requests
 
 SERVER_URL = "http://127.0.0.1:5000"
 
+def bracket_match_keys(name, teams):
+    """Keys for a single-elimination bracket: <name>-R<round>-M<match>, ending in <name>-final."""
+    keys = []
+    remaining = teams
+    round_no = 1
+    while remaining > 2:
+        matches = (remaining + 1) // 2
+        keys += [f"{name}-R{round_no}-M{m}" for m in range(1, matches + 1)]
+        remaining = matches
+        round_no += 1
+    keys.append(f"{name}-final")
+    return keys
+
+def load_bracket(path, default_count):
+    """Reads a bracket config file into a /new_matches request body.
+
+    The config is JSON with optional "seed", "tag_count", "server" and mapping
+    options (min_points, max_points, mine_chance, mine_value), plus either
+    "bracket": {"name": ..., "teams": N} or "matches": a list of match keys or
+    {"match_key": ..., "tag_count": ...} objects.
+    """
+    with open(path) as f:
+        config = json.load(f)
+
+    tag_count = config.get("tag_count", default_count)
+    entries = list(config.get("matches", []))
+    if "bracket" in config:
+        entries += bracket_match_keys(config["bracket"]["name"], config["bracket"]["teams"])
+
+    matches = []
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {"match_key": entry}
+        count = entry.pop("tag_count", tag_count)
+        entry["tag_ids"] = [str(i) for i in range(1, count + 1)]
+        matches.append(entry)
+
+    body = {name: config[name] for name in ("seed", "min_points", "max_points", "mine_chance", "mine_value")
+            if name in config}
+    body["matches"] = matches
+    return config.get("server", SERVER_URL), body
+
 def main():
     parser = argparse.ArgumentParser(description="Create a new match with tags")
     parser.add_argument("--count", type=int, default=40, help="Number of tags to register (default: 40)")
-    parser.add_argument("--key", type=str, required=True, help="Match key (required, no default)")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--key", type=str, help="Match key (required unless --config is given)")
+    target.add_argument("--config", type=str, help="Bracket config file: create all of its matches in one request")
+    parser.add_argument("--seed", type=int, help="Seed for reproducible point mappings")
+    parser.add_argument("--output", type=str, help="With --config, write the created mappings to this JSON file")
     args = parser.parse_args()
 
+    if args.config:
+        server_url, body = load_bracket(args.config, args.count)
+        if args.seed is not None:
+            body["seed"] = args.seed
+        r = requests.post(f"{server_url}/new_matches", json=body)
+        try:
+            data = r.json()
+        except Exception:
+            print("Error: Could not decode response:", r.text)
+            return
+        if "matches" not in data:
+            print(data)
+            return
+        for match in data["matches"]:
+            print(f"{match['match_key']}: {match['tag_count']} tags")
+        print(f"Created {data['match_count']} matches")
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(data, f, indent=2)
+        return
+
     tag_ids = [str(i) for i in range(1, args.count + 1)]
 
-    r = requests.post(f"{SERVER_URL}/new_match", json={
-        "match_key": args.key,
-        "tag_ids": tag_ids
-    })
+    payload = {"match_key": args.key, "tag_ids": tag_ids}
+    if args.seed is not None:
+        payload["seed"] = args.seed
+    r = requests.post(f"{SERVER_URL}/new_match", json=payload)
 
     try:
         print(r.json())
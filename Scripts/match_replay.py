@@ -0,0 +1,262 @@
+import argparse
+import bisect
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+from unity_transmitter import MatchRecorder, negotiate_wire
+
+RECORD = MatchRecorder.RECORD
+KIND_NAMES = {MatchRecorder.MESSAGE: "message", MatchRecorder.MAVLINK: "mavlink", MatchRecorder.FRAME: "frame"}
+
+
+class Recording:
+    """Reads a MatchRecorder file, seeking through its .idx sidecar (rebuilt by a scan if missing)."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(MatchRecorder.MAGIC)) != MatchRecorder.MAGIC:
+                raise ValueError(f"{path} is not a match recording")
+        self.index = self.load_index()
+        self.start = self.index[0][0] if self.index else None
+        self.end = self.start
+        offset = self.index[-1][1] if self.index else len(MatchRecorder.MAGIC)
+        for ts, _, _ in self.scan(offset):
+            self.start = ts if self.start is None else self.start
+            self.end = ts
+
+    def load_index(self):
+        index = []
+        try:
+            with open(self.path + ".idx", "rb") as f:
+                data = f.read()
+            size = MatchRecorder.INDEX.size
+            index = [MatchRecorder.INDEX.unpack_from(data, i) for i in range(0, len(data) - size + 1, size)]
+        except OSError:
+            pass
+        if not index:
+            last = None
+            offset = len(MatchRecorder.MAGIC)
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                while True:
+                    header = f.read(RECORD.size)
+                    if len(header) < RECORD.size:
+                        break
+                    ts, _, length = RECORD.unpack(header)
+                    if last is None or ts - last >= 1_000_000:
+                        index.append((ts, offset))
+                        last = ts
+                    f.seek(length, os.SEEK_CUR)
+                    offset += RECORD.size + length
+        return index
+
+    def scan(self, offset):
+        """Yields (timestamp_us, kind, payload) from a record offset, stopping at a truncated tail."""
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            while True:
+                header = f.read(RECORD.size)
+                if len(header) < RECORD.size:
+                    return
+                ts, kind, length = RECORD.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length:
+                    return
+                yield ts, kind, payload
+
+    @property
+    def duration(self):
+        return (self.end - self.start) / 1e6 if self.start is not None else 0.0
+
+    def records(self, position=0.0):
+        """Records from position seconds into the recording onwards."""
+        if self.start is None:
+            return
+        target = self.start + int(position * 1e6)
+        i = bisect.bisect_right(self.index, (target, float("inf"))) - 1
+        offset = self.index[max(i, 0)][1] if self.index else len(MatchRecorder.MAGIC)
+        for record in self.scan(offset):
+            if record[0] >= target:
+                yield record
+
+
+class Playback:
+    """Playback position and speed, changed from stdin while streaming."""
+
+    def __init__(self, speed, position):
+        self.lock = threading.Lock()
+        self.speed = speed
+        self.position = position
+        self.paused = False
+        self.jump = None
+        self.stopped = False
+
+    def command(self, line):
+        words = line.split()
+        if not words:
+            return
+        with self.lock:
+            if words[0] == "seek" and len(words) == 2:
+                self.jump = float(words[1])
+            elif words[0] == "speed" and len(words) == 2:
+                self.speed = parse_speed(words[1])
+            elif words[0] == "pause":
+                self.paused = True
+            elif words[0] in ("play", "resume"):
+                self.paused = False
+            elif words[0] in ("quit", "exit"):
+                self.stopped = True
+            else:
+                print("Commands: seek SECONDS, speed N|max, pause, play, quit")
+
+
+def parse_speed(value):
+    return None if value == "max" else float(value)
+
+
+def read_commands(playback):
+    for line in sys.stdin:
+        try:
+            playback.command(line)
+        except ValueError:
+            print(f"Bad command: {line.strip()}")
+        if playback.stopped:
+            return
+
+
+def stream(recording, sock, encoder, playback, end=None, max_batch=65536):
+    """Sends the recorded Unity messages, paced to the recording's timing at playback.speed."""
+    sent = 0
+    while not playback.stopped:
+        with playback.lock:
+            if playback.jump is not None:
+                playback.position, playback.jump = playback.jump, None
+            position = playback.position
+        encoder.reset()
+
+        anchor = None
+        batch = []
+        pending = 0
+        jumped = False
+        for ts, kind, payload in recording.records(position):
+            position = (ts - recording.start) / 1e6
+            if end is not None and position > end:
+                break
+            if kind != MatchRecorder.MESSAGE:
+                continue
+
+            with playback.lock:
+                speed, paused, jumped = playback.speed, playback.paused, playback.jump is not None
+            if jumped or playback.stopped:
+                break
+            if paused:
+                if batch:
+                    sock.sendall(b"".join(batch))
+                    batch, pending = [], 0
+                while playback.paused and not playback.stopped and playback.jump is None:
+                    time.sleep(0.05)
+                anchor = None
+            if speed is not None:
+                if anchor is None or anchor[2] != speed:
+                    anchor = (time.monotonic(), position, speed)
+                delay = anchor[0] + (position - anchor[1]) / speed - time.monotonic()
+                if delay > 0:
+                    if batch:
+                        sock.sendall(b"".join(batch))
+                        batch, pending = [], 0
+                    time.sleep(delay)
+
+            data = encoder.encode(json.loads(payload))
+            batch.append(data)
+            pending += len(data)
+            sent += 1
+            if pending >= max_batch:
+                sock.sendall(b"".join(batch))
+                batch, pending = [], 0
+
+        if batch:
+            sock.sendall(b"".join(batch))
+        with playback.lock:
+            playback.position = position
+            if not jumped and playback.jump is None:
+                break
+    return sent
+
+
+def export_tlog(recording, path):
+    """Writes the recorded MAVLink packets as a .tlog (big-endian microsecond timestamp + packet)."""
+    count = 0
+    with open(path, "wb") as f:
+        for ts, kind, payload in recording.records():
+            if kind == MatchRecorder.MAVLINK:
+                f.write(struct.pack(">Q", ts))
+                f.write(payload)
+                count += 1
+    return count
+
+
+def print_info(recording):
+    counts = {}
+    types = {}
+    for _, kind, payload in recording.records():
+        counts[KIND_NAMES.get(kind, kind)] = counts.get(KIND_NAMES.get(kind, kind), 0) + 1
+        if kind == MatchRecorder.MESSAGE:
+            mtype = json.loads(payload).get("type")
+            types[mtype] = types.get(mtype, 0) + 1
+    print(f"{recording.path}: {recording.duration:.1f} s, {len(recording.index)} index entries")
+    for name, n in sorted(counts.items(), key=str):
+        print(f"  {name}: {n}")
+    for mtype, n in sorted(types.items(), key=str):
+        print(f"    {mtype}: {n}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a match recording to Unity / the Admin Terminal")
+    parser.add_argument("recording", type=str, help="Recording written by unity_transmitter.py --record")
+    parser.add_argument("--host", type=str, required=True, help="Unity server IP")
+    parser.add_argument("--port", type=int, required=True, help="Unity server port")
+    parser.add_argument("--wire", choices=["json", "compact", "auto"], default="json",
+                        help="Message encoding, as for the transmitter (default: json)")
+    parser.add_argument("--speed", type=str, default="1", help="Playback speed factor or max (default: 1)")
+    parser.add_argument("--start", type=float, default=0.0, help="Start this many seconds into the recording")
+    parser.add_argument("--end", type=float, help="Stop this many seconds into the recording")
+    parser.add_argument("--interactive", action="store_true",
+                        help="Read seek/speed/pause/play/quit commands from stdin during playback")
+    parser.add_argument("--info", action="store_true", help="Print what the recording contains and exit")
+    parser.add_argument("--tlog", type=str, help="Export the recorded MAVLink stream to this .tlog file and exit")
+    args = parser.parse_args()
+
+    recording = Recording(args.recording)
+    if args.info:
+        print_info(recording)
+        return
+    if args.tlog:
+        print(f"Exported {export_tlog(recording, args.tlog)} MAVLink packets to {args.tlog}")
+        return
+
+    sock = socket.create_connection((args.host, args.port))
+    encoder = negotiate_wire(sock, args.wire)
+    playback = Playback(parse_speed(args.speed), args.start)
+    if args.interactive:
+        threading.Thread(target=read_commands, args=(playback,), daemon=True).start()
+
+    start = time.monotonic()
+    try:
+        sent = stream(recording, sock, encoder, playback, args.end)
+    except KeyboardInterrupt:
+        sent = None
+    finally:
+        sock.close()
+    if sent is not None:
+        elapsed = time.monotonic() - start
+        print(f"Replayed {sent} messages in {elapsed:.1f} s ({sent / max(elapsed, 1e-9):.0f} msg/s)")
+
+
+if __name__ == "__main__":
+    main()
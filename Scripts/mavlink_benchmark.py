@@ -0,0 +1,161 @@
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from pymavlink import mavutil
+
+from unity_transmitter import (MavlinkInbox, UnityWriter, init_drone_state, mavlink_reader_loop, metrics,
+                               telemetry_loop)
+from mavlink_generator import DEFAULT_RATES, parse_rates
+
+GENERATOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mavlink_generator.py")
+
+
+class UnityStandIn:
+    """Accepts one Unity connection and times the latency probes that arrive inside DRONE messages."""
+
+    def __init__(self):
+        self.server = socket.create_server(("127.0.0.1", 0))
+        self.port = self.server.getsockname()[1]
+        self.drone_messages = 0
+        self.latencies = []
+        self.cpu = 0.0
+        self.thread = threading.Thread(target=self.run, name="unity-stand-in", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        conn, _ = self.server.accept()
+        with conn, conn.makefile("rb") as f:
+            for line in f:
+                start = time.thread_time()
+                arrived = time.time_ns()
+                msg = json.loads(line)
+                if msg.get("type") == "DRONE":
+                    self.drone_messages += 1
+                    for entry in msg.get("messages", []):
+                        if entry["text"].startswith("probe "):
+                            self.latencies.append((arrived - int(entry["text"].split()[1])) / 1e6)
+                self.cpu += time.thread_time() - start
+
+    def close(self):
+        self.server.close()
+        self.thread.join(timeout=2)
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run_once(rates, mode, duration, telemetry_rate, probe_rate, max_drain, port):
+    """Runs the generator against the transmitter's MAVLink -> DRONE path for duration seconds."""
+    unity = UnityStandIn()
+    writer = UnityWriter(socket.create_connection(("127.0.0.1", unity.port)), "127.0.0.1", unity.port)
+    master = mavutil.mavlink_connection(f"udp:127.0.0.1:{port}")
+    command = [sys.executable, GENERATOR, "--target", f"udpout:127.0.0.1:{port}", "--duration", str(duration),
+               "--probe-rate", str(probe_rate), "--json"]
+    command += [arg for mtype, rate in rates.items() for arg in ("--rate", f"{mtype}={rate}")]
+    generator = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+
+    try:
+        if master.wait_heartbeat(timeout=10) is None:
+            raise RuntimeError("No heartbeat from the generator")
+        inbox = MavlinkInbox(threaded=(mode == "thread"), max_drain=max_drain)
+        inbox.received["HEARTBEAT"] = 1  # The one wait_heartbeat consumed.
+        drone_state = init_drone_state()
+        stop = threading.Event()
+        threads = [threading.Thread(target=telemetry_loop, args=(writer, master, inbox, drone_state,
+                                                                 threading.Lock(), telemetry_rate, stop))]
+        if inbox.threaded:
+            threads.append(threading.Thread(target=mavlink_reader_loop, args=(master, inbox, stop)))
+
+        metrics.reset()
+        wall, cpu = time.monotonic(), time.process_time()
+        for t in threads:
+            t.start()
+        out, _ = generator.communicate(timeout=duration + 30)
+        # Let the last tick pick up what is still buffered.
+        time.sleep(2.0 / telemetry_rate)
+        stop.set()
+        for t in threads:
+            t.join(timeout=2)
+        wall, cpu = time.monotonic() - wall, time.process_time() - cpu
+    finally:
+        if generator.poll() is None:
+            generator.kill()
+        master.close()
+        writer.close()
+        unity.close()
+
+    sent = json.loads(out)["sent"]
+    counters = inbox.counters()
+    total_sent = sum(sent.values())
+    received = sum(c["received"] for c in counters.values())
+    cpu -= unity.cpu
+    telemetry = metrics.snapshot()[0].get("telemetry", {})
+    return {
+        "mode": mode,
+        "offered_rate": total_sent / duration,
+        "sent": total_sent,
+        "received": received,
+        "loss": 1.0 - received / total_sent if total_sent else 0.0,
+        "ingest_rate": received / wall,
+        "cpu_percent": 100.0 * cpu / wall,
+        "cpu_us_per_message": 1e6 * cpu / received if received else None,
+        "telemetry_tick_ms": {k: telemetry.get(f"{k}_ms") for k in ("mean", "p50", "p99")},
+        "drone_messages": unity.drone_messages,
+        "probes": {"sent": int(probe_rate * duration), "received": len(unity.latencies)},
+        "latency_ms": {"p50": percentile(unity.latencies, 0.5), "p90": percentile(unity.latencies, 0.9),
+                       "p99": percentile(unity.latencies, 0.99), "max": max(unity.latencies, default=None)},
+        "per_type": {mtype: {"sent": sent.get(mtype, 0), **counters.get(mtype, {"received": 0, "dropped": 0})}
+                     for mtype in sorted(set(sent) | set(counters))},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark MAVLink ingestion: generator -> UDP -> inbox -> drone state -> Unity socket")
+    parser.add_argument("--rate", action="append", metavar="TYPE=HZ",
+                        help=f"Generator message rate, repeatable (defaults: "
+                             f"{', '.join(f'{k}={v:g}' for k, v in DEFAULT_RATES.items())})")
+    parser.add_argument("--scale", type=float, nargs="+", default=[1.0, 10.0, 100.0],
+                        help="Rate multipliers to sweep (default: 1 10 100)")
+    parser.add_argument("--modes", choices=["drain", "thread"], nargs="+", default=["drain", "thread"],
+                        help="MAVLink read modes to compare (default: drain thread)")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per run (default: 10)")
+    parser.add_argument("--telemetry-rate", type=float, default=10.0, help="DRONE messages per second (default: 10)")
+    parser.add_argument("--probe-rate", type=float, default=5.0, help="Latency probes per second (default: 5)")
+    parser.add_argument("--max-drain", type=int, default=1000, help="Messages drained per tick (default: 1000)")
+    parser.add_argument("--port", type=int, default=14560, help="Local UDP port for the MAVLink link (default: 14560)")
+    parser.add_argument("--json", type=str, help="Also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'mode':>6} {'offered':>9} {'ingested':>9} {'loss':>6} {'cpu':>6} {'us/msg':>7} "
+          f"{'lat p50':>8} {'lat p99':>8} {'probes':>7}")
+    for scale in args.scale:
+        for mode in args.modes:
+            result = run_once(parse_rates(args.rate, scale), mode, args.duration, args.telemetry_rate,
+                              args.probe_rate, args.max_drain, args.port)
+            result["scale"] = scale
+            results.append(result)
+            latency = result["latency_ms"]
+            print(f"{mode:>6} {result['offered_rate']:>7.0f}/s {result['ingest_rate']:>7.0f}/s "
+                  f"{result['loss'] * 100:>5.1f}% {result['cpu_percent']:>5.1f}% "
+                  f"{result['cpu_us_per_message'] or 0:>7.1f} "
+                  f"{latency['p50'] or 0:>6.1f}ms {latency['p99'] or 0:>6.1f}ms "
+                  f"{result['probes']['received']:>3}/{result['probes']['sent']:<3}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import argparse
+import json
+import time
+
+from pymavlink import mavutil
+
+from unity_transmitter import SimulatedDrone
+
+DEFAULT_RATES = {"HEARTBEAT": 1.0, "ATTITUDE": 50.0, "LOCAL_POSITION_NED": 30.0, "BATTERY_STATUS": 1.0,
+                 "RADIO_STATUS": 1.0, "STATUSTEXT": 0.2}
+
+
+class MavlinkGenerator:
+    """Flight-controller stand-in that sends MAVLink telemetry over UDP at configurable rates.
+
+    Poses come from a SimulatedDrone. With probe_rate set, extra STATUSTEXT
+    messages carry "probe <time.time_ns()>" so a receiver on the same machine
+    can measure the latency through the whole pipeline.
+    """
+
+    def __init__(self, target="udpout:127.0.0.1:14550", rates=None, system=1, trajectory="circle:5", probe_rate=0.0):
+        self.conn = mavutil.mavlink_connection(target, source_system=system, source_component=1)
+        self.rates = dict(DEFAULT_RATES if rates is None else rates)
+        self.drone = SimulatedDrone(trajectory)
+        self.probe_rate = probe_rate
+        self.sent = {}
+        self.start = None
+
+    def send(self, mtype, t):
+        mav = self.conn.mav
+        ms = int(t * 1000) & 0xFFFFFFFF
+        if mtype == "HEARTBEAT":
+            mav.heartbeat_send(mavutil.mavlink.MAV_TYPE_QUADROTOR, mavutil.mavlink.MAV_AUTOPILOT_ARDUPILOTMEGA,
+                               mavutil.mavlink.MAV_MODE_FLAG_SAFETY_ARMED
+                               | mavutil.mavlink.MAV_MODE_FLAG_CUSTOM_MODE_ENABLED,
+                               4, mavutil.mavlink.MAV_STATE_ACTIVE)
+        elif mtype == "ATTITUDE":
+            pose = self.drone.pose(t)
+            mav.attitude_send(ms, pose["roll"], pose["pitch"], pose["yaw"], 0.0, 0.0, 0.0)
+        elif mtype == "LOCAL_POSITION_NED":
+            pose = self.drone.pose(t)
+            mav.local_position_ned_send(ms, pose["x"], pose["y"], pose["z"], pose["vx"], pose["vy"], pose["vz"])
+        elif mtype == "BATTERY_STATUS":
+            battery = self.drone.battery(t)
+            mav.battery_status_send(0, 0, 0, 2500, [int(11100 + 15 * battery)] + [65535] * 9, 1500, -1, -1, battery)
+        elif mtype == "RADIO_STATUS":
+            mav.radio_status_send(200, 200, 100, 40, 40, 0, 0)
+        elif mtype == "STATUSTEXT":
+            mav.statustext_send(mavutil.mavlink.MAV_SEVERITY_INFO, f"generator t={t:.1f}".encode())
+        elif mtype == "PROBE":
+            mav.statustext_send(mavutil.mavlink.MAV_SEVERITY_DEBUG, f"probe {time.time_ns()}".encode())
+            mtype = "STATUSTEXT"
+        self.sent[mtype] = self.sent.get(mtype, 0) + 1
+
+    def run(self, duration=None, stop=None):
+        """Sends until duration seconds have passed or stop is set. Rates above ~1 kHz go out in bursts."""
+        periods = {mtype: 1.0 / rate for mtype, rate in self.rates.items() if rate > 0}
+        if self.probe_rate > 0:
+            periods["PROBE"] = 1.0 / self.probe_rate
+        self.start = time.monotonic()
+        due = {mtype: self.start for mtype in periods}
+        while (duration is None or time.monotonic() - self.start < duration) and not (stop and stop.is_set()):
+            now = time.monotonic()
+            for mtype, period in periods.items():
+                # Catch up at most one second of backlog after a stall.
+                due[mtype] = max(due[mtype], now - 1.0)
+                while due[mtype] <= now:
+                    self.send(mtype, due[mtype] - self.start)
+                    due[mtype] += period
+            delay = min(due.values()) - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        return self.sent
+
+    def close(self):
+        self.conn.close()
+
+
+def parse_rates(specs, scale=1.0):
+    """["ATTITUDE=1000", "STATUSTEXT=0"] on top of the defaults, every rate multiplied by scale."""
+    rates = dict(DEFAULT_RATES)
+    for spec in specs or []:
+        mtype, _, rate = spec.partition("=")
+        mtype = mtype.upper()
+        if mtype not in DEFAULT_RATES:
+            raise ValueError(f"Unknown message type {mtype}, expected one of {', '.join(DEFAULT_RATES)}")
+        rates[mtype] = float(rate)
+    return {mtype: rate * scale for mtype, rate in rates.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send simulated flight-controller MAVLink traffic over UDP")
+    parser.add_argument("--target", type=str, default="udpout:127.0.0.1:14550",
+                        help="pymavlink connection string to send to (default: udpout:127.0.0.1:14550)")
+    parser.add_argument("--rate", action="append", metavar="TYPE=HZ",
+                        help=f"Message rate, repeatable (defaults: {', '.join(f'{k}={v:g}' for k, v in DEFAULT_RATES.items())})")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply every rate (default: 1)")
+    parser.add_argument("--system", type=int, default=1, help="MAVLink system ID (default: 1)")
+    parser.add_argument("--trajectory", type=str, default="circle:5", help="Simulated flight path (default: circle:5)")
+    parser.add_argument("--probe-rate", type=float, default=0.0,
+                        help="Latency probe STATUSTEXT messages per second (default: 0)")
+    parser.add_argument("--duration", type=float, help="Stop after this many seconds (default: run until Ctrl+C)")
+    parser.add_argument("--json", action="store_true", help="Print the sent message counts as JSON when done")
+    args = parser.parse_args()
+
+    generator = MavlinkGenerator(args.target, parse_rates(args.rate, args.scale), args.system, args.trajectory,
+                                 args.probe_rate)
+    try:
+        sent = generator.run(args.duration)
+    except KeyboardInterrupt:
+        sent = generator.sent
+    finally:
+        generator.close()
+    elapsed = time.monotonic() - generator.start
+    if args.json:
+        print(json.dumps({"sent": sent, "seconds": elapsed}))
+    else:
+        total = sum(sent.values())
+        print(f"Sent {total} messages in {elapsed:.1f} s ({total / elapsed:.0f} msg/s): {sent}")
+
+
+if __name__ == "__main__":
+    main()
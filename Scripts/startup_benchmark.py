@@ -0,0 +1,122 @@
+import argparse
+import json
+import os
+import shlex
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+GENERATOR = os.path.join(HERE, "mavlink_generator.py")
+TRANSMITTER = os.path.join(HERE, "unity_transmitter.py")
+EVENTS = ("connect", "first_log", "first_drone")
+
+
+class UnityStandIn:
+    """Accepts one transmitter connection and records when its first messages arrive."""
+
+    def __init__(self, start):
+        self.start = start
+        self.server = socket.create_server(("127.0.0.1", 0))
+        self.port = self.server.getsockname()[1]
+        self.times = {}
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="unity-stand-in", daemon=True)
+        self.thread.start()
+
+    def mark(self, event):
+        self.times.setdefault(event, time.monotonic() - self.start)
+
+    def run(self):
+        try:
+            conn, _ = self.server.accept()
+        except OSError:
+            return
+        self.mark("connect")
+        with conn, conn.makefile("rb") as f:
+            for line in f:
+                mtype = json.loads(line).get("type")
+                if mtype == "LOG":
+                    self.mark("first_log")
+                elif mtype == "DRONE":
+                    self.mark("first_drone")
+                    self.done.set()
+
+    def close(self):
+        self.server.close()
+        self.thread.join(timeout=2)
+
+
+def run_once(command, mavlink_port, timeout, extra_args):
+    """Launches the transmitter once and returns seconds from launch to each startup event."""
+    start = time.monotonic()
+    unity = UnityStandIn(start)
+    proc = subprocess.Popen(command + ["--host", "127.0.0.1", "--port", str(unity.port),
+                                       "--mavlink", f"udpin:127.0.0.1:{mavlink_port}"] + extra_args,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        unity.done.wait(timeout)
+    finally:
+        proc.send_signal(signal.SIGINT)
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+        unity.close()
+    return dict(unity.times)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure transmitter startup: launch -> Unity connect -> first LOG -> first DRONE message")
+    parser.add_argument("--command", type=str,
+                        help="Transmitter to launch, e.g. dist/unity_transmitter/unity_transmitter.exe "
+                             "(default: this Python running unity_transmitter.py)")
+    parser.add_argument("--runs", type=int, default=5, help="Number of launches (default: 5)")
+    parser.add_argument("--timeout", type=float, default=30.0,
+                        help="Seconds to wait for the first DRONE message per launch (default: 30)")
+    parser.add_argument("--mavlink-port", type=int, default=14570,
+                        help="Local UDP port the MAVLink generator sends to (default: 14570)")
+    parser.add_argument("--heartbeat-rate", type=float, default=1.0,
+                        help="Generator HEARTBEAT rate in Hz; real flight controllers send 1 (default: 1)")
+    parser.add_argument("--server", type=str, default="http://127.0.0.1:5000", help="Decoder server URL")
+    parser.add_argument("--source", type=str, default="synthetic", help="Transmitter frame source (default: synthetic)")
+    parser.add_argument("--json", type=str, help="Also write the results as JSON to this file")
+    args, extra = parser.parse_known_args()
+
+    command = shlex.split(args.command) if args.command else [sys.executable, TRANSMITTER]
+    extra = ["--match", "startup-benchmark", "--server", args.server, "--source", args.source] + extra
+    # The flight controller is already up when the transmitter starts, as on the field.
+    generator = subprocess.Popen([sys.executable, GENERATOR, "--target", f"udpout:127.0.0.1:{args.mavlink_port}",
+                                  "--rate", f"HEARTBEAT={args.heartbeat_rate}"], stdout=subprocess.DEVNULL)
+    runs = []
+    try:
+        time.sleep(1.0)
+        for i in range(args.runs):
+            times = run_once(command, args.mavlink_port, args.timeout, extra)
+            runs.append(times)
+            print(f"run {i + 1}: " + "  ".join(f"{event} {times[event]:.2f} s" if event in times else f"{event} -"
+                                               for event in EVENTS))
+    finally:
+        generator.terminate()
+        generator.wait()
+
+    summary = {}
+    for event in EVENTS:
+        values = [times[event] for times in runs if event in times]
+        summary[event] = {"median": statistics.median(values), "min": min(values), "max": max(values),
+                          "runs": len(values)} if values else None
+    print("median: " + "  ".join(f"{event} {summary[event]['median']:.2f} s" if summary[event] else f"{event} -"
+                                 for event in EVENTS))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"command": command, "runs": runs, "summary": summary}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import argparse
+import asyncio
+import json
+import time
+from collections import deque
+
+from drone_gateway import StreamParser
+
+# Trace stamps in pipeline order. A latency is reported for each step between two stamps present in a message,
+# named after the later one, plus "receive" (send -> arrival here) and "total" (first stamp -> arrival here).
+TRACE_STAGES = ("capture", "detect", "decode", "localize", "send")
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class LatencyReport:
+    """Message counts, bytes and per-stage latencies of everything received."""
+
+    def __init__(self, max_samples=100000):
+        self.max_samples = max_samples
+        self.start = None
+        self.last = None
+        self.bytes = 0
+        self.counts = {}
+        self.traced = {}
+        self.latencies = {}
+
+    def add_bytes(self, count):
+        self.last = time.monotonic()
+        if self.start is None:
+            self.start = self.last
+        self.bytes += count
+
+    def add(self, msg, received_at):
+        mtype = msg.get("type")
+        self.counts[mtype] = self.counts.get(mtype, 0) + 1
+        trace = msg.get("trace")
+        if not isinstance(trace, dict):
+            return
+        stamps = [(stage, trace[stage]) for stage in TRACE_STAGES if trace.get(stage) is not None]
+        if not stamps:
+            return
+        self.traced[mtype] = self.traced.get(mtype, 0) + 1
+        stamps.append(("receive", received_at))
+        for (_, before), (stage, after) in zip(stamps, stamps[1:]):
+            self.sample(mtype, stage, after - before)
+        if len(stamps) > 2:
+            self.sample(mtype, "total", received_at - stamps[0][1])
+
+    def sample(self, mtype, stage, ns):
+        key = (mtype, stage)
+        if key not in self.latencies:
+            self.latencies[key] = deque(maxlen=self.max_samples)
+        self.latencies[key].append(ns / 1e6)
+
+    def summary(self):
+        # Rates cover the time data was actually arriving.
+        elapsed = self.last - self.start if self.start is not None else 0.0
+        stages = {}
+        for (mtype, stage), values in sorted(self.latencies.items()):
+            values = list(values)
+            stages.setdefault(mtype, {})[stage] = {
+                "count": len(values), "mean_ms": sum(values) / len(values), "p50_ms": percentile(values, 0.5),
+                "p90_ms": percentile(values, 0.9), "p99_ms": percentile(values, 0.99), "max_ms": max(values)}
+        return {
+            "seconds": elapsed,
+            "bytes": self.bytes,
+            "bytes_per_second": self.bytes / elapsed if elapsed > 0 else None,
+            "messages": dict(self.counts),
+            "rates": {mtype: count / elapsed for mtype, count in self.counts.items()} if elapsed > 0 else {},
+            "traced": dict(self.traced),
+            "latency": stages,
+        }
+
+
+def print_summary(summary):
+    rates = "  ".join(f"{mtype} {rate:.1f}/s" for mtype, rate in sorted(summary["rates"].items()))
+    print(f"{summary['seconds']:.1f} s, {summary['bytes_per_second'] or 0:.0f} B/s  {rates}")
+    for mtype, stages in summary["latency"].items():
+        for stage in TRACE_STAGES[1:] + ("receive", "total"):
+            if stage in stages:
+                s = stages[stage]
+                print(f"  {mtype:<6} {stage:<8} p50 {s['p50_ms']:>8.2f} ms  p90 {s['p90_ms']:>8.2f} ms  "
+                      f"p99 {s['p99_ms']:>8.2f} ms  max {s['max_ms']:>8.2f} ms  ({s['count']})")
+
+
+class UnityStandIn:
+    """Stands in for the Admin Terminal: accepts transmitter or gateway streams and measures them.
+
+    Speaks the same protocol as Unity, JSON lines plus an optional HELLO
+    negotiation of the compact encoding. Latencies compare the senders'
+    time.monotonic_ns() trace stamps with the arrival time here, so they are
+    only meaningful when both run on the same machine.
+    """
+
+    def __init__(self, wire="json", echo=False):
+        self.wire = wire
+        self.echo = echo
+        self.report = LatencyReport()
+
+    async def handle(self, reader, writer):
+        peer = "%s:%s" % writer.get_extra_info("peername")[:2]
+        print(f"Connection from {peer}")
+        parser = StreamParser()
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                received_at = time.monotonic_ns()
+                self.report.add_bytes(len(data))
+                for msg in parser.feed(data):
+                    if msg.get("type") == "HELLO":
+                        encoding = self.wire if self.wire in msg.get("encodings", []) else "json"
+                        writer.write((json.dumps({"type": "HELLO", "encoding": encoding}) + "\n").encode("utf-8"))
+                        await writer.drain()
+                        continue
+                    if self.echo:
+                        print(json.dumps(msg))
+                    self.report.add(msg, received_at)
+        except (ConnectionError, ValueError) as e:
+            print(f"Stream from {peer} failed: {e}")
+        finally:
+            writer.close()
+            print(f"{peer} disconnected")
+
+    async def report_loop(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            if self.report.start is not None:
+                print_summary(self.report.summary())
+
+
+async def serve(standin, host, port, interval, duration=None):
+    server = await asyncio.start_server(standin.handle, host, port)
+    print(f"Unity stand-in listening on {host}:{port}")
+    task = asyncio.create_task(standin.report_loop(interval)) if interval > 0 else None
+    try:
+        if duration:
+            await asyncio.sleep(duration)
+        else:
+            await server.serve_forever()
+    finally:
+        if task:
+            task.cancel()
+        server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Unity stand-in: receive the transmitter stream and report message rates, bytes/s and the "
+                    "latency of every pipeline stage (run the transmitter with --trace on the same machine)")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Listen address (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=5005, help="Listen port (default: 5005)")
+    parser.add_argument("--wire", choices=["json", "compact"], default="json",
+                        help="Encoding to accept when a transmitter offers a choice (default: json)")
+    parser.add_argument("--interval", type=float, default=5.0, help="Seconds between reports, 0 for none (default: 5)")
+    parser.add_argument("--duration", type=float, help="Stop after this many seconds (default: run until Ctrl+C)")
+    parser.add_argument("--echo", action="store_true", help="Print every received message")
+    parser.add_argument("--json", type=str, help="Write the final report as JSON to this file")
+    args = parser.parse_args()
+
+    standin = UnityStandIn(args.wire, args.echo)
+    try:
+        asyncio.run(serve(standin, args.host, args.port, args.interval, args.duration))
+    except KeyboardInterrupt:
+        pass
+    summary = standin.report.summary()
+    print("Final report:")
+    print_summary(summary)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
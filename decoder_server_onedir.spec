@@ -0,0 +1,49 @@
+# -*- mode: python ; coding: utf-8 -*-
+# Startup-optimized build: a folder instead of a single EXE, so nothing is
+# extracted to a temp directory on every launch, and no UPX, so the DLLs do
+# not have to be decompressed when they load.
+# Build with: pyinstaller decoder_server_onedir.spec  ->  dist/decoder_server/decoder_server.exe
+
+
+a = Analysis(
+    ['decoder_server.py'],
+    pathex=[],
+    binaries=[],
+    datas=[],
+    # Imported inside the functions that first need them.
+    hiddenimports=['numpy', 'sqlite3', 'waitress'],
+    hookspath=[],
+    hooksconfig={},
+    runtime_hooks=[],
+    excludes=[],
+    noarchive=False,
+    optimize=0,
+)
+pyz = PYZ(a.pure)
+
+exe = EXE(
+    pyz,
+    a.scripts,
+    [],
+    exclude_binaries=True,
+    name='decoder_server',
+    debug=False,
+    bootloader_ignore_signals=False,
+    strip=False,
+    upx=False,
+    console=True,
+    disable_windowed_traceback=False,
+    argv_emulation=False,
+    target_arch=None,
+    codesign_identity=None,
+    entitlements_file=None,
+)
+coll = COLLECT(
+    exe,
+    a.binaries,
+    a.datas,
+    strip=False,
+    upx=False,
+    upx_exclude=[],
+    name='decoder_server',
+)
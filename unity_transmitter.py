@@ -2,14 +2,468 @@ import sys
 import socket
 import time
 import json
-import cv2
-import requests
+import struct
 import argparse
 import os
-from pupil_apriltags import Detector
-from pymavlink import mavutil
+import glob
+import math
+import re
+import threading
+import functools
+import bisect
+import hashlib
+import hmac
+import importlib
+import cProfile
+import signal
+from abc import ABC, abstractmethod
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import random
 
+
+class LazyModule:
+    """Stands in for a heavy module until it is first used, then imports it and takes its place here.
+
+    Keeps startup from waiting on cv2, numpy, pupil_apriltags, pymavlink and
+    requests before the Unity connection and heartbeat wait are under way.
+    The PyInstaller specs list these modules as hidden imports.
+    """
+
+    def __init__(self, name, alias):
+        self._name = name
+        self._alias = alias
+        self._lock = threading.Lock()
+        self._module = None
+
+    def _load(self):
+        with self._lock:
+            if self._module is None:
+                self._module = importlib.import_module(self._name)
+                globals()[self._alias] = self._module
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+
+cv2 = LazyModule("cv2", "cv2")
+np = LazyModule("numpy", "np")
+requests = LazyModule("requests", "requests")
+apriltags = LazyModule("pupil_apriltags", "apriltags")
+mavutil = LazyModule("pymavlink.mavutil", "mavutil")
+
+# Serializes writes from the pipeline threads so JSON lines never interleave.
+send_lock = threading.Lock()
+
+
+class LatestQueue:
+    """Bounded queue where new items push out the oldest ones (latest wins)."""
+
+    def __init__(self, maxsize=1, on_drop=None):
+        self.items = deque(maxlen=maxsize)
+        self.cond = threading.Condition()
+        self.dropped = 0
+        self.on_drop = on_drop
+
+    def put(self, item):
+        with self.cond:
+            if len(self.items) == self.items.maxlen:
+                self.dropped += 1
+                if self.on_drop is not None:
+                    self.on_drop(self.items[0])
+            self.items.append(item)
+            self.cond.notify()
+
+    def get(self, timeout=None):
+        with self.cond:
+            if not self.items:
+                self.cond.wait(timeout)
+            if not self.items:
+                return None
+            return self.items.popleft()
+
+    def __len__(self):
+        with self.cond:
+            return len(self.items)
+
+
+class Metrics:
+    """Thread-safe stage latency histograms and event counters.
+
+    Buckets are fixed so observe() is a few additions under a lock; quantiles
+    are interpolated from the buckets when a snapshot is taken.
+    """
+
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+
+    def observe(self, stage, seconds):
+        index = next((i for i, bound in enumerate(self.BUCKETS) if seconds <= bound), len(self.BUCKETS))
+        with self.lock:
+            hist = self.histograms.get(stage)
+            if hist is None:
+                hist = self.histograms[stage] = {"buckets": [0] * (len(self.BUCKETS) + 1), "sum": 0.0, "count": 0}
+            hist["buckets"][index] += 1
+            hist["sum"] += seconds
+            hist["count"] += 1
+
+    def incr(self, event, n=1):
+        with self.lock:
+            self.counters[event] = self.counters.get(event, 0) + n
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+            self.counters = {}
+
+    def quantile(self, hist, q):
+        target = q * hist["count"]
+        seen = 0
+        for i, n in enumerate(hist["buckets"]):
+            if n and seen + n >= target:
+                low = self.BUCKETS[i - 1] if i > 0 else 0.0
+                high = self.BUCKETS[i] if i < len(self.BUCKETS) else self.BUCKETS[-1] * 2
+                return low + (high - low) * (target - seen) / n
+            seen += n
+        return 0.0
+
+    def snapshot(self):
+        with self.lock:
+            histograms = {stage: {"buckets": list(h["buckets"]), "sum": h["sum"], "count": h["count"]}
+                          for stage, h in self.histograms.items()}
+            counters = dict(self.counters)
+        stages = {stage: {"count": h["count"],
+                          "mean_ms": round(h["sum"] / h["count"] * 1000.0, 3),
+                          "p50_ms": round(self.quantile(h, 0.5) * 1000.0, 3),
+                          "p99_ms": round(self.quantile(h, 0.99) * 1000.0, 3)}
+                  for stage, h in histograms.items() if h["count"]}
+        return stages, counters, histograms
+
+    def prometheus(self, writer_stats=None, mavlink_counters=None, governor_state=None):
+        _, counters, histograms = self.snapshot()
+        lines = ["# TYPE transmitter_stage_seconds histogram"]
+        for stage, h in sorted(histograms.items()):
+            cumulative = 0
+            for bound, n in zip(self.BUCKETS + ("+Inf",), h["buckets"]):
+                cumulative += n
+                lines.append(f'transmitter_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'transmitter_stage_seconds_sum{{stage="{stage}"}} {h["sum"]}')
+            lines.append(f'transmitter_stage_seconds_count{{stage="{stage}"}} {h["count"]}')
+        lines.append("# TYPE transmitter_events_total counter")
+        for event, n in sorted(counters.items()):
+            lines.append(f'transmitter_events_total{{event="{event}"}} {n}')
+        if mavlink_counters:
+            lines.append("# TYPE transmitter_mavlink_messages_total counter")
+            for mtype, counts in sorted(mavlink_counters.items()):
+                lines.append(f'transmitter_mavlink_messages_total{{type="{mtype}"}} {counts["received"]}')
+                lines.append(f'transmitter_mavlink_coalesced_total{{type="{mtype}"}} {counts["dropped"]}')
+        if writer_stats:
+            lines.append("# TYPE transmitter_unity_queue_depth gauge")
+            lines.append(f'transmitter_unity_queue_depth {writer_stats["queue_depth"]}')
+            for name in ("sent", "bytes", "writes", "reconnects"):
+                lines.append(f'transmitter_unity_{name}_total {writer_stats[name]}')
+            for mtype, n in sorted(writer_stats["dropped"].items()):
+                lines.append(f'transmitter_unity_dropped_total{{type="{mtype}"}} {n}')
+        if governor_state:
+            lines.append("# TYPE transmitter_governor gauge")
+            for name in ("fps", "quad_decimate", "cpu_percent"):
+                lines.append(f'transmitter_governor{{value="{name}"}} {governor_state[name]}')
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class StageProfiler:
+    """cProfile capture across the pipeline threads.
+
+    cProfile only sees the thread it was enabled in, so every stage loop calls
+    tick() once per iteration; toggle() (bound to SIGUSR1 where available)
+    starts or stops the capture and each thread dumps its own .prof file.
+    """
+
+    def __init__(self, out_dir="profiles", active=False):
+        self.out_dir = out_dir
+        self.active = active
+        self.local = threading.local()
+
+    def toggle(self, *_):
+        self.active = not self.active
+        print(f"Profiling {'started' if self.active else 'stopped'}")
+
+    def tick(self):
+        prof = getattr(self.local, "prof", None)
+        if self.active and prof is None:
+            self.local.prof = cProfile.Profile()
+            self.local.prof.enable()
+        elif not self.active and prof is not None:
+            self.finish()
+
+    def finish(self):
+        prof = getattr(self.local, "prof", None)
+        if prof is None:
+            return
+        prof.disable()
+        self.local.prof = None
+        os.makedirs(self.out_dir, exist_ok=True)
+        path = os.path.join(self.out_dir, f"profile-{threading.current_thread().name}-{int(time.time())}.prof")
+        prof.dump_stats(path)
+        print(f"Wrote {path}")
+
+
+profiler = StageProfiler()
+
+
+def start_metrics_server(port, writer, inbox, host="127.0.0.1", governor=None):
+    """Serves Prometheus text format on http://host:port/metrics from a daemon thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            governor_state = governor.snapshot() if governor is not None else None
+            body = metrics.prometheus(writer.stats(), inbox.counters(), governor_state).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+def metrics_loop(sock, inbox, interval, stop, governor=None):
+    """Periodically sends a METRICS summary (stage latencies, event rates, queue stats) to Unity."""
+    previous = {}
+    last = time.monotonic()
+    while not stop.wait(interval):
+        profiler.tick()
+        now = time.monotonic()
+        stages, counters, _ = metrics.snapshot()
+        rates = {event: round((n - previous.get(event, 0)) / (now - last), 2) for event, n in counters.items()}
+        mavlink = inbox.counters()
+        rates.update({f"mavlink_{mtype}": round((c["received"] - previous.get(f"mavlink_{mtype}", 0)) / (now - last), 2)
+                      for mtype, c in mavlink.items()})
+        previous = dict(counters, **{f"mavlink_{mtype}": c["received"] for mtype, c in mavlink.items()})
+        last = now
+
+        send_message(sock, {
+            "type": "METRICS",
+            "timestamp": int(time.time() * 1000),
+            "stages": stages,
+            "rates": rates,
+            "unity": sock.stats() if isinstance(sock, UnityWriter) else None,
+            "governor": governor.snapshot() if governor is not None else None
+        })
+
+
+class JsonEncoder:
+    """Newline-delimited JSON, the format every Admin Terminal build understands."""
+
+    name = "json"
+
+    def encode(self, msg):
+        return (json.dumps(msg) + "\n").encode("utf-8")
+
+    def reset(self):
+        pass
+
+
+DRONE_FIELDS = [("id", "H"), ("x", "f"), ("y", "f"), ("z", "f"), ("pitch", "f"), ("roll", "f"), ("yaw", "f"),
+                ("timestamp", "q"), ("armable", "?"), ("armed", "?"), ("battery_voltage", "f"),
+                ("battery_percentage", "b"), ("flight_mode", "s"), ("rssi", "H")]
+TAG_FIELDS = [("id", "H"), ("x", "f"), ("y", "f"), ("z", "f"), ("points", "i"), ("sightings", "I"),
+              ("confidence", "f"), ("drone", "H")]
+KIND_JSON, KIND_DRONE, KIND_TAG, KIND_LOG, KIND_EVENT = range(5)
+
+
+class CompactEncoder:
+    """Length-prefixed binary records for the Unity socket.
+
+    Every record is <u8 kind><u16 length><payload>, little-endian:
+
+    - KIND_DRONE / KIND_TAG: <u16 present mask><u16 null mask> followed by the
+      present, non-null fields of DRONE_FIELDS / TAG_FIELDS in order. Strings
+      are <u8 length><utf-8>. DRONE records are delta encoded: only fields that
+      changed since the previous record of the same drone are present, with a
+      full keyframe every keyframe_interval records.
+    - KIND_LOG / KIND_EVENT: <u8 severity><i64 timestamp ms><utf-8 text>.
+      STATUSTEXT messages from the drone are sent once each as KIND_EVENT.
+    - KIND_JSON: a UTF-8 JSON object for anything that does not fit the above.
+    """
+
+    name = "compact"
+
+    def __init__(self, keyframe_interval=50):
+        self.keyframe_interval = keyframe_interval
+        self.reset()
+
+    def reset(self):
+        self.previous = {}
+        self.since_keyframe = {}
+
+    def record(self, kind, payload):
+        return struct.pack("<BH", kind, len(payload)) + payload
+
+    def pack_fields(self, fields, msg, present):
+        present_mask = null_mask = 0
+        parts = []
+        for bit, (name, fmt) in enumerate(fields):
+            if name not in present:
+                continue
+            present_mask |= 1 << bit
+            value = msg.get(name)
+            if value is None:
+                null_mask |= 1 << bit
+            elif fmt == "s":
+                text = str(value).encode("utf-8")[:255]
+                parts.append(struct.pack("<B", len(text)) + text)
+            else:
+                parts.append(struct.pack("<" + fmt, value))
+        return struct.pack("<HH", present_mask, null_mask) + b"".join(parts)
+
+    def encode_drone(self, msg):
+        drone_id = msg.get("id")
+        previous = self.previous.get(drone_id)
+        count = self.since_keyframe.get(drone_id, 0)
+        if previous is None or count >= self.keyframe_interval:
+            present = {name for name, _ in DRONE_FIELDS}
+            count = 0
+        else:
+            present = {name for name, _ in DRONE_FIELDS if msg.get(name) != previous.get(name)}
+            present.add("id")
+        data = self.record(KIND_DRONE, self.pack_fields(DRONE_FIELDS, msg, present))
+        self.previous[drone_id] = dict(msg)
+        self.since_keyframe[drone_id] = count + 1
+
+        for event in msg.get("messages") or []:
+            data += self.encode_text(KIND_EVENT, event)
+        return data
+
+    def encode_text(self, kind, msg):
+        text = str(msg.get("text", "")).encode("utf-8")[:65000]
+        return self.record(kind, struct.pack("<Bq", msg.get("severity") or 0, msg.get("timestamp") or 0) + text)
+
+    def encode(self, msg):
+        mtype = msg.get("type")
+        try:
+            if mtype == "DRONE" and set(msg) <= {"type", "messages"} | {name for name, _ in DRONE_FIELDS}:
+                return self.encode_drone(msg)
+            if mtype == "TAG" and set(msg) <= {"type"} | {name for name, _ in TAG_FIELDS}:
+                return self.record(KIND_TAG, self.pack_fields(TAG_FIELDS, msg, msg))
+            if mtype == "LOG":
+                return self.encode_text(KIND_LOG, msg)
+        except (struct.error, TypeError):
+            pass
+        return self.record(KIND_JSON, json.dumps(msg).encode("utf-8"))
+
+
+class CompactDecoder:
+    """Reassembles messages from a CompactEncoder byte stream (for tools and tests)."""
+
+    def __init__(self):
+        self.buffer = b""
+        self.drones = {}
+
+    def unpack_fields(self, fields, payload):
+        present_mask, null_mask = struct.unpack_from("<HH", payload)
+        offset = 4
+        msg = {}
+        for bit, (name, fmt) in enumerate(fields):
+            if not present_mask & (1 << bit):
+                continue
+            if null_mask & (1 << bit):
+                msg[name] = None
+            elif fmt == "s":
+                length = payload[offset]
+                msg[name] = payload[offset + 1:offset + 1 + length].decode("utf-8")
+                offset += 1 + length
+            else:
+                msg[name] = struct.unpack_from("<" + fmt, payload, offset)[0]
+                offset += struct.calcsize("<" + fmt)
+        return msg
+
+    def decode_record(self, kind, payload):
+        if kind == KIND_DRONE:
+            delta = self.unpack_fields(DRONE_FIELDS, payload)
+            state = self.drones.setdefault(delta["id"], {"type": "DRONE"})
+            state.update(delta)
+            return dict(state)
+        if kind == KIND_TAG:
+            return dict(self.unpack_fields(TAG_FIELDS, payload), type="TAG")
+        if kind in (KIND_LOG, KIND_EVENT):
+            severity, timestamp = struct.unpack_from("<Bq", payload)
+            return {"type": "LOG" if kind == KIND_LOG else "EVENT", "severity": severity,
+                    "timestamp": timestamp, "text": payload[9:].decode("utf-8")}
+        return json.loads(payload.decode("utf-8"))
+
+    def feed(self, data):
+        """Returns the complete messages in data; raises ValueError on a malformed record."""
+        self.buffer += data
+        messages = []
+        while len(self.buffer) >= 3:
+            kind, length = struct.unpack_from("<BH", self.buffer)
+            if len(self.buffer) < 3 + length:
+                break
+            payload = self.buffer[3:3 + length]
+            self.buffer = self.buffer[3 + length:]
+            try:
+                messages.append(self.decode_record(kind, payload))
+            except (struct.error, IndexError, KeyError, UnicodeDecodeError) as e:
+                raise ValueError(f"Malformed compact record of kind {kind}: {e!r}") from e
+        return messages
+
+
+def negotiate_wire(sock, mode="json", timeout=1.0):
+    """Picks the Unity socket encoding: "json", "compact", or "auto" to ask the receiver.
+
+    In auto mode a HELLO line listing the supported encodings is sent and the
+    receiver may answer with {"type": "HELLO", "encoding": ...}. Receivers
+    that do not answer within timeout (existing Admin Terminal builds) get JSON.
+    """
+    encoding = mode
+    if mode == "auto":
+        encoding = "json"
+        try:
+            sock.sendall((json.dumps({"type": "HELLO", "encodings": ["compact", "json"]}) + "\n").encode("utf-8"))
+            sock.settimeout(timeout)
+            reply = b""
+            while not reply.endswith(b"\n"):
+                chunk = sock.recv(256)
+                if not chunk:
+                    break
+                reply += chunk
+            encoding = json.loads(reply.decode("utf-8")).get("encoding", "json")
+        except (OSError, ValueError, AttributeError):
+            pass
+        finally:
+            sock.settimeout(None)
+
+    encoder = CompactEncoder() if encoding == "compact" else JsonEncoder()
+    print(f"Using {encoder.name} encoding for Unity messages")
+    return encoder
+
+
+def send_message(sock, msg):
+    if isinstance(sock, UnityWriter):
+        sock.submit(msg)
+        return
+    with send_lock:
+        sock.sendall(JsonEncoder().encode(msg))
+
+
 def send_log(sock, text, severity=1):
     log_msg = {
         "type": "LOG",
@@ -18,13 +472,380 @@ def send_log(sock, text, severity=1):
         "timestamp": int(time.time() * 1000)
     }
     try:
-        sock.sendall((json.dumps(log_msg) + "\n").encode("utf-8"))
+        send_message(sock, log_msg)
     except Exception:
         pass
 
     print(f"[LOG-{severity}] {text}")
 
 
+class UnityWriter:
+    """Owns the Unity socket and sends queued messages from a background thread.
+
+    submit() never blocks: messages go into a bounded buffer and the writer
+    thread encodes everything pending into one sendall. A newer DRONE state
+    replaces a queued one of the same drone, and when the buffer is full the
+    oldest lowest-priority message is dropped (DRONE before LOG before TAG).
+    Messages carrying a "trace" get its "send" stamp when they are written.
+    If the peer goes away the writer reconnects and renegotiates the encoding.
+    Without a socket it connects from its own thread, so startup can go on
+    while Unity is not up yet; messages queue until the connection is made.
+    """
+
+    PRIORITY = {"DRONE": 0, "METRICS": 0, "LOG": 1, "TAG": 2}
+
+    def __init__(self, sock, host, port, wire_mode="json", max_messages=1024, retry_delay=2.0, recorder=None):
+        self.sock = sock
+        self.host = host
+        self.port = port
+        self.wire_mode = wire_mode
+        self.max_messages = max_messages
+        self.retry_delay = retry_delay
+        self.encoder = negotiate_wire(sock, wire_mode) if sock is not None else None
+        self.cond = threading.Condition()
+        self.queue = deque()
+        self.closed = False
+        self.sent = 0
+        self.bytes_sent = 0
+        self.writes = 0
+        self.reconnects = 0
+        self.dropped = {}
+        self.recorder = recorder
+        self.thread = threading.Thread(target=self.run, name="unity-writer", daemon=True)
+        self.thread.start()
+
+    def drop(self, msg):
+        mtype = msg.get("type")
+        self.dropped[mtype] = self.dropped.get(mtype, 0) + 1
+
+    def submit(self, msg):
+        if self.recorder is not None:
+            self.recorder.write_message(msg)
+        priority = self.PRIORITY.get(msg.get("type"), 1)
+        with self.cond:
+            if self.closed:
+                return
+            if msg.get("type") == "DRONE":
+                for i, queued in enumerate(self.queue):
+                    if queued.get("type") == "DRONE" and queued.get("id") == msg.get("id"):
+                        # Keep the queue position but carry over STATUSTEXT events that were never sent.
+                        if queued.get("messages"):
+                            msg = dict(msg, messages=queued["messages"] + (msg.get("messages") or []))
+                        self.queue[i] = msg
+                        self.drop(queued)
+                        self.cond.notify()
+                        return
+            if len(self.queue) >= self.max_messages:
+                victim = min(range(len(self.queue)), key=lambda i: self.PRIORITY.get(self.queue[i].get("type"), 1))
+                if self.PRIORITY.get(self.queue[victim].get("type"), 1) > priority:
+                    self.drop(msg)
+                    return
+                self.drop(self.queue[victim])
+                del self.queue[victim]
+            self.queue.append(msg)
+            self.cond.notify()
+
+    def run(self):
+        if self.sock is None:
+            if not self.connect():
+                return
+            print("Connected to Unity")
+            # Sent ahead of whatever queued up while connecting, but recorded like any other message.
+            msg = {"type": "LOG", "severity": 3, "text": "Connected to Unity", "timestamp": int(time.time() * 1000)}
+            if self.recorder is not None:
+                self.recorder.write_message(msg)
+            with self.cond:
+                self.queue.appendleft(msg)
+        while True:
+            with self.cond:
+                while not self.queue and not self.closed:
+                    self.cond.wait(0.5)
+                if not self.queue:
+                    return
+                batch = list(self.queue)
+                self.queue.clear()
+
+            sent_at = time.monotonic_ns()
+            for msg in batch:
+                if "trace" in msg:
+                    msg["trace"]["send"] = sent_at
+            data = b"".join(self.encoder.encode(msg) for msg in batch)
+            start = time.perf_counter()
+            try:
+                self.sock.sendall(data)
+                metrics.observe("send", time.perf_counter() - start)
+            except OSError as e:
+                print(f"Unity connection lost: {e}")
+                with self.cond:
+                    # TAG updates are worth resending after reconnecting; stale telemetry is not.
+                    for msg in reversed(batch):
+                        if msg.get("type") == "TAG":
+                            self.queue.appendleft(msg)
+                        else:
+                            self.drop(msg)
+                if not self.reconnect():
+                    return
+                continue
+
+            self.sent += len(batch)
+            self.bytes_sent += len(data)
+            self.writes += 1
+
+    def connect(self):
+        while not self.closed:
+            try:
+                sock = socket.create_connection((self.host, self.port), timeout=self.retry_delay)
+                sock.settimeout(None)
+            except OSError as e:
+                print(f"Unity not available yet: {e}. Retrying in {self.retry_delay} seconds...")
+                time.sleep(self.retry_delay)
+                continue
+            self.sock = sock
+            self.encoder = negotiate_wire(sock, self.wire_mode)
+            return True
+        return False
+
+    def reconnect(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+        if not self.connect():
+            return False
+        self.reconnects += 1
+        self.submit({"type": "LOG", "severity": 3, "text": "Reconnected to Unity",
+                     "timestamp": int(time.time() * 1000)})
+        return True
+
+    def stats(self):
+        with self.cond:
+            return {"queue_depth": len(self.queue), "sent": self.sent, "bytes": self.bytes_sent,
+                    "writes": self.writes, "reconnects": self.reconnects, "dropped": dict(self.dropped)}
+
+    def close(self, timeout=2.0):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join(timeout)
+        try:
+            if self.sock is not None:
+                self.sock.close()
+        except OSError:
+            pass
+
+
+class MatchRecorder:
+    """Append-only recording of everything a run sends to Unity, for replay with match_replay.py.
+
+    Each record is a <QBI header (wall-clock microseconds, kind, length)
+    followed by the payload: a compact JSON message, a raw MAVLink packet or
+    the number of a frame written to the companion .avi. Roughly every
+    index_interval seconds a (timestamp, offset) pair is appended to the
+    .idx sidecar and both files are flushed, so a crash loses at most that
+    much and replay can seek without scanning.
+    """
+
+    MAGIC = b"DCFREC1\n"
+    RECORD = struct.Struct("<QBI")
+    INDEX = struct.Struct("<QQ")
+    MESSAGE, MAVLINK, FRAME = range(3)
+
+    def __init__(self, path, mavlink=False, video=False, video_fps=30.0, index_interval=1.0):
+        self.path = path
+        self.mavlink = mavlink
+        self.video = video
+        self.video_fps = video_fps
+        self.index_interval = int(index_interval * 1e6)
+        self.lock = threading.Lock()
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, "ab")
+        if new:
+            self.file.write(self.MAGIC)
+        self.index = open(path + ".idx", "ab")
+        self.last_index = 0
+        self.records = 0
+        self.writer = None
+        self.frame_count = 0
+
+    def write(self, kind, payload):
+        ts = int(time.time() * 1e6)
+        with self.lock:
+            if self.file.closed:
+                return
+            if ts - self.last_index >= self.index_interval:
+                self.index.write(self.INDEX.pack(ts, self.file.tell()))
+                self.file.flush()
+                self.index.flush()
+                self.last_index = ts
+            self.file.write(self.RECORD.pack(ts, kind, len(payload)))
+            self.file.write(payload)
+            self.records += 1
+
+    def write_message(self, msg):
+        self.write(self.MESSAGE, json.dumps(msg, separators=(",", ":")).encode("utf-8"))
+
+    def write_mavlink(self, msg):
+        if self.mavlink:
+            self.write(self.MAVLINK, bytes(msg.get_msgbuf()))
+
+    def write_frame(self, frame):
+        if not self.video:
+            return
+        if self.writer is None:
+            h, w = frame.shape[:2]
+            self.writer = cv2.VideoWriter(os.path.splitext(self.path)[0] + ".avi",
+                                          cv2.VideoWriter_fourcc(*"MJPG"), self.video_fps, (w, h))
+        if frame.ndim == 2:
+            frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+        elif frame.shape[2] == 2:
+            frame = cv2.cvtColor(frame, cv2.COLOR_YUV2BGR_YUYV)
+        self.writer.write(frame)
+        self.write(self.FRAME, struct.pack("<I", self.frame_count))
+        self.frame_count += 1
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+            self.index.close()
+        if self.writer is not None:
+            self.writer.release()
+
+
+class PoseBuffer:
+    """Time-indexed history of LOCAL_POSITION_NED and ATTITUDE samples.
+
+    Samples are keyed by the flight controller's time_boot_ms, mapped onto the
+    local time.monotonic() clock with the smallest receive-minus-boot offset
+    seen recently (the least delayed message), so batched reads do not skew
+    them. at(t) interpolates the pose at any local instant, e.g. when a frame
+    was captured.
+    """
+
+    SERIES = {"LOCAL_POSITION_NED": ("x", "y", "z", "vx", "vy", "vz"), "ATTITUDE": ("roll", "pitch", "yaw")}
+
+    def __init__(self, maxlen=256, offset_window=100, max_extrapolate=0.25):
+        self.max_extrapolate = max_extrapolate
+        self.lock = threading.Lock()
+        self.times = {mtype: deque(maxlen=maxlen) for mtype in self.SERIES}
+        self.values = {mtype: deque(maxlen=maxlen) for mtype in self.SERIES}
+        self.offsets = deque(maxlen=offset_window)
+        self.last_boot = None
+
+    def add(self, msg, received=None):
+        mtype = msg.get_type()
+        fields = self.SERIES.get(mtype)
+        if fields is None:
+            return
+        received = time.monotonic() if received is None else received
+        boot = msg.time_boot_ms / 1000.0
+
+        with self.lock:
+            if self.last_boot is not None and boot < self.last_boot - 1.0:
+                # Flight controller rebooted: its clock restarted.
+                self.offsets.clear()
+                for mtype_ in self.SERIES:
+                    self.times[mtype_].clear()
+                    self.values[mtype_].clear()
+            self.last_boot = boot
+            self.offsets.append(received - boot)
+            t = boot + min(self.offsets)
+
+            times = self.times[mtype]
+            if times and t <= times[-1]:
+                return
+            times.append(t)
+            self.values[mtype].append(tuple(getattr(msg, name) for name in fields))
+
+    def at(self, t):
+        """Pose interpolated at local monotonic time t, or None before any sample arrived.
+
+        Past the newest sample (in drain mode samples arrive once per telemetry
+        tick) the last two samples are extrapolated for up to max_extrapolate.
+        """
+        pose = {}
+        with self.lock:
+            for mtype, fields in self.SERIES.items():
+                times, values = self.times[mtype], self.values[mtype]
+                if not times:
+                    continue
+                i = bisect.bisect_left(times, t)
+                if i == 0 or len(times) == 1:
+                    sample = values[0] if i == 0 else values[-1]
+                else:
+                    i = min(i, len(times) - 1)
+                    t0, t1 = times[i - 1], times[i]
+                    f = (min(t, t1 + self.max_extrapolate) - t0) / (t1 - t0)
+                    v0, v1 = values[i - 1], values[i]
+                    sample = tuple(a + (b - a) * f if name != "yaw"
+                                   else (a + ((b - a + math.pi) % (2 * math.pi) - math.pi) * f + math.pi)
+                                   % (2 * math.pi) - math.pi
+                                   for name, a, b in zip(fields, v0, v1))
+                pose.update(zip(fields, sample))
+        return pose or None
+
+
+class MavlinkInbox:
+    """Coalesces incoming MAVLink messages into the latest one per type.
+
+    In drain mode update_drone_state empties the receive buffer every tick;
+    in threaded mode a dedicated reader thread feeds the inbox instead.
+    """
+
+    # Every message of these types matters, so they are queued instead of coalesced.
+    KEEP_ALL = ("STATUSTEXT",)
+
+    def __init__(self, threaded=False, max_drain=1000, poses=None, recorder=None):
+        self.threaded = threaded
+        self.max_drain = max_drain
+        self.poses = poses
+        self.recorder = recorder
+        self.lock = threading.Lock()
+        self.latest = {}
+        self.events = []
+        self.received = {}
+        self.dropped = {}
+        # time.monotonic_ns() when the newest message of each type was read off the link.
+        self.read_at = {}
+
+    def add(self, msg):
+        mtype = msg.get_type()
+        if mtype == "BAD_DATA":
+            return
+        if self.recorder is not None:
+            self.recorder.write_mavlink(msg)
+        if self.poses is not None:
+            # Coalescing keeps only the newest pose; the buffer keeps the history.
+            self.poses.add(msg)
+        with self.lock:
+            self.received[mtype] = self.received.get(mtype, 0) + 1
+            self.read_at[mtype] = time.monotonic_ns()
+            if mtype in self.KEEP_ALL:
+                self.events.append(msg)
+                return
+            if mtype in self.latest:
+                self.dropped[mtype] = self.dropped.get(mtype, 0) + 1
+            self.latest[mtype] = msg
+
+    def drain(self, master):
+        for _ in range(self.max_drain):
+            msg = master.recv_match(blocking=False)
+            if msg is None:
+                break
+            self.add(msg)
+
+    def take(self):
+        with self.lock:
+            messages = list(self.latest.values()) + self.events
+            self.latest = {}
+            self.events = []
+        return messages
+
+    def counters(self):
+        with self.lock:
+            return {mtype: {"received": count, "dropped": self.dropped.get(mtype, 0)}
+                    for mtype, count in self.received.items()}
+
+
 def init_drone_state(type_val="DRONE", id_val=1):
     return {
         "type": type_val,
@@ -48,7 +869,6 @@ def init_drone_state(type_val="DRONE", id_val=1):
 
 def create_master(sock, endpoint="udp:0.0.0.0:14550", update_rate=10):
     send_log(sock, "Waiting for heartbeat...", severity=2)
-    time.sleep(1)
     master = mavutil.mavlink_connection(endpoint)
     try:
         master.wait_heartbeat()
@@ -70,7 +890,7 @@ def create_master(sock, endpoint="udp:0.0.0.0:14550", update_rate=10):
 
 
 
-def update_drone_state(sock, master, drone_state):
+def update_drone_state(sock, master, drone_state, inbox=None):
 
     if master is None:
         # summy data
@@ -93,12 +913,24 @@ def update_drone_state(sock, master, drone_state):
         })
         return
 
-    msg = master.recv_match(blocking=False)
-    if not msg:
+    if inbox is None:
+        inbox = MavlinkInbox()
+    if not inbox.threaded:
+        inbox.drain(master)
+
+    messages = inbox.take()
+    if not messages:
         return
 
-    mtype = msg.get_type()
     now = time.time()
+    for msg in messages:
+        apply_mavlink_message(master, drone_state, msg, now)
+
+    drone_state["timestamp"] = int(now * 1000)
+
+
+def apply_mavlink_message(master, drone_state, msg, now):
+    mtype = msg.get_type()
 
     if mtype == "HEARTBEAT":
         base_mode = msg.base_mode
@@ -129,7 +961,13 @@ def update_drone_state(sock, master, drone_state):
                      "timestamp": int(now * 1000)}
         drone_state["messages"].append(log_entry)
 
-    drone_state["timestamp"] = int(now * 1000)
+
+def mavlink_reader_loop(master, inbox, stop):
+    while not stop.is_set():
+        profiler.tick()
+        msg = master.recv_match(blocking=True, timeout=0.5)
+        if msg is not None:
+            inbox.add(msg)
 
 
 def wait_for_unity(unity_host, unity_port, retry_delay=5):
@@ -145,10 +983,28 @@ def wait_for_unity(unity_host, unity_port, retry_delay=5):
             sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 
 
-def wait_for_camera(sock, retry_delay=5):
+def wait_for_camera(sock, retry_delay=5, index=0, width=None, height=None, fps=None, buffer_size=None, gray=False):
     while True:
-        cap = cv2.VideoCapture(0)
+        cap = cv2.VideoCapture(index)
         if cap.isOpened():
+            if width:
+                cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+            if height:
+                cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+            if fps:
+                cap.set(cv2.CAP_PROP_FPS, fps)
+            if buffer_size:
+                cap.set(cv2.CAP_PROP_BUFFERSIZE, buffer_size)
+            if gray:
+                # Raw output is GREY/Y800 (h, w) or YUYV (h, w, 2) on cameras that support it; anything
+                # else (MJPG arrives as one row of compressed bytes) goes back to decoded BGR.
+                cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+                ret, frame = cap.read()
+                if ret and ((frame.ndim == 2 and frame.shape[0] > 1) or (frame.ndim == 3 and frame.shape[2] == 2)):
+                    send_log(sock, "Camera delivers luma directly, skipping BGR conversion", severity=3)
+                else:
+                    cap.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+                    send_log(sock, "Camera has no raw gray output, converting from BGR", severity=2)
             send_log(sock, "Camera opened successfully", severity=3)
             return cap
         else:
@@ -157,97 +1013,1683 @@ def wait_for_camera(sock, retry_delay=5):
             time.sleep(retry_delay)
 
 
-def decode_tag(sock, tag_id, match_key, server_url):
+TAGS_DIR = next((d for d in (os.path.join(os.path.dirname(os.path.abspath(__file__)), "Tags"),
+                             os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Tags"))
+                 if os.path.isdir(d)), "Tags")
+
+
+def render_svg_tag(path, cell_px=10):
+    """Rasterizes one of the Tags/ SVGs (filled M/L paths on a 10x10 grid in a 100x100 viewBox).
+
+    Each grid cell takes the color of the last path covering its center, which
+    keeps cell edges exact instead of inheriting fillPoly's inclusive borders.
+    """
+    with open(path) as f:
+        svg = f.read()
+
+    grid = np.zeros((10, 10), np.uint8)
+    for fill, d in re.findall(r'fill:#([0-9a-fA-F]{6})[^"]*"\s+d="([^"]+)"', svg):
+        color = int(fill[:2], 16)
+        polygons = []
+        for sub in re.findall(r"M[^Mz]+", d):
+            coords = [float(v) for v in re.findall(r"-?\d+(?:\.\d+)?", sub)]
+            polygons.append(np.array(coords, np.float32).reshape(-1, 2))
+        for row in range(10):
+            for col in range(10):
+                point = (col * 10 + 5.0, row * 10 + 5.0)
+                inside = sum(cv2.pointPolygonTest(poly, point, False) > 0 for poly in polygons)
+                if inside % 2:
+                    grid[row, col] = color
+    return np.kron(grid, np.ones((cell_px, cell_px), np.uint8))
+
+
+def load_tag_images(tags_dir=TAGS_DIR, cell_px=10):
+    tags = {}
+    for path in glob.glob(os.path.join(tags_dir, "tag36h11-*.svg")):
+        tag_id = int(re.search(r"tag36h11-(\d+)\.svg$", path).group(1))
+        tags[tag_id] = render_svg_tag(path, cell_px)
+    return tags
+
+
+def render_scene(rng, tags, width=1280, height=720, count=4, min_size=40, max_size=200,
+                 max_rotation=180.0, blur=0.0, noise=0.0):
+    """Pastes randomly scaled/rotated tags on a background. Returns (bgr_frame, [(tag_id, cx, cy), ...])."""
+    frame = np.full((height, width), 170, np.float32)
+    frame += cv2.resize(rng.uniform(-30, 30, (height // 32 + 1, width // 32 + 1)).astype(np.float32),
+                        (width, height), interpolation=cv2.INTER_CUBIC)
+
+    truth = []
+    placed = []
+    tag_ids = rng.choice(sorted(tags), size=min(count, len(tags)), replace=False)
+    for tag_id in tag_ids:
+        tag = tags[int(tag_id)]
+        size = rng.uniform(min_size, max_size)
+        radius = size * math.sqrt(2) / 2
+        for _ in range(50):
+            cx = rng.uniform(radius, width - radius)
+            cy = rng.uniform(radius, height - radius)
+            if all(math.hypot(cx - px, cy - py) > radius + pr for px, py, pr in placed):
+                break
+        else:
+            continue
+
+        # OpenCV addresses pixel centers, so the tag's geometric center is at (n - 1) / 2.
+        tag_center = ((tag.shape[1] - 1) / 2.0, (tag.shape[0] - 1) / 2.0)
+        scale = size / tag.shape[0]
+        m = cv2.getRotationMatrix2D(tag_center, rng.uniform(-max_rotation, max_rotation), scale)
+        m[0, 2] += cx - tag_center[0]
+        m[1, 2] += cy - tag_center[1]
+        warped = cv2.warpAffine(tag.astype(np.float32), m, (width, height), flags=cv2.INTER_LINEAR)
+        mask = cv2.warpAffine(np.ones(tag.shape, np.float32), m, (width, height), flags=cv2.INTER_LINEAR)
+        frame = frame * (1 - mask) + warped * mask
+
+        placed.append((cx, cy, radius))
+        # AprilTag reports coordinates with pixel centers at i + 0.5.
+        truth.append((int(tag_id), cx + 0.5, cy + 0.5))
+
+    if blur > 0:
+        frame = cv2.GaussianBlur(frame, (0, 0), blur)
+    if noise > 0:
+        frame += rng.normal(0, noise, frame.shape)
+    gray = np.clip(frame, 0, 255).astype(np.uint8)
+    return cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR), truth
+
+
+class ReplaySource(ABC):
+    """Base for recorded and synthetic frame sources, read like a cv2.VideoCapture.
+
+    rate is "realtime" (the source's native FPS), "max" (as fast as frames
+    can be produced) or a fixed FPS. read() returns (False, None) at the end
+    of the stream unless loop is set. Subclasses implement next_frame() and
+    rewind(); skip_frame() can be overridden when a frame is cheaper to skip
+    than to produce.
+    """
+
+    def __init__(self, rate="realtime", native_fps=30.0, loop=False):
+        if rate == "max":
+            self.period = 0.0
+        elif rate == "realtime":
+            self.period = 1.0 / native_fps
+        else:
+            self.period = 1.0 / float(rate)
+        self.loop = loop
+        self.next_due = None
+
+    @abstractmethod
+    def next_frame(self, image=None):
+        """Returns the next frame (into image when possible), or None at the end of the stream."""
+
+    @abstractmethod
+    def rewind(self):
+        """Goes back to the first frame."""
+
+    def skip_frame(self):
+        return self.next_frame() is not None
+
+    def pace(self):
+        # Pace before producing the frame so it is fresh when read() returns (the simulator renders on demand).
+        if self.period:
+            now = time.monotonic()
+            if self.next_due is None or self.next_due < now - self.period:
+                self.next_due = now
+            elif self.next_due > now:
+                time.sleep(self.next_due - now)
+            self.next_due += self.period
+
+    def grab(self):
+        """Like VideoCapture.grab: moves past one frame, paced like read(), without handing it out."""
+        self.pace()
+        if self.skip_frame():
+            return True
+        if self.loop:
+            self.rewind()
+            return self.skip_frame()
+        return False
+
+    def read(self, image=None):
+        """Like VideoCapture.read: fills image when given and the frame size matches."""
+        self.pace()
+        frame = self.next_frame(image)
+        if frame is None and self.loop:
+            self.rewind()
+            frame = self.next_frame(image)
+        if frame is None:
+            return False, None
+        if image is not None and frame is not image and frame.shape == image.shape and frame.dtype == image.dtype:
+            np.copyto(image, frame)
+            frame = image
+        return True, frame
+
+    def isOpened(self):
+        return True
+
+    def release(self):
+        pass
+
+
+class VideoFileSource(ReplaySource):
+    def __init__(self, path, rate="realtime", loop=False):
+        self.path = path
+        self.cap = cv2.VideoCapture(path)
+        if not self.cap.isOpened():
+            raise RuntimeError(f"Could not open video {path}")
+        super().__init__(rate, self.cap.get(cv2.CAP_PROP_FPS) or 30.0, loop)
+
+    def next_frame(self, image=None):
+        ret, frame = self.cap.read(image)
+        return frame if ret else None
+
+    def skip_frame(self):
+        return self.cap.grab()
+
+    def rewind(self):
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+    def release(self):
+        self.cap.release()
+
+
+class ImageDirectorySource(ReplaySource):
+    EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+
+    def __init__(self, path, rate="realtime", loop=False, fps=30.0):
+        self.paths = sorted(p for p in glob.glob(os.path.join(path, "*")) if p.lower().endswith(self.EXTENSIONS))
+        if not self.paths:
+            raise RuntimeError(f"No images found in {path}")
+        self.index = 0
+        super().__init__(rate, fps, loop)
+
+    def skip_frame(self):
+        self.index += 1
+        return self.index <= len(self.paths)
+
+    def next_frame(self, image=None):
+        while self.index < len(self.paths):
+            frame = cv2.imread(self.paths[self.index])
+            self.index += 1
+            if frame is not None:
+                return frame
+        return None
+
+    def rewind(self):
+        self.index = 0
+
+
+class SyntheticSource(ReplaySource):
+    """Cycles through a pool of pre-rendered tag scenes built from the Tags/ SVGs."""
+
+    def __init__(self, rate="realtime", loop=True, fps=30.0, width=1280, height=720, count=4, pool=30, seed=0):
+        tags = load_tag_images()
+        if not tags:
+            raise RuntimeError(f"No tag36h11-*.svg files found in {TAGS_DIR}")
+        rng = np.random.default_rng(seed)
+        self.scenes = [render_scene(rng, tags, width, height, count)[0] for _ in range(max(1, pool))]
+        self.index = 0
+        super().__init__(rate, fps, loop)
+
+    def next_frame(self, image=None):
+        if self.index >= len(self.scenes):
+            return None
+        frame = self.scenes[self.index]
+        self.index += 1
+        return frame
+
+    def rewind(self):
+        self.index = 0
+
+
+class TagField:
+    """The Tags/ tags lying on the ground (z = 0, NED) for the simulator.
+
+    layout is an optional JSON file {"tags": [{"id", "x", "y", "size", "yaw"}]}
+    with positions in meters and yaw in degrees; by default every tag image is
+    placed on a square grid around the origin. size is the black border edge,
+    as for AprilTag pose estimation.
+    """
+
+    def __init__(self, layout=None, tags_dir=TAGS_DIR, spacing=3.0, size=0.4):
+        images = load_tag_images(tags_dir)
+        if not images:
+            raise RuntimeError(f"No tag36h11-*.svg files found in {tags_dir}")
+        if layout:
+            with open(layout) as f:
+                entries = json.load(f)["tags"]
+        else:
+            ids = sorted(images)
+            cols = math.ceil(math.sqrt(len(ids)))
+            rows = math.ceil(len(ids) / cols)
+            entries = [{"id": tag_id, "x": ((rows - 1) / 2.0 - i // cols) * spacing,
+                        "y": (i % cols - (cols - 1) / 2.0) * spacing,
+                        "size": size, "yaw": (tag_id * 37) % 360} for i, tag_id in enumerate(ids)]
+
+        self.tags = []
+        for entry in entries:
+            image = images[int(entry["id"])]
+            psi = math.radians(entry.get("yaw", 0.0))
+            full = entry.get("size", size) * 10.0 / 8.0
+            right = np.array([-math.sin(psi), math.cos(psi), 0.0]) * full
+            down = np.array([-math.cos(psi), -math.sin(psi), 0.0]) * full
+            center = np.array([entry["x"], entry["y"], 0.0])
+            corners = np.array([center + (u - 0.5) * right + (v - 0.5) * down for u, v in ((0, 0), (1, 0), (1, 1), (0, 1))])
+            self.tags.append({"id": int(entry["id"]), "x": entry["x"], "y": entry["y"],
+                              "size": entry.get("size", size), "image": image, "corners": corners})
+        xs = [tag["x"] for tag in self.tags]
+        ys = [tag["y"] for tag in self.tags]
+        self.bounds = (min(xs), max(xs), min(ys), max(ys))
+
+
+class SimulatedDrone:
+    """Deterministic flight along a trajectory; pose(t) gives the state at t simulated seconds.
+
+    trajectory is "hover", "circle[:radius]", "lawnmower[:spacing]",
+    "random[:seed]" (random waypoints over the field) or "waypoints:file.json"
+    (a list of [x, y, z] NED points). The path is flown at a constant speed
+    and looped; yaw follows the direction of travel and roll/pitch the
+    acceleration, like a multirotor.
+    """
+
+    def __init__(self, trajectory="random", field=None, speed=3.0, altitude=8.0, seed=0, battery_minutes=20.0):
+        self.speed = speed
+        self.altitude = altitude
+        self.battery_minutes = battery_minutes
+        x0, x1, y0, y1 = field.bounds if field else (-5.0, 5.0, -5.0, 5.0)
+        kind, _, arg = trajectory.partition(":")
+        z = -altitude
+        if kind == "hover":
+            points = [((x0 + x1) / 2, (y0 + y1) / 2, z)]
+        elif kind == "circle":
+            radius = float(arg) if arg else max(x1 - x0, y1 - y0) / 2.0
+            points = [((x0 + x1) / 2 + radius * math.cos(a), (y0 + y1) / 2 + radius * math.sin(a), z)
+                      for a in np.linspace(0.0, 2 * math.pi, 73)]
+        elif kind == "lawnmower":
+            spacing = float(arg) if arg else 3.0
+            points = []
+            for i, x in enumerate(np.arange(x0, x1 + 1e-6, spacing)):
+                row = [(x, y0, z), (x, y1, z)]
+                points += row if i % 2 == 0 else row[::-1]
+            points.append(points[0])
+        elif kind == "random":
+            rng = np.random.default_rng(int(arg) if arg else seed)
+            points = [(rng.uniform(x0, x1), rng.uniform(y0, y1), z + rng.uniform(-1.0, 1.0)) for _ in range(50)]
+            points.append(points[0])
+        elif kind == "waypoints":
+            with open(arg) as f:
+                points = [tuple(p) for p in json.load(f)]
+        else:
+            raise ValueError(f"Unknown trajectory: {trajectory}")
+
+        self.points = np.array(points, dtype=float)
+        lengths = np.linalg.norm(np.diff(self.points, axis=0), axis=1) if len(points) > 1 else np.zeros(0)
+        self.lengths = lengths
+        self.cumulative = np.concatenate(([0.0], np.cumsum(lengths)))
+        self.total = float(self.cumulative[-1])
+
+    def position(self, t):
+        if self.total <= 0.0:
+            return self.points[0]
+        d = (self.speed * t) % self.total
+        i = min(int(np.searchsorted(self.cumulative, d, side="right")) - 1, len(self.lengths) - 1)
+        f = (d - self.cumulative[i]) / self.lengths[i] if self.lengths[i] else 0.0
+        return self.points[i] + (self.points[i + 1] - self.points[i]) * f
+
+    def pose(self, t, h=0.5):
+        """x, y, z, roll, pitch, yaw plus NED velocity (vx, vy, vz) at simulated time t."""
+        p = self.position(t)
+        velocity = (self.position(t + h) - self.position(t - h)) / (2 * h)
+        accel = (self.position(t + 2 * h) - 2 * p + self.position(t - 2 * h)) / (4 * h * h)
+        horizontal = math.hypot(velocity[0], velocity[1])
+        yaw = math.atan2(velocity[1], velocity[0]) if horizontal > 0.05 else 0.0
+        forward = accel[0] * math.cos(yaw) + accel[1] * math.sin(yaw)
+        right = -accel[0] * math.sin(yaw) + accel[1] * math.cos(yaw)
+        limit = math.radians(30.0)
+        pitch = max(-limit, min(limit, -math.atan2(forward, 9.81)))
+        roll = max(-limit, min(limit, math.atan2(right, 9.81)))
+        return {"x": float(p[0]), "y": float(p[1]), "z": float(p[2]), "roll": roll, "pitch": pitch, "yaw": yaw,
+                "vx": float(velocity[0]), "vy": float(velocity[1]), "vz": float(velocity[2])}
+
+    def battery(self, t):
+        return max(0, int(100 - t / (self.battery_minutes * 60.0) * 100))
+
+
+def project_tags(field, pose, camera):
+    """Pixel corners (AprilTag convention) of every field tag in front of the camera at pose."""
+    rotation = attitude_matrix(pose["roll"], pose["pitch"], pose["yaw"]) @ CAMERA_TO_BODY
+    position = np.array([pose["x"], pose["y"], pose["z"]])
+    projected = []
+    for tag in field.tags:
+        local = (tag["corners"] - position) @ rotation
+        if (local[:, 2] < 0.1).any():
+            continue
+        projected.append((tag, np.column_stack((local[:, 0] / local[:, 2] * camera.fx + camera.cx,
+                                                local[:, 1] / local[:, 2] * camera.fy + camera.cy))))
+    return projected
+
+
+def render_view(field, pose, camera, background):
+    """Renders what the downward camera sees of the tag field from a pose (BGR frame)."""
+    gray = background.copy()
+    h, w = gray.shape[:2]
+    for tag, corners in project_tags(field, pose, camera):
+        # OpenCV pixel centers sit 0.5 px before AprilTag's.
+        dst = corners - 0.5
+        x0, y0 = np.floor(dst.min(axis=0)).astype(int)
+        x1, y1 = np.ceil(dst.max(axis=0)).astype(int) + 1
+        x0, y0, x1, y1 = max(x0, 0), max(y0, 0), min(x1, w), min(y1, h)
+        if x1 - x0 < 2 or y1 - y0 < 2:
+            continue
+        image = tag["image"]
+        size = image.shape[0]
+        src = np.array([(-0.5, -0.5), (size - 0.5, -0.5), (size - 0.5, size - 0.5), (-0.5, size - 0.5)], np.float32)
+        homography = cv2.getPerspectiveTransform(src, (dst - (x0, y0)).astype(np.float32))
+        region = gray[y0:y1, x0:x1]
+        cv2.warpPerspective(image, homography, (x1 - x0, y1 - y0), dst=region, flags=cv2.INTER_LINEAR,
+                            borderMode=cv2.BORDER_TRANSPARENT)
+    return cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+
+
+def ground_texture(width, height, seed=0):
+    rng = np.random.default_rng(seed)
+    ground = np.full((height, width), 150, np.float32)
+    ground += cv2.resize(rng.uniform(-25, 25, (height // 32 + 1, width // 32 + 1)).astype(np.float32),
+                         (width, height), interpolation=cv2.INTER_CUBIC)
+    return np.clip(ground, 0, 255).astype(np.uint8)
+
+
+class SimClock:
+    """Simulated seconds since start, running speed times faster than the wall clock."""
+
+    def __init__(self, speed=1.0):
+        self.start = time.monotonic()
+        self.speed = speed
+
+    def __call__(self):
+        return (time.monotonic() - self.start) * self.speed
+
+
+class SimulatedCameraSource(ReplaySource):
+    """Camera frames rendered from a SimulatedDrone's pose at the current simulated time."""
+
+    def __init__(self, drone, field, clock, rate="realtime", fps=30.0, width=1280, height=720, hfov=78.0):
+        self.drone = drone
+        self.field = field
+        self.clock = clock
+        self.camera = CameraModel(width, height, hfov=hfov)
+        self.background = ground_texture(width, height)
+        super().__init__(rate, fps, loop=False)
+
+    def next_frame(self, image=None):
+        return render_view(self.field, self.drone.pose(self.clock()), self.camera, self.background)
+
+    def skip_frame(self):
+        return True
+
+    def rewind(self):
+        pass
+
+
+class SimulatedMaster:
+    """Stands in for the pymavlink connection, emitting MAVLink messages of a SimulatedDrone.
+
+    LOCAL_POSITION_NED and ATTITUDE stream at pose_rate, HEARTBEAT,
+    BATTERY_STATUS and RADIO_STATUS at 1 Hz, all stamped with the simulated
+    time_boot_ms and packed so they can be recorded like real traffic.
+    """
+
+    def __init__(self, drone, clock, pose_rate=30.0):
+        self.drone = drone
+        self.clock = clock
+        self.flightmode = "GUIDED"
+        self.target_system = 1
+        self.target_component = 1
+        self.mav = mavutil.mavlink.MAVLink(None, srcSystem=1, srcComponent=1)
+        self.schedule = [[0.0, 1.0 / pose_rate, "pose"], [0.0, 1.0, "status"]]
+        self.pending = deque()
+
+    def generate(self, kind, t):
+        ms = int(t * 1000)
+        if kind == "pose":
+            pose = self.drone.pose(t)
+            return [mavutil.mavlink.MAVLink_local_position_ned_message(ms, pose["x"], pose["y"], pose["z"],
+                                                                       pose["vx"], pose["vy"], pose["vz"]),
+                    mavutil.mavlink.MAVLink_attitude_message(ms, pose["roll"], pose["pitch"], pose["yaw"], 0, 0, 0)]
+        battery = self.drone.battery(t)
+        return [mavutil.mavlink.MAVLink_heartbeat_message(
+                    mavutil.mavlink.MAV_TYPE_QUADROTOR, mavutil.mavlink.MAV_AUTOPILOT_ARDUPILOTMEGA,
+                    mavutil.mavlink.MAV_MODE_FLAG_SAFETY_ARMED | mavutil.mavlink.MAV_MODE_FLAG_CUSTOM_MODE_ENABLED,
+                    4, mavutil.mavlink.MAV_STATE_ACTIVE, 3),
+                mavutil.mavlink.MAVLink_battery_status_message(
+                    0, 0, 0, 2500, [int(11100 + 15 * battery)] + [65535] * 9, 1500, -1, -1, battery),
+                mavutil.mavlink.MAVLink_radio_status_message(200, 200, 100, 40, 40, 0, 0)]
+
+    def recv_match(self, blocking=False, timeout=None):
+        deadline = time.monotonic() + (timeout or 0.0)
+        while not self.pending:
+            now = self.clock()
+            entry = min(self.schedule)
+            if entry[0] <= now:
+                # Skip ahead instead of replaying a long backlog after a stall.
+                entry[0] = max(entry[0], now - 1.0)
+                for msg in self.generate(entry[2], entry[0]):
+                    msg.pack(self.mav)
+                    self.pending.append(msg)
+                entry[0] += entry[1]
+                break
+            if not blocking or time.monotonic() >= deadline:
+                return None
+            time.sleep(min((entry[0] - now) / self.clock.speed, max(0.0, deadline - time.monotonic())))
+        return self.pending.popleft()
+
+    def close(self):
+        pass
+
+
+def open_frame_source(sock, source="camera:0", rate="realtime", loop=False, width=None, height=None, fps=None,
+                      buffer_size=None, simulator=None, gray=False):
+    """Opens a frame source from a "kind[:arg]" spec: camera[:index], video:path, images:dir, synthetic[:count]
+    or sim (the simulated drone's camera; simulator holds the SimulatedCameraSource arguments).
+    gray asks a camera for raw luma output instead of BGR where the device supports it."""
+    kind, _, arg = source.partition(":")
+    if kind == "camera":
+        return wait_for_camera(sock, index=int(arg or 0), width=width, height=height, fps=fps,
+                               buffer_size=buffer_size, gray=gray)
+    if kind == "video":
+        cap = VideoFileSource(arg, rate=rate, loop=loop)
+    elif kind == "images":
+        cap = ImageDirectorySource(arg, rate=rate, loop=loop, fps=fps or 30.0)
+    elif kind == "synthetic":
+        cap = SyntheticSource(rate=rate, loop=True, fps=fps or 30.0, width=width or 1280, height=height or 720,
+                              count=int(arg or 4))
+    elif kind == "sim":
+        if simulator is None:
+            raise ValueError("The sim frame source needs --simulate")
+        cap = SimulatedCameraSource(rate=rate, fps=fps or 30.0, width=width or 1280, height=height or 720,
+                                    **simulator)
+    else:
+        raise ValueError(f"Unknown frame source: {source}")
+    send_log(sock, f"Replaying frames from {source} at {rate} rate", severity=3)
+    return cap
+
+
+def create_session(pool_size=4):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def verify_match_key(sock, match_key, server_url, session=requests):
+    """Returns True/False for a valid/invalid key, or None if the server is unreachable."""
     try:
-        verify_resp = requests.get(f"{server_url}/verify_match_key", params={"match_key": match_key}, timeout=2)
+        verify_resp = session.get(f"{server_url}/verify_match_key", params={"match_key": match_key}, timeout=2)
         if verify_resp.status_code == 404:
             send_log(sock, f"Invalid match_key: {match_key}", severity=1)  # Error
-            # raise RuntimeError(f"Invalid match_key: {match_key}")
+            return False
         elif verify_resp.status_code != 200:
             send_log(sock, f"Error verifying match_key: {verify_resp.status_code}", severity=1)  # Error
-            # raise RuntimeError(f"Error verifying match_key: {verify_resp.status_code}")
+            return None
+        return True
     except requests.exceptions.RequestException as e:
         send_log(sock, f"Could not reach the decoder server!", severity=1)  # Error
-        # raise RuntimeError(f"Match key verification failed: {e}")
+        return None
+
 
+def fetch_points_batch(sock, tag_ids, match_key, server_url, session=requests):
+    """Resolves many tags in one /decode_batch call. Returns {tag_id: points} or None on failure."""
     try:
-        r = requests.get(f"{server_url}/decode", params={"tag_id": str(tag_id), "match_key": match_key}, timeout=2)
+        r = session.post(f"{server_url}/decode_batch",
+                         json={"match_key": match_key, "tag_ids": [str(t) for t in tag_ids]}, timeout=2)
+        if r.status_code == 403:
+            send_log(sock, f"Invalid match_key: {match_key}", severity=1)  # Error
+            return None
         r.raise_for_status()
         data = r.json()
-        if "points" in data:
-            send_log(sock, f"Tag {tag_id} decoded successfully: {data['points']} points", severity=3)  # Success
-            return data["points"]
-        else:
-            send_log(sock, f"Decoder error for tag {tag_id}: {data.get('error', 'Unknown error')}", severity=2)  # Warning
-            # raise RuntimeError(f"Decoder error for tag {tag_id}: {data.get('error', 'Unknown error')}")
-    except requests.exceptions.RequestException as e:
+        for tid in data.get("unknown", []):
+            send_log(sock, f"Decoder error for tag {tid}: Unknown tag_id", severity=2)  # Warning
+        return {int(tid): pts for tid, pts in data.get("points", {}).items()}
+    except (requests.exceptions.RequestException, ValueError) as e:
         send_log(sock, f"Decoder server not reachable: {e}", severity=2)  # Warning
-        # raise RuntimeError(f"Decoder server not reachable: {e}")
+        return None
+
+
+class TagDecoder:
+    """Caches decoded points per (match_key, tag_id) over a pooled HTTP session.
+
+    The match key is verified once; an invalid or unreachable key clears the
+    cache and is re-verified at most every verify_retry seconds. request()
+    never touches the network: misses are resolved on a background pool,
+    each tag at most once at a time, and failures are cached for negative_ttl.
+    While a pushed mapping bundle is installed every lookup is answered from
+    it and the server is not asked at all.
+    """
 
+    def __init__(self, match_key, server_url, ttl=300.0, pool_size=4, verify_retry=5.0,
+                 negative_ttl=10.0, workers=2):
+        self.match_key = match_key
+        self.server_url = server_url
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.verify_retry = verify_retry
+        self.session = create_session(max(pool_size, workers))
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="decode")
+        self.lock = threading.Lock()
+        self.cache = {}
+        self.in_flight = set()
+        self.verified = None
+        self.next_verify = 0.0
+        self.bundle = None
+        self.revoked = 0
 
+    def install_bundle(self, payload):
+        """Installs a verified bundle payload; returns False if it is older than the current one or revoked."""
+        points = {int(tid) if str(tid).isdigit() else tid: pts for tid, pts in payload["mapping"].items()}
+        with self.lock:
+            current = self.bundle["version"] if self.bundle else self.revoked
+            if payload["version"] <= current:
+                return False
+            self.bundle = {"version": payload["version"], "expires": payload.get("expires"), "points": points}
+            self.cache.clear()
+            self.verified = True
+        return True
 
-def main(unity_host, unity_port, match_key, server_url):
-    at_detector = Detector(families="tag36h11")
-    
-    sock = wait_for_unity(unity_host, unity_port)
-    cap = wait_for_camera(sock)
-    decode_tag(sock, 1, match_key, server_url)
+    def revoke_bundle(self, revoked):
+        with self.lock:
+            self.bundle = None
+            self.revoked = max(self.revoked, int(revoked * 1e6))
+            self.cache.clear()
+            self.verified = None
+            self.next_verify = 0.0
 
-    master = create_master(sock)
-    drone_state = init_drone_state()
+    def local_points(self):
+        """The installed bundle's {tag_id: points}, or None without an unexpired bundle."""
+        bundle = self.bundle
+        if bundle is None or (bundle["expires"] is not None and time.time() >= bundle["expires"]):
+            return None
+        return bundle["points"]
 
+    def lookup(self, tag_id):
+        with self.lock:
+            entry = self.cache.get((self.match_key, tag_id))
+        if entry is None:
+            return False, None
+        points, expires = entry
+        if time.monotonic() >= expires:
+            self.invalidate(tag_id)
+            return False, None
+        return True, points
+
+    def store(self, tag_id, points, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        with self.lock:
+            self.cache[(self.match_key, tag_id)] = (points, time.monotonic() + ttl)
+
+    def invalidate(self, tag_id=None):
+        with self.lock:
+            if tag_id is None:
+                self.cache.clear()
+            else:
+                self.cache.pop((self.match_key, tag_id), None)
+
+    def ensure_verified(self, sock):
+        if not self.verified and time.monotonic() >= self.next_verify:
+            self.verified = verify_match_key(sock, self.match_key, self.server_url, self.session)
+            self.next_verify = time.monotonic() + self.verify_retry
+        return self.verified
+
+    def fetch_many(self, sock, tag_ids):
+        """Resolves tag_ids over the network, caching hits and negatively caching failures."""
+        if not self.ensure_verified(sock):
+            fetched = None
+        else:
+            start = time.perf_counter()
+            fetched = fetch_points_batch(sock, tag_ids, self.match_key, self.server_url, self.session)
+            metrics.observe("decode", time.perf_counter() - start)
+            metrics.incr("decode_requests")
+            if fetched is None:
+                self.verified = None
+                self.invalidate()
+
+        results = {}
+        for tag_id in tag_ids:
+            if fetched and tag_id in fetched:
+                self.store(tag_id, fetched[tag_id])
+                results[tag_id] = fetched[tag_id]
+            else:
+                self.store(tag_id, None, ttl=self.negative_ttl)
+        return results
+
+    def split_cached(self, tag_ids):
+        points = self.local_points()
+        if points is not None:
+            metrics.incr("decode_local", len(tag_ids))
+            return {tag_id: points.get(tag_id) for tag_id in tag_ids}, []
+        results = {}
+        missing = []
+        for tag_id in tag_ids:
+            hit, points = self.lookup(tag_id)
+            if hit:
+                results[tag_id] = points
+            elif tag_id not in missing:
+                missing.append(tag_id)
+        return results, missing
+
+    def decode_many(self, sock, tag_ids):
+        """Blocking lookup: returns {tag_id: points} for every tag that could be resolved."""
+        results, missing = self.split_cached(tag_ids)
+        if missing:
+            results.update(self.fetch_many(sock, missing))
+        return {tag_id: points for tag_id, points in results.items() if points is not None}
+
+    def decode(self, sock, tag_id):
+        return self.decode_many(sock, [tag_id]).get(tag_id)
+
+    def request(self, sock, tag_ids, callback):
+        """Non-blocking lookup: returns cached points now, calls callback(tag_id, points) later for misses."""
+        results, missing = self.split_cached(tag_ids)
+        with self.lock:
+            missing = [tag_id for tag_id in missing if tag_id not in self.in_flight]
+            self.in_flight.update(missing)
+        if missing:
+            self.executor.submit(self.resolve, sock, missing, callback)
+        return {tag_id: points for tag_id, points in results.items() if points is not None}
+
+    def resolve(self, sock, tag_ids, callback):
+        try:
+            fetched = self.fetch_many(sock, tag_ids)
+        except Exception as e:
+            send_log(sock, f"Background decode failed: {e}", severity=1)
+            fetched = {}
+        finally:
+            with self.lock:
+                self.in_flight.difference_update(tag_ids)
+
+        for tag_id, points in fetched.items():
+            callback(tag_id, points)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+
+def bundle_signature(secret, payload):
+    data = json.dumps(payload, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hmac.new(secret.encode("utf-8"), data, hashlib.sha256).hexdigest()
+
+
+def subscribe_token(secret, match_key, drone):
+    return hmac.new(secret.encode("utf-8"), f"subscribe\n{match_key}\n{drone}".encode("utf-8"),
+                    hashlib.sha256).hexdigest()
+
+
+class MappingSubscriber:
+    """Keeps a TagDecoder loaded with the mapping bundle the decoder server pushes for its match.
+
+    Listens to /subscribe (server-sent events) on a background thread and
+    reconnects after failures. Events with a bad signature, for another match
+    or older than what is installed are ignored; a revocation drops the bundle
+    and decoding falls back to the HTTP path.
+    """
+
+    def __init__(self, sock, decoder, secret, drone_id=1, retry_delay=2.0):
+        self.sock = sock
+        self.decoder = decoder
+        self.secret = secret
+        self.drone_id = drone_id
+        self.retry_delay = retry_delay
+        self.stop = threading.Event()
+        self.response = None
+        self.thread = threading.Thread(target=self.run, name="mapping-subscriber", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stop.is_set():
+            try:
+                if not self.listen():
+                    return
+            except Exception as e:
+                # close() pulls the response out from under a blocked read.
+                if self.stop.is_set():
+                    return
+                send_log(self.sock, f"Mapping push disconnected: {e}", severity=2)  # Warning
+            self.stop.wait(self.retry_delay)
+
+    def listen(self):
+        """Reads one event stream until it ends. Returns False when the server refuses the subscription."""
+        match_key = self.decoder.match_key
+        token = subscribe_token(self.secret, match_key, self.drone_id)
+        headers = {"Authorization": f"Bearer {token}"}
+        r = requests.get(f"{self.decoder.server_url}/subscribe", params={"match_key": match_key, "drone": self.drone_id},
+                         headers=headers, stream=True, timeout=(5, 60), allow_redirects=False)
+        if r.is_redirect:
+            # The server streams from a separate push port; requests would drop the token on the way there.
+            r.close()
+            r = requests.get(requests.compat.urljoin(r.url, r.headers["Location"]), headers=headers, stream=True,
+                             timeout=(5, 60), allow_redirects=False)
+        with r:
+            if r.status_code in (403, 404):
+                send_log(self.sock, f"Mapping push unavailable ({r.status_code}), decoding over HTTP", severity=1)
+                return False
+            r.raise_for_status()
+            self.response = r
+            send_log(self.sock, "Subscribed to mapping push", severity=3)  # Success
+            event, data = None, []
+            for line in r.iter_lines(decode_unicode=True):
+                if self.stop.is_set():
+                    break
+                if not line:
+                    if data:
+                        self.handle(event or "message", "\n".join(data))
+                    event, data = None, []
+                elif line.startswith("event:"):
+                    event = line[6:].strip()
+                elif line.startswith("data:"):
+                    data.append(line[5:].lstrip())
+        return True
+
+    def handle(self, event, data):
+        message = json.loads(data)
+        payload = message.get("payload") or {}
+        if not hmac.compare_digest(str(message.get("signature", "")), bundle_signature(self.secret, payload)):
+            send_log(self.sock, f"Ignoring mapping {event} with a bad signature", severity=1)  # Error
+            return
+        if payload.get("match_key") != self.decoder.match_key:
+            return
+        if event == "mapping":
+            if self.decoder.install_bundle(payload):
+                send_log(self.sock, f"Mapping bundle installed: {len(payload['mapping'])} tags resolved locally",
+                         severity=3)  # Success
+        elif event == "revoke":
+            self.decoder.revoke_bundle(payload.get("revoked", time.time()))
+            send_log(self.sock, f"Mapping for match {payload['match_key']} revoked", severity=2)  # Warning
+
+    def close(self):
+        self.stop.set()
+        if self.response is not None:
+            self.response.close()
+
+
+class CameraModel:
+    """Pinhole model of the downward-facing camera.
+
+    Without explicit intrinsics (fx, fy, cx, cy in pixels) they are derived
+    from the frame size and horizontal field of view. tag_size is the black
+    border edge in meters; when set, detections carry a full pose estimate.
+    """
+
+    def __init__(self, width, height, intrinsics=None, hfov=78.0, tag_size=None, default_altitude=1.0):
+        if intrinsics:
+            self.fx, self.fy, self.cx, self.cy = (float(v) for v in intrinsics)
+        else:
+            self.fx = self.fy = (width / 2.0) / math.tan(math.radians(hfov) / 2.0)
+            self.cx, self.cy = width / 2.0, height / 2.0
+        self.tag_size = tag_size
+        self.default_altitude = default_altitude
+
+    def params(self, x0=0, y0=0):
+        """camera_params for Detector.detect on a crop whose top-left corner is (x0, y0)."""
+        return (self.fx, self.fy, self.cx - x0, self.cy - y0)
+
+
+# Camera frame (x right, y down in the image, z along the optical axis) to the
+# FRD body frame, for a camera looking straight down with the image top
+# towards the nose.
+CAMERA_TO_BODY = ((0.0, -1.0, 0.0),
+                  (1.0, 0.0, 0.0),
+                  (0.0, 0.0, 1.0))
+
+
+def attitude_matrix(roll, pitch, yaw):
+    """Rotation from the FRD body frame to NED for MAVLink ATTITUDE angles (radians)."""
+    cr, sr = math.cos(roll or 0.0), math.sin(roll or 0.0)
+    cp, sp = math.cos(pitch or 0.0), math.sin(pitch or 0.0)
+    cy, sy = math.cos(yaw or 0.0), math.sin(yaw or 0.0)
+    return np.array([[cy * cp, cy * sp * sr - sy * cr, cy * sp * cr + sy * sr],
+                     [sy * cp, sy * sp * sr + cy * cr, sy * sp * cr - cy * sr],
+                     [-sp, cp * sr, cp * cr]])
+
+
+def localize_tags(detections, drone_state, camera):
+    """NED positions of all detections in one frame as an (N, 3) array.
+
+    Detections with a pose estimate (pose_t) use it directly. The rest are
+    back-projected through the camera and intersected with the ground plane
+    (z = 0) at the drone's altitude, or default_altitude while that is unknown.
+    """
+    if not detections:
+        return np.empty((0, 3))
+
+    x, y, z = drone_state["x"] or 0.0, drone_state["y"] or 0.0, drone_state["z"]
+    position = np.array([x, y, z if z is not None else -camera.default_altitude])
+    rotation = attitude_matrix(drone_state["roll"], drone_state["pitch"], drone_state["yaw"]) @ CAMERA_TO_BODY
+
+    posed = np.array([getattr(det, "pose_t", None) is not None for det in detections])
+    offsets = np.empty((len(detections), 3))
+    if posed.any():
+        offsets[posed] = np.stack([det.pose_t.reshape(3) for det, p in zip(detections, posed) if p])
+    if not posed.all():
+        centers = np.array([det.center for det, p in zip(detections, posed) if not p], dtype=float)
+        rays = np.column_stack(((centers[:, 0] - camera.cx) / camera.fx,
+                                (centers[:, 1] - camera.cy) / camera.fy,
+                                np.ones(len(centers))))
+        down = np.maximum(rays @ rotation[2], 1e-3)
+        altitude = max(-position[2], 0.1)
+        offsets[~posed] = rays * (altitude / down)[:, None]
+
+    return position + offsets @ rotation.T
+
+
+def run_stage(sock, name, stop, target, *args):
+    """Runs a pipeline stage and stops the whole pipeline if it crashes."""
     try:
-        while True:
-            update_drone_state(sock, master, drone_state)
-            if drone_state["timestamp"]:
-                sock.sendall((json.dumps(drone_state) + "\n").encode("utf-8"))
-
-            ret, frame = cap.read()
-            if not ret:
-                send_log(sock, "Camera read failed. Reopening camera...", severity=2)
-                cap.release()
-                cap = wait_for_camera(sock)
+        target(*args)
+    except Exception as e:
+        send_log(sock, f"{name} stage failed: {e}", severity=1)
+    finally:
+        profiler.finish()
+        stop.set()
+
+
+class FrameSlot:
+    """One pooled capture buffer plus the grayscale buffer it is converted into."""
+
+    def __init__(self, pool, generation, shape, dtype):
+        self.pool = pool
+        self.generation = generation
+        self.frame = np.empty(shape, dtype)
+        # Gray frames (raw GREY/Y800 cameras) are used as they are.
+        self.gray = self.frame if len(shape) == 2 else np.empty(shape[:2], np.uint8)
+
+    def to_gray(self):
+        if self.frame.ndim == 2:
+            return self.frame
+        if self.frame.shape[2] == 2:
+            # YUYV: luma is every other byte.
+            return cv2.extractChannel(self.frame, 0, dst=self.gray)
+        return cv2.cvtColor(self.frame, cv2.COLOR_BGR2GRAY, dst=self.gray)
+
+    def release(self):
+        self.pool.release(self)
+
+
+class FramePool:
+    """Fixed set of frame buffers passed from capture to the detection workers and back.
+
+    Buffers are only allocated when the frame size changes, so in steady state
+    capture, grayscale conversion and detection reuse the same memory.
+    acquire() returns None when every slot is in use instead of allocating more.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.cond = threading.Condition()
+        self.free = deque()
+        self.shape = None
+        self.generation = 0
+
+    def resize(self, shape, dtype="uint8"):
+        with self.cond:
+            self.generation += 1
+            self.shape = shape
+            slots = [FrameSlot(self, self.generation, shape, dtype) for _ in range(self.size)]
+            self.free = deque(slots)
+            self.cond.notify_all()
+        nbytes = sum(slot.frame.nbytes + (slot.gray.nbytes if slot.gray is not slot.frame else 0) for slot in slots)
+        metrics.incr("frame_allocations", len(slots))
+        metrics.incr("frame_bytes_allocated", nbytes)
+
+    def acquire(self, timeout=None):
+        with self.cond:
+            if not self.free:
+                self.cond.wait(timeout)
+            if not self.free:
+                return None
+            return self.free.popleft()
+
+    def release(self, slot):
+        with self.cond:
+            # Slots from before a resize are left to the garbage collector.
+            if slot.generation == self.generation:
+                self.free.append(slot)
+                self.cond.notify()
+
+
+def capture_loop(sock, cap_holder, reopen, frames, stop, recorder=None, pool=None, governor=None):
+    pool = pool or FramePool(2)
+    slot = None
+    while not stop.is_set():
+        profiler.tick()
+        if governor is not None and not governor.admit(time.monotonic()):
+            # Keep the camera buffer fresh without decoding frames nobody will look at.
+            if cap_holder[0].grab():
+                metrics.incr("frames_skipped")
+                continue
+        if slot is None and pool.shape is not None:
+            slot = pool.acquire(timeout=0.5)
+            if slot is None:
+                metrics.incr("frame_pool_exhausted")
+                continue
+        start = time.perf_counter()
+        ret, frame = cap_holder[0].read(slot.frame if slot is not None else None)
+        metrics.observe("capture", time.perf_counter() - start)
+        if not ret:
+            if isinstance(cap_holder[0], ReplaySource):
+                send_log(sock, "Frame replay finished", severity=3)
+                # Let the detection workers pick up the last frames before shutting down.
+                while len(frames) and not stop.is_set():
+                    time.sleep(0.05)
+                stop.wait(1.0)
+                return
+            send_log(sock, "Camera read failed. Reopening camera...", severity=2)
+            cap_holder[0].release()
+            cap_holder[0] = reopen()
+            continue
+        captured_at = time.monotonic()
+        if slot is None or frame is not slot.frame:
+            # First frame, a new frame size or a source that could not fill the buffer.
+            metrics.incr("frame_allocations")
+            metrics.incr("frame_bytes_allocated", frame.nbytes)
+            if pool.shape != frame.shape:
+                pool.resize(frame.shape, frame.dtype)
+                slot = pool.acquire()
+            np.copyto(slot.frame, frame)
+        metrics.incr("frames_captured")
+        frames.put((slot, captured_at))
+        if recorder is not None:
+            recorder.write_frame(slot.frame)
+        slot = None
+
+
+class TagPriors:
+    """Tags recently seen by adaptive TagDetectors, shared by all detection workers.
+
+    Every worker plans its frame from the same priors, so with several
+    workers each one still sees the tags of every frame, not only of its
+    own. Tags are kept as ground-plane corners, which the next frame's pose
+    projects back into the image whatever the drone did in between.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # tag_id -> (ground corners, time seen, frame number seen)
+        self.tags = {}
+        self.frames = 0
+        self.last_sweep = 0
+        # Time and ground-to-image homography of the newest frame whose tags are in.
+        self.latest = None
+        self.found_last = False
+        # Recent pixel error of the predicted corners, from pose noise and latency.
+        self.error = 0.0
+
+
+def ground_homography(camera, pose):
+    """Homography from ground-plane (z = 0) NED x, y to pixels for the camera at pose."""
+    rotation = attitude_matrix(pose.get("roll"), pose.get("pitch"), pose.get("yaw")) @ CAMERA_TO_BODY
+    z = pose.get("z")
+    position = np.array([pose.get("x") or 0.0, pose.get("y") or 0.0,
+                         z if z is not None else -camera.default_altitude])
+    intrinsics = np.array([[camera.fx, 0.0, camera.cx], [0.0, camera.fy, camera.cy], [0.0, 0.0, 1.0]])
+    return intrinsics @ np.column_stack((rotation.T[:, 0], rotation.T[:, 1], -rotation.T @ position))
+
+
+def apply_homography(homography, points):
+    """Maps (N, 2) points; points that land behind the camera come back as NaN."""
+    mapped = np.column_stack((points, np.ones(len(points)))) @ homography.T
+    scale = np.where(mapped[:, 2] > 1e-9, mapped[:, 2], np.nan)
+    return mapped[:, :2] / scale[:, None]
+
+
+def clip_box(box, w, h):
+    x0, y0, x1, y1 = box
+    return max(x0, 0), max(y0, 0), min(x1, w), min(y1, h)
+
+
+class TagDetector:
+    """AprilTag detector with an optional adaptive region-of-interest mode.
+
+    In "full" mode every frame is a plain full-frame detect. In "adaptive"
+    mode, for frames with a drone pose, known tags are searched for in crops
+    where the pose projects them, and new tags in strips along the frame
+    edges covering the ground the previous frame did not see. When those
+    strips cost more than a decimated full-frame pass (keeping
+    min_tag_pixels per edge of the smallest tracked tag), that pass replaces
+    them. A regular full-frame pass runs without a pose, every
+    sweep_interval frames, when the previous frame found nothing, and when a
+    tracked tag well inside the frame is not where the pose puts it.
+    """
+
+    # Grid spacing in pixels for finding the ground that came into view.
+    ENTRY_GRID = 16
+
+    def __init__(self, mode="full", quad_decimate=2.0, nthreads=1, decode_sharpening=0.25,
+                 coarse_decimate=6.0, sweep_interval=10, roi_margin=0.25, prior_ttl=5, min_tag_pixels=16.0,
+                 priors=None):
+        self.mode = mode
+        self.quad_decimate = quad_decimate
+        self.coarse_decimate = coarse_decimate
+        self.sweep_interval = max(1, sweep_interval)
+        self.roi_margin = roi_margin
+        self.prior_ttl = prior_ttl
+        self.min_tag_pixels = min_tag_pixels
+        self.nthreads = nthreads
+        self.decode_sharpening = decode_sharpening
+        self.detector = self.create(quad_decimate, nthreads)
+        if mode == "adaptive":
+            self.coarse = {}
+            self.fine = self.create(quad_decimate, 1)
+            self.priors = priors if priors is not None else TagPriors()
+
+    def create(self, quad_decimate, nthreads):
+        return apriltags.Detector(families="tag36h11", quad_decimate=quad_decimate, nthreads=nthreads,
+                                  decode_sharpening=self.decode_sharpening)
+
+    def set_quad_decimate(self, value):
+        # pupil_apriltags has no public setter for a live detector, so the detectors are rebuilt.
+        self.quad_decimate = value
+        self.detector = self.create(value, self.nthreads)
+        if self.mode == "adaptive":
+            self.fine = self.create(value, 1)
+
+    @staticmethod
+    def run(detector, gray, camera, x0=0, y0=0):
+        if camera is None or not camera.tag_size:
+            return detector.detect(gray)
+        return detector.detect(gray, estimate_tag_pose=True, camera_params=camera.params(x0, y0),
+                               tag_size=camera.tag_size)
+
+    def detect(self, gray, camera=None, pose=None, at=None):
+        """Detects tags in a frame taken at pose; `at` is its capture time, by default its frame number."""
+        if self.mode != "adaptive" or camera is None or not pose:
+            return self.run(self.detector, gray, camera)
+
+        homography = ground_homography(camera, pose)
+        priors = self.priors
+        with priors.lock:
+            priors.frames += 1
+            frame = priors.frames
+            if at is None:
+                at = frame
+            plan = self.plan(gray.shape[:2], at, frame, homography)
+
+        found = None
+        if plan is not None:
+            found = self.detect_regions(gray, camera, *plan)
+            if not found or any(tag_id not in found for tag_id in plan[2]):
+                found = None
+        detections = list(found.values()) if found is not None else self.run(self.detector, gray, camera)
+
+        with priors.lock:
+            if found is None:
+                priors.last_sweep = frame
+            self.record(detections, at, frame, homography)
+        return detections
+
+    def plan(self, shape, at, frame, homography):
+        """Returns (coarse decimation or None, crop boxes by tag, tags that must be found, strip boxes)
+        for this frame, or None for a full sweep."""
+        priors = self.priors
+        priors.tags = {tag_id: prior for tag_id, prior in priors.tags.items() if frame - prior[2] <= self.prior_ttl}
+        # New tags are searched for on the ground the newest recorded frame did not see, so a frame
+        # still being detected by another worker does not hide the tags it is about to find.
+        previous = priors.latest
+        if (not priors.tags or not priors.found_last or previous is None
+                or frame - priors.last_sweep >= self.sweep_interval):
+            return None
+
+        h, w = shape
+        error = 2 * priors.error + 2
+        crops, expected, edges, extents = {}, [], [], []
+        for tag_id, (ground, _, _) in priors.tags.items():
+            corners = apply_homography(homography, ground)
+            if np.isnan(corners).any():
                 continue
+            edges.append(np.linalg.norm(corners - np.roll(corners, 1, axis=0), axis=1).mean())
+            x0, y0 = corners.min(axis=0)
+            x1, y1 = corners.max(axis=0)
+            extents.append(max(x1 - x0, y1 - y0))
+            if x0 < 0 or y0 < 0 or x1 >= w or y1 >= h:
+                # Outside or cut by the frame edge, where it cannot be decoded anyway.
+                continue
+            pad = extents[-1] * self.roi_margin + error + 8
+            box = (int(x0 - pad), int(y0 - pad), int(x1 + pad) + 1, int(y1 + pad) + 1)
+            crops[tag_id] = box
+            if clip_box(box, w, h) == box:
+                # Well inside the frame, so missing it means the pose prediction broke down.
+                expected.append(tag_id)
+        if not extents:
+            return None
+
+        strips = self.entry_strips(previous[1], homography, w, h, max(extents) + error + 8)
+        # Pick whichever covers the new ground at less cost: the strips at full resolution or a
+        # decimated pass over the whole frame.
+        decimate = float(min(self.coarse_decimate, max(self.quad_decimate, int(min(edges) / self.min_tag_pixels))))
+        strip_area = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in strips)
+        if w * h * (self.quad_decimate / decimate) ** 2 < strip_area:
+            if decimate == self.quad_decimate:
+                return None
+            return decimate, crops, expected, []
+        return None, crops, expected, strips
+
+    def entry_strips(self, previous, homography, w, h, size):
+        """Boxes along the frame edges that hold every tag not fully inside the previous frame."""
+        step = self.ENTRY_GRID
+        xs = np.append(np.arange(0, w - 1, step), w - 1)
+        ys = np.append(np.arange(0, h - 1, step), h - 1)
+        grid = np.stack(np.meshgrid(xs, ys), axis=-1).reshape(-1, 2).astype(float)
+        before = apply_homography(previous @ np.linalg.inv(homography), grid)
+        with np.errstate(invalid="ignore"):
+            # A pixel of slack so rounding in the poses does not turn whole edges new.
+            seen = (before[:, 0] >= -1) & (before[:, 0] <= w) & (before[:, 1] >= -1) & (before[:, 1] <= h)
+        new = grid[~seen]
+        if not len(new):
+            return []
+
+        # Each new point goes to its nearest edge, and the deepest edges are peeled off first so one
+        # strip covers the points it already reaches.
+        distance = np.column_stack((new[:, 0], w - 1 - new[:, 0], new[:, 1], h - 1 - new[:, 1]))
+        nearest = distance.argmin(axis=1)
+        depths = [distance[nearest == edge, edge].max() if (nearest == edge).any() else -1 for edge in range(4)]
+        remaining = np.ones(len(new), dtype=bool)
+        strips = []
+        for edge in np.argsort(depths)[::-1]:
+            mine = remaining & (nearest == edge)
+            if not mine.any():
+                continue
+            depth = int(distance[mine, edge].max() + step + size) + 1
+            remaining &= distance[:, edge] > depth - size
+            strips.append(((0, 0, depth, h), (w - depth, 0, w, h), (0, 0, w, depth), (0, h - depth, w, h))[edge])
+        return [clip_box(box, w, h) for box in strips]
+
+    def detect_regions(self, gray, camera, decimate, crops, expected, strips):
+        h, w = gray.shape[:2]
+        found = {}
+        boxes = list(crops.values()) + strips
+        if decimate is not None:
+            # The decimated pass finds the tags; crops only look for the tracked ones it lost.
+            if decimate not in self.coarse:
+                self.coarse[decimate] = self.create(decimate, self.nthreads)
+            found = {det.tag_id: det for det in self.run(self.coarse[decimate], gray, camera)}
+            boxes = [box for tag_id, box in crops.items() if tag_id not in found]
+
+        refined = {}
+        for box in boxes:
+            x0, y0, x1, y1 = clip_box(box, w, h)
+            if x1 - x0 < 16 or y1 - y0 < 16:
+                continue
+            # Crops keep the full-frame intrinsics with the principal point shifted.
+            for det in self.run(self.fine, np.ascontiguousarray(gray[y0:y1, x0:x1]), camera, x0, y0):
+                det.center = det.center + (x0, y0)
+                det.corners = det.corners + (x0, y0)
+                best = refined.get(det.tag_id)
+                if best is None or det.decision_margin > best.decision_margin:
+                    refined[det.tag_id] = det
+
+        found.update(refined)
+        return found
+
+    def record(self, detections, at, frame, homography):
+        priors = self.priors
+        if priors.latest is None or at >= priors.latest[0]:
+            priors.latest = (at, homography)
+            priors.found_last = bool(detections)
+        inverse = np.linalg.inv(homography)
+        errors = []
+        for det in detections:
+            prior = priors.tags.get(det.tag_id)
+            if prior is not None:
+                if at <= prior[1]:
+                    # A later frame already placed this tag.
+                    continue
+                predicted = apply_homography(homography, prior[0])
+                if not np.isnan(predicted).any():
+                    errors.append(np.abs(det.corners - predicted).max())
+            priors.tags[det.tag_id] = (apply_homography(inverse, det.corners), at, frame)
+        if errors:
+            priors.error = max(max(errors), 0.9 * priors.error)
+
+
+class TagTracker:
+    """Fuses repeated sightings of a tag into one running position estimate.
 
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            detections = at_detector.detect(gray)
+    Sightings are averaged with the detector's decision margin as weight.
+    update() only returns a TAG message on the first sighting, when the
+    estimate moved more than min_move (at most max_rate times a second per
+    tag), or every refresh seconds so Unity sees the growing confidence.
+    """
 
-            for det in detections:
-                tag_id = det.tag_id
-                cx, cy = det.center
-                h, w = gray.shape
+    def __init__(self, min_move=0.25, max_rate=2.0, refresh=5.0):
+        self.min_move = min_move
+        self.min_interval = 1.0 / max_rate if max_rate > 0 else 0.0
+        self.refresh = refresh
+        self.lock = threading.Lock()
+        self.tracks = {}
 
-                nx, ny = cx / w, cy / h
-                rel_x = (nx - 0.5) * 2.0
-                rel_y = (ny - 0.5) * 2.0
+    def update(self, tag_id, x, y, z, weight=1.0, points=None):
+        now = time.monotonic()
+        weight = max(float(weight), 1e-3)
 
-                tag_x = (drone_state["x"] if drone_state["x"] else 0.0) + rel_x
-                tag_y = (drone_state["y"] if drone_state["y"] else 0.0) + rel_y
-                tag_z = 0.0
+        with self.lock:
+            track = self.tracks.get(tag_id)
+            if track is None:
+                track = {"mean": [x, y, z], "m2": 0.0, "weight": 0.0, "sightings": 0,
+                         "points": None, "sent": None, "sent_at": 0.0}
+                self.tracks[tag_id] = track
 
-                try:
-                    points = decode_tag(sock, tag_id, match_key, server_url)
-                except RuntimeError as e:
-                    print(e)
-                    points = 0
+            # Weighted incremental mean/variance (West's algorithm).
+            track["weight"] += weight
+            track["sightings"] += 1
+            mean = track["mean"]
+            delta = [x - mean[0], y - mean[1], z - mean[2]]
+            for i in range(3):
+                mean[i] += delta[i] * weight / track["weight"]
+            track["m2"] += weight * sum(d * (v - m) for d, v, m in zip(delta, (x, y, z), mean))
+            if points is not None:
+                track["points"] = points
 
-                tag_msg = {
-                    "type": "TAG",
-                    "id": tag_id,
-                    "x": float(tag_x),
-                    "y": float(tag_y),
-                    "z": float(tag_z),
-                    "points": points
-                }
-                sock.sendall((json.dumps(tag_msg) + "\n").encode("utf-8"))
+            if track["sent"] is None:
+                return self.emit(tag_id, track, now)
+
+            since = now - track["sent_at"]
+            moved = sum((m - s) ** 2 for m, s in zip(mean, track["sent"])) ** 0.5
+            if (moved >= self.min_move and since >= self.min_interval) or (self.refresh and since >= self.refresh):
+                return self.emit(tag_id, track, now)
+            return None
+
+    def set_points(self, tag_id, points):
+        """Records decoded points and returns the TAG message announcing them."""
+        with self.lock:
+            track = self.tracks.get(tag_id)
+            if track is None or track["points"] == points:
+                return None
+            track["points"] = points
+            return self.emit(tag_id, track, time.monotonic())
+
+    def confidence(self, track):
+        # Grows with the number of sightings and shrinks with their spread.
+        n = track["sightings"]
+        stderr = (track["m2"] / track["weight"] / n) ** 0.5
+        return (n / (n + 2.0)) / (1.0 + stderr)
+
+    def emit(self, tag_id, track, now):
+        track["sent"] = list(track["mean"])
+        track["sent_at"] = now
+        x, y, z = track["mean"]
+        return {
+            "type": "TAG",
+            "id": tag_id,
+            "x": float(x),
+            "y": float(y),
+            "z": float(z),
+            "points": track["points"],
+            "sightings": track["sightings"],
+            "confidence": round(self.confidence(track), 3)
+        }
+
+
+def send_decoded_update(sock, tracker, tag_id, points, trace=None):
+    """Re-sends the TAG message of tag_id once its points are known.
+
+    trace holds the stamps of the frame that asked for the points; the
+    decode stamp is taken here, when they arrived.
+    """
+    msg = tracker.set_points(tag_id, points)
+    if msg is not None:
+        if trace is not None:
+            msg["trace"] = dict(trace, decode=time.monotonic_ns())
+        send_message(sock, msg)
+
+
+def detection_loop(sock, frames, drone_state, state_lock, poses, decoder, tracker, on_decoded, detector_options,
+                   camera_options, stop, governor=None, trace=False):
+    """Detects tags in queued frames and sends their tracked positions.
+
+    With trace set, TAG messages carry time.monotonic_ns() stamps of the frame
+    capture, the end of detection, the moment the tag's points were known
+    (only when they were cached; TAG updates for points fetched later carry
+    their own decode stamp) and the end of localization.
+    """
+    at_detector = TagDetector(**detector_options)
+    camera = None
+
+    while not stop.is_set():
+        profiler.tick()
+        item = frames.get(timeout=0.5)
+        if item is None:
+            continue
+        slot, captured_at = item
+        if governor is not None and governor.decimate != at_detector.quad_decimate:
+            at_detector.set_quad_decimate(governor.decimate)
+
+        # Use the pose at capture time, not whatever arrived while the frame was queued and processed.
+        pose = poses.at(captured_at)
+        start = time.perf_counter()
+        try:
+            gray = slot.to_gray()
+            if camera is None:
+                camera = CameraModel(gray.shape[1], gray.shape[0], **camera_options)
+            converted = time.perf_counter()
+            detections = at_detector.detect(gray, camera, pose, captured_at)
+        finally:
+            slot.release()
+        detected_at = time.monotonic_ns()
+        metrics.observe("gray", converted - start)
+        metrics.observe("detect", time.perf_counter() - converted)
+        metrics.incr("frames_processed")
+        if not detections:
+            continue
+        metrics.incr("tags_detected", len(detections))
+
+        with state_lock:
+            state = dict(drone_state)
+        if pose:
+            state.update(pose)
+
+        frame_trace = {"capture": int(captured_at * 1e9), "detect": detected_at} if trace else None
+        callback = functools.partial(on_decoded, trace=frame_trace) if trace else on_decoded
+        decoded = decoder.request(sock, [det.tag_id for det in detections], callback)
+        decoded_at = time.monotonic_ns()
+
+        start = time.perf_counter()
+        positions = localize_tags(detections, state, camera).tolist()
+        metrics.observe("localize", time.perf_counter() - start)
+        localized_at = time.monotonic_ns()
+
+        for det, (tag_x, tag_y, tag_z) in zip(detections, positions):
+            tag_id = det.tag_id
+            tag_msg = tracker.update(tag_id, tag_x, tag_y, tag_z, det.decision_margin, decoded.get(tag_id))
+            if tag_msg is not None:
+                if trace:
+                    tag_msg["trace"] = dict(frame_trace, localize=localized_at)
+                    if tag_id in decoded:
+                        tag_msg["trace"]["decode"] = decoded_at
+                send_message(sock, tag_msg)
+
+
+class FrameRateGovernor:
+    """Picks the detection frame rate and quad_decimate from drone motion, CPU load and detect latency.
+
+    A tag should stay in view for `sightings` frames while the drone crosses
+    it, so the wanted rate grows with ground speed and shrinks with altitude.
+    A grounded or hovering drone drops to min_fps. Decimation is the largest
+    step that still leaves a tag of tag_size meters min_tag_px wide after
+    decimating. The rate is then capped by the CPU budget (percent of all
+    cores) and by what the detection workers sustain at the measured detect
+    latency. Only when the budget is still exceeded at min_fps does the
+    decimation go past the resolution limit. Capture asks admit() for every
+    camera frame; frames it turns down are grabbed but never decoded.
+    """
+
+    DECIMATE_STEPS = (1.0, 1.5, 2.0, 3.0, 4.0)
+
+    def __init__(self, min_fps=2.0, max_fps=30.0, cpu_target=75.0, workers=1, quad_decimate=2.0,
+                 camera_options=None, tag_size=0.4, sightings=5.0, min_tag_px=10.0, interval=1.0):
+        self.min_fps = min_fps
+        self.max_fps = max(max_fps, min_fps)
+        self.cpu_target = cpu_target
+        self.workers = workers
+        self.camera_options = camera_options or {}
+        self.tag_size = self.camera_options.get("tag_size") or tag_size
+        self.sightings = sightings
+        self.min_tag_px = min_tag_px
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.fps = self.max_fps
+        self.decimate = quad_decimate
+        self.cpu_cap = self.max_fps
+        self.camera = None
+        self.next_due = None
+        self.last = (time.monotonic(), time.process_time())
+        self.detect_seen = (0.0, 0)
+        self.state = {}
+
+    def admit(self, now):
+        with self.lock:
+            period = 1.0 / self.fps
+            if self.next_due is not None and now < self.next_due:
+                return False
+            # Carry the remainder so the average rate holds between discrete camera frames.
+            catch_up = self.next_due is not None and now - self.next_due < period
+            self.next_due = (self.next_due if catch_up else now) + period
+            return True
+
+    def measure(self):
+        """CPU percent of all cores and mean detect seconds per frame since the last call."""
+        wall, cpu = time.monotonic(), time.process_time()
+        elapsed = max(wall - self.last[0], 1e-6)
+        cpu_percent = 100.0 * (cpu - self.last[1]) / elapsed / (os.cpu_count() or 1)
+        self.last = (wall, cpu)
+        hist = metrics.snapshot()[2].get("detect")
+        detect = None
+        if hist is not None:
+            frames = hist["count"] - self.detect_seen[1]
+            if frames:
+                detect = (hist["sum"] - self.detect_seen[0]) / frames
+            self.detect_seen = (hist["sum"], hist["count"])
+        return cpu_percent, detect
+
+    def update(self, pose, armed, frame_shape):
+        """Re-plans from the latest pose; returns the reason when fps or decimation changed, else None."""
+        cpu_percent, detect = self.measure()
+        if self.camera is None and frame_shape is not None:
+            self.camera = CameraModel(frame_shape[1], frame_shape[0], **self.camera_options)
+
+        z = pose.get("z") if pose else None
+        altitude = -z if z is not None else None
+        speed = math.hypot(pose["vx"], pose["vy"]) if pose and pose.get("vx") is not None else None
+
+        reason = "motion"
+        decimate = self.decimate
+        if altitude is None or speed is None or self.camera is None:
+            wanted, reason = self.max_fps, "no telemetry"
+        elif armed is False or altitude < 0.5:
+            wanted, reason = self.min_fps, "grounded"
+        else:
+            footprint = altitude * frame_shape[0] / self.camera.fy
+            wanted = self.sightings * speed / footprint
+            tag_px = self.tag_size * self.camera.fx / altitude
+            decimate = max([step for step in self.DECIMATE_STEPS if tag_px / step >= self.min_tag_px], default=1.0)
+
+        if cpu_percent > self.cpu_target:
+            self.cpu_cap = max(self.min_fps, min(self.cpu_cap, self.fps) * self.cpu_target / cpu_percent)
+        elif cpu_percent < 0.8 * self.cpu_target:
+            self.cpu_cap = min(self.max_fps, self.cpu_cap * 1.25)
+        fps = min(wanted, self.cpu_cap)
+        if fps < wanted:
+            reason = "cpu"
+        if detect:
+            sustainable = 0.9 * self.workers / detect
+            if sustainable < fps:
+                fps, reason = sustainable, "latency"
+        fps = min(max(fps, self.min_fps), self.max_fps)
+        if fps <= self.min_fps and cpu_percent > self.cpu_target and reason != "grounded":
+            steps = [step for step in self.DECIMATE_STEPS if step > decimate]
+            if steps:
+                decimate, reason = steps[0], "cpu"
+
+        with self.lock:
+            changed = abs(fps - self.fps) > 0.15 * self.fps or decimate != self.decimate
+            self.fps = fps
+            self.decimate = decimate
+            self.state = {"fps": round(fps, 2), "quad_decimate": decimate, "reason": reason,
+                          "speed": None if speed is None else round(speed, 2),
+                          "altitude": None if altitude is None else round(altitude, 2),
+                          "cpu_percent": round(cpu_percent, 1),
+                          "detect_ms": None if detect is None else round(detect * 1000.0, 2)}
+        return reason if changed else None
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.state)
+
+
+def governor_loop(sock, governor, drone_state, state_lock, poses, pool, stop):
+    while not stop.wait(governor.interval):
+        profiler.tick()
+        with state_lock:
+            pose = {name: drone_state[name] for name in ("z", "armed")}
+        # Velocities only come through the pose buffer.
+        pose.update(poses.at(time.monotonic()) or {})
+        reason = governor.update(pose, pose.get("armed"), pool.shape)
+        if reason:
+            state = governor.snapshot()
+            metrics.incr("governor_changes")
+            send_log(sock, f"Governor: {state['fps']:.1f} fps, quad_decimate {state['quad_decimate']:g} ({reason}; "
+                           f"speed {state['speed']} m/s, altitude {state['altitude']} m, "
+                           f"CPU {state['cpu_percent']:.0f}%, detect {state['detect_ms']} ms)", severity=3)
+
+
+def telemetry_loop(sock, master, inbox, drone_state, state_lock, rate, stop, trace=False):
+    """Sends the drone state rate times a second.
+
+    With trace set, DRONE messages carry the time.monotonic_ns() at which the
+    newest pose sample (LOCAL_POSITION_NED or ATTITUDE) was read as "capture".
+    """
+    period = 1.0 / rate
+    next_tick = time.monotonic()
+
+    while not stop.is_set():
+        profiler.tick()
+        start = time.perf_counter()
+        with state_lock:
+            update_drone_state(sock, master, drone_state, inbox)
+            state = dict(drone_state) if drone_state["timestamp"] else None
+            # STATUSTEXT messages are sent once instead of piling up in every DRONE message.
+            drone_state["messages"] = []
+        metrics.observe("telemetry", time.perf_counter() - start)
+        if state:
+            if trace:
+                read_at = [inbox.read_at[mtype] for mtype in ("LOCAL_POSITION_NED", "ATTITUDE")
+                           if mtype in inbox.read_at]
+                state["trace"] = {"capture": max(read_at)} if read_at else {}
+            send_message(sock, state)
+
+        next_tick = max(next_tick + period, time.monotonic())
+        stop.wait(max(0.0, next_tick - time.monotonic()))
+
+
+def main(unity_host, unity_port, match_key, server_url, detector_threads=1, telemetry_rate=10.0,
+         mavlink_mode="drain", decode_ttl=300.0, decode_workers=2, tag_min_move=0.25, tag_max_rate=2.0,
+         tag_refresh=5.0, detector_options=None, source_options=None, wire_mode="json", metrics_port=None,
+         metrics_interval=5.0, profile=False, profile_dir="profiles", camera_options=None, record_options=None,
+         drone_id=1, sim_options=None, mavlink_endpoint="udp:0.0.0.0:14550", bundle_secret=None,
+         governor_options=None, trace=False):
+    profiler.out_dir = profile_dir
+    profiler.active = profile
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, profiler.toggle)
+
+    # Connects in the background: the heartbeat wait, opening the camera and the decoder check
+    # run alongside it and each other instead of one after another.
+    recorder = MatchRecorder(**record_options) if record_options else None
+    sock = UnityWriter(None, unity_host, unity_port, wire_mode, recorder=recorder)
+    source_options = dict(source_options or {})
+    simulated = None
+    if sim_options:
+        sim_options = dict(sim_options)
+        field = TagField(sim_options.pop("layout", None))
+        clock = SimClock()
+        simulated = SimulatedDrone(field=field, **sim_options)
+        source_options["simulator"] = {"drone": simulated, "field": field, "clock": clock,
+                                       "hfov": (camera_options or {}).get("hfov", 78.0)}
+        send_log(sock, f"Simulating a drone flying {sim_options.get('trajectory')}", severity=2)
+    startup = ThreadPoolExecutor(max_workers=3, thread_name_prefix="startup")
+    pending_master = None if simulated else startup.submit(create_master, sock, mavlink_endpoint)
+    reopen = functools.partial(open_frame_source, sock, **source_options)
+    pending_source = startup.submit(reopen)
+    decoder = TagDecoder(match_key, server_url, ttl=decode_ttl, pool_size=max(1, detector_threads),
+                         workers=decode_workers)
+    subscriber = MappingSubscriber(sock, decoder, bundle_secret, drone_id).start() if bundle_secret else None
+    startup.submit(decoder.decode, sock, 1)
+    startup.shutdown(wait=False)
+    cap_holder = [None]
+
+    master = None
+    drone_state = init_drone_state(id_val=drone_id)
+    state_lock = threading.Lock()
+    poses = PoseBuffer()
+    inbox = MavlinkInbox(threaded=(mavlink_mode == "thread"), poses=poses, recorder=recorder)
+
+    # One slot being captured, one queued and one in detection per worker, plus a spare.
+    pool = FramePool(2 * max(1, detector_threads) + 2)
+    frames = LatestQueue(maxsize=max(1, detector_threads), on_drop=lambda item: item[0].release())
+    tracker = TagTracker(min_move=tag_min_move, max_rate=tag_max_rate, refresh=tag_refresh)
+    on_decoded = functools.partial(send_decoded_update, sock, tracker)
+    stop = threading.Event()
+    governor = None
+    if governor_options:
+        governor = FrameRateGovernor(workers=max(1, detector_threads),
+                                     quad_decimate=(detector_options or {}).get("quad_decimate", 2.0),
+                                     camera_options=camera_options, **governor_options)
+
+    vision_stages = [("capture", capture_loop, sock, cap_holder, reopen, frames, stop, recorder, pool, governor)]
+    if governor:
+        vision_stages.append(("governor", governor_loop, sock, governor, drone_state, state_lock, poses, pool, stop))
+    detector_options = dict(detector_options or {})
+    if detector_options.get("mode") == "adaptive":
+        # One set of priors for all workers, so each sees the tags found in every frame.
+        detector_options["priors"] = TagPriors()
+    for i in range(detector_threads):
+        vision_stages.append((f"detection-{i}", detection_loop, sock, frames, drone_state, state_lock, poses,
+                              decoder, tracker, on_decoded, detector_options, camera_options or {}, stop,
+                              governor, trace))
+
+    metrics_server = start_metrics_server(metrics_port, sock, inbox, governor=governor) if metrics_port else None
+
+    threads = []
+
+    def start_stages(stages):
+        for name, target, *args in stages:
+            t = threading.Thread(target=run_stage, args=(sock, name, stop, target, *args), name=name, daemon=True)
+            t.start()
+            threads.append(t)
+
+    try:
+        # Telemetry starts as soon as the flight controller answers, even while the camera is still
+        # opening. Detection waits for both, otherwise the first tags would be placed relative to an
+        # unknown pose.
+        master = SimulatedMaster(simulated, clock) if simulated else pending_master.result()
+        inbox.threaded = inbox.threaded and master is not None
+        stages = [("telemetry", telemetry_loop, sock, master, inbox, drone_state, state_lock, telemetry_rate, stop,
+                   trace)]
+        if inbox.threaded:
+            stages.append(("mavlink", mavlink_reader_loop, master, inbox, stop))
+        if metrics_interval > 0:
+            stages.append(("metrics", metrics_loop, sock, inbox, metrics_interval, stop, governor))
+        start_stages(stages)
+        cap_holder[0] = pending_source.result()
+        start_stages(vision_stages)
 
-            time.sleep(0.5)
+        while not stop.is_set():
+            profiler.tick()
+            stop.wait(0.5)
 
     except KeyboardInterrupt:
         print("Stopping...")
     finally:
-        cap.release()
+        stop.set()
+        profiler.active = False
+        for t in threads:
+            t.join(timeout=2)
+        profiler.finish()
+        if metrics_server:
+            metrics_server.shutdown()
+        for mtype, counts in sorted(inbox.counters().items()):
+            print(f"MAVLink {mtype}: received {counts['received']}, coalesced {counts['dropped']}")
+        if cap_holder[0] is not None:
+            cap_holder[0].release()
+        if subscriber:
+            subscriber.close()
+        decoder.close()
         sock.close()
+        print(f"Unity writer: {sock.stats()}")
+        counters = metrics.snapshot()[1]
+        print(f"Frame buffers: {counters.get('frame_allocations', 0)} allocations, "
+              f"{counters.get('frame_bytes_allocated', 0) / 1e6:.1f} MB for {counters.get('frames_captured', 0)} frames")
+        if recorder:
+            recorder.close()
+            print(f"Recorded {recorder.records} records to {recorder.path}")
         try:
             if master:
                 master.close()
@@ -260,7 +2702,105 @@ if __name__ == "__main__":
     parser.add_argument("--host", type=str, required=True, help="Unity server IP")
     parser.add_argument("--port", type=int, required=True, help="Unity server port")
     parser.add_argument("--match", type=str, required=True, help="Match key for server decoding")
+    parser.add_argument("--drone-id", type=int, default=1,
+                        help="Drone ID in DRONE messages; a drone_gateway.py may reassign it on conflicts (default: 1)")
     parser.add_argument("--server", type=str, required=True, help="Backend server URL (e.g., http://127.0.0.1:5000)")
+    parser.add_argument("--detector-threads", type=int, default=1, help="Number of AprilTag detection workers (default: 1)")
+    parser.add_argument("--telemetry-rate", type=float, default=10.0, help="Drone state send rate in Hz (default: 10)")
+    parser.add_argument("--mavlink", type=str, default="udp:0.0.0.0:14550",
+                        help="pymavlink connection string for the flight controller, e.g. a mavlink_generator.py "
+                             "target (default: udp:0.0.0.0:14550)")
+    parser.add_argument("--mavlink-mode", choices=["drain", "thread"], default="drain",
+                        help="Drain the MAVLink buffer every telemetry tick or read it on a dedicated thread (default: drain)")
+    parser.add_argument("--decode-ttl", type=float, default=300.0,
+                        help="Seconds to cache decoded tag points before asking the server again (default: 300)")
+    parser.add_argument("--bundle-secret", type=str, default=os.environ.get("DECODER_BUNDLE_SECRET"),
+                        help="Secret shared with decoder_server.py; subscribes to the pushed mapping bundle so tags "
+                             "resolve locally (default: $DECODER_BUNDLE_SECRET)")
+    parser.add_argument("--decode-workers", type=int, default=2,
+                        help="Background threads resolving tag points (default: 2)")
+    parser.add_argument("--tag-min-move", type=float, default=0.25,
+                        help="Re-send a tag when its estimate moves this far in meters (default: 0.25)")
+    parser.add_argument("--tag-max-rate", type=float, default=2.0,
+                        help="Maximum TAG messages per second for a single tag (default: 2)")
+    parser.add_argument("--tag-refresh", type=float, default=5.0,
+                        help="Re-send a tracked tag at least every N seconds while in view, 0 to disable (default: 5)")
+    parser.add_argument("--detect-mode", choices=["full", "adaptive"], default="full",
+                        help="Full-frame detection, or detection only where telemetry puts known tags and newly "
+                             "visible ground, with periodic full-frame sweeps (default: full)")
+    parser.add_argument("--quad-decimate", type=float, default=2.0, help="AprilTag quad_decimate (default: 2.0)")
+    parser.add_argument("--apriltag-nthreads", type=int, default=1,
+                        help="Threads used inside each AprilTag detector (default: 1)")
+    parser.add_argument("--decode-sharpening", type=float, default=0.25, help="AprilTag decode_sharpening (default: 0.25)")
+    parser.add_argument("--sweep-interval", type=int, default=10,
+                        help="In adaptive mode, run a full-frame sweep every N frames (default: 10)")
+    parser.add_argument("--governor", action="store_true",
+                        help="Adapt detection FPS and quad_decimate to drone speed, altitude, CPU load and detect latency")
+    parser.add_argument("--min-fps", type=float, default=2.0, help="Governor: lowest detection rate (default: 2)")
+    parser.add_argument("--max-fps", type=float, default=30.0, help="Governor: highest detection rate (default: 30)")
+    parser.add_argument("--cpu-target", type=float, default=75.0,
+                        help="Governor: CPU budget in percent of all cores (default: 75)")
+    parser.add_argument("--camera-intrinsics", type=float, nargs=4, metavar=("FX", "FY", "CX", "CY"),
+                        help="Calibrated camera intrinsics in pixels (default: derived from --camera-hfov)")
+    parser.add_argument("--camera-hfov", type=float, default=78.0,
+                        help="Horizontal field of view in degrees when no intrinsics are given (default: 78)")
+    parser.add_argument("--tag-size", type=float,
+                        help="Tag edge length in meters; enables pose estimation instead of ground-plane projection")
+    parser.add_argument("--source", type=str,
+                        help="Frame source: camera[:index], video:path, images:dir, synthetic[:tags] or sim "
+                             "(default: sim with --simulate, else camera:0)")
+    parser.add_argument("--replay-rate", type=str, default="realtime",
+                        help="Replay pacing for non-camera sources: realtime, max or a fixed FPS (default: realtime)")
+    parser.add_argument("--loop", action="store_true", help="Restart video/image replay when it reaches the end")
+    parser.add_argument("--capture-width", type=int, help="Requested capture width in pixels")
+    parser.add_argument("--capture-height", type=int, help="Requested capture height in pixels")
+    parser.add_argument("--capture-fps", type=float, help="Requested camera FPS, or native FPS of image/synthetic replay")
+    parser.add_argument("--capture-gray", action="store_true",
+                        help="Ask the camera for raw GREY/YUYV output and detect on its luma without a BGR conversion")
+    parser.add_argument("--capture-buffer", type=int, help="Camera driver buffer size in frames")
+    parser.add_argument("--wire", choices=["json", "compact", "auto"], default="json",
+                        help="Unity message encoding; auto negotiates compact and falls back to json (default: json)")
+    parser.add_argument("--trace", action="store_true",
+                        help="Add monotonic capture/detect/decode/localize/send timestamps to DRONE and TAG messages, "
+                             "for unity_standin.py latency reports (these go out as JSON records in compact mode)")
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--metrics-interval", type=float, default=5.0,
+                        help="Seconds between METRICS messages to Unity, 0 to disable (default: 5)")
+    parser.add_argument("--profile", action="store_true",
+                        help="Capture a cProfile of every pipeline thread from startup (SIGUSR1 toggles it at runtime)")
+    parser.add_argument("--profile-dir", type=str, default="profiles", help="Where profile dumps are written (default: profiles)")
+    parser.add_argument("--simulate", type=str, metavar="TRAJECTORY",
+                        help="Fly a simulated drone instead of MAVLink: hover, circle[:radius], lawnmower[:spacing], "
+                             "random[:seed] or waypoints:file.json")
+    parser.add_argument("--sim-layout", type=str, help="JSON tag layout for the simulated field (default: grid of Tags/)")
+    parser.add_argument("--sim-speed", type=float, default=3.0, help="Simulated ground speed in m/s (default: 3)")
+    parser.add_argument("--sim-altitude", type=float, default=8.0, help="Simulated altitude in meters (default: 8)")
+    parser.add_argument("--record", type=str, help="Append every message sent to Unity to this recording file")
+    parser.add_argument("--record-mavlink", action="store_true", help="Also record the raw MAVLink stream")
+    parser.add_argument("--record-video", action="store_true", help="Also record the camera frames to a .avi next to it")
 
     args = parser.parse_args()
-    main(args.host, args.port, args.match, args.server)
+    main(args.host, args.port, args.match, args.server,
+         detector_threads=max(1, args.detector_threads), telemetry_rate=args.telemetry_rate,
+         mavlink_mode=args.mavlink_mode, decode_ttl=args.decode_ttl,
+         decode_workers=max(1, args.decode_workers), tag_min_move=args.tag_min_move,
+         tag_max_rate=args.tag_max_rate, tag_refresh=args.tag_refresh,
+         detector_options={"mode": args.detect_mode, "quad_decimate": args.quad_decimate,
+                           "nthreads": args.apriltag_nthreads, "decode_sharpening": args.decode_sharpening,
+                           "sweep_interval": args.sweep_interval},
+         source_options={"source": args.source or ("sim" if args.simulate else "camera:0"),
+                         "rate": args.replay_rate, "loop": args.loop, "width": args.capture_width,
+                         "height": args.capture_height, "fps": args.capture_fps, "buffer_size": args.capture_buffer,
+                         "gray": args.capture_gray},
+         wire_mode=args.wire, metrics_port=args.metrics_port, metrics_interval=args.metrics_interval,
+         profile=args.profile, profile_dir=args.profile_dir,
+         camera_options={"intrinsics": args.camera_intrinsics, "hfov": args.camera_hfov, "tag_size": args.tag_size},
+         record_options={"path": args.record, "mavlink": args.record_mavlink, "video": args.record_video}
+         if args.record else None,
+         drone_id=args.drone_id,
+         sim_options={"trajectory": args.simulate, "layout": args.sim_layout, "speed": args.sim_speed,
+                      "altitude": args.sim_altitude} if args.simulate else None,
+         mavlink_endpoint=args.mavlink, bundle_secret=args.bundle_secret,
+         governor_options={"min_fps": args.min_fps, "max_fps": args.max_fps,
+                           "cpu_target": args.cpu_target} if args.governor else None,
+         trace=args.trace)
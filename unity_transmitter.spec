@@ -6,7 +6,8 @@ a = Analysis(
     pathex=[],
     binaries=[('C:\\Users\\Administrator\\AppData\\Local\\Programs\\Python\\Python313\\Lib\\site-packages\\pupil_apriltags\\lib\\*.dll', 'pupil_apriltags/lib')],
     datas=[],
-    hiddenimports=[],
+    # Imported lazily through importlib, which the analysis cannot follow.
+    hiddenimports=['cv2', 'numpy', 'requests', 'pupil_apriltags', 'pymavlink.mavutil'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
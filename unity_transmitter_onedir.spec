@@ -0,0 +1,49 @@
+# -*- mode: python ; coding: utf-8 -*-
+# Startup-optimized build: a folder instead of a single EXE, so nothing is
+# extracted to a temp directory on every launch, and no UPX, so the DLLs do
+# not have to be decompressed when they load.
+# Build with: pyinstaller unity_transmitter_onedir.spec  ->  dist/unity_transmitter/unity_transmitter.exe
+
+
+a = Analysis(
+    ['unity_transmitter.py'],
+    pathex=[],
+    binaries=[('C:\\Users\\Administrator\\AppData\\Local\\Programs\\Python\\Python313\\Lib\\site-packages\\pupil_apriltags\\lib\\*.dll', 'pupil_apriltags/lib')],
+    datas=[],
+    # Imported lazily through importlib, which the analysis cannot follow.
+    hiddenimports=['cv2', 'numpy', 'requests', 'pupil_apriltags', 'pymavlink.mavutil'],
+    hookspath=[],
+    hooksconfig={},
+    runtime_hooks=[],
+    excludes=[],
+    noarchive=False,
+    optimize=0,
+)
+pyz = PYZ(a.pure)
+
+exe = EXE(
+    pyz,
+    a.scripts,
+    [],
+    exclude_binaries=True,
+    name='unity_transmitter',
+    debug=False,
+    bootloader_ignore_signals=False,
+    strip=False,
+    upx=False,
+    console=True,
+    disable_windowed_traceback=False,
+    argv_emulation=False,
+    target_arch=None,
+    codesign_identity=None,
+    entitlements_file=None,
+)
+coll = COLLECT(
+    exe,
+    a.binaries,
+    a.datas,
+    strip=False,
+    upx=False,
+    upx_exclude=[],
+    name='unity_transmitter',
+)